@@ -4,7 +4,7 @@ Audio Analysis Script for Strudel Composer
 Extracts musical features from reference tracks to guide composition.
 
 Usage:
-    python analyze_audio.py <audio_file> [--output-dir OUTPUT_DIR]
+    python analyze_audio.py <audio_file> [--output-dir OUTPUT_DIR] [--stream] [--profile]
 
 Outputs:
     - JSON file with extracted features
@@ -23,11 +23,27 @@ import librosa.display
 import matplotlib.pyplot as plt
 import numpy as np
 
+# Shared analysis modules live in scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+import key_detection  # noqa: E402
+import streaming  # noqa: E402
+import tempo  # noqa: E402
+from beat_features import beat_features_from_frames, drum_energy  # noqa: E402
+from feature_plan import Node, block_extractor, format_report, run_plan  # noqa: E402
+from structure import detect_sections  # noqa: E402
 
-# Krumhansl-Schmuckler key profiles for key detection
-MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
-PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+# Frequency bands for the balance report (Hz)
+FREQUENCY_BANDS = {
+    'sub_bass': (20, 60),
+    'bass': (60, 250),
+    'low_mids': (250, 500),
+    'mids': (500, 2000),
+    'high_mids': (2000, 4000),
+    'highs': (4000, 20000)
+}
+
+# Time columns kept for the plots of streamed (long) files
+PLOT_COLUMNS = 4000
 
 
 def detect_key(y, sr):
@@ -35,67 +51,36 @@ def detect_key(y, sr):
     Detect the musical key using Krumhansl-Schmuckler algorithm.
     Returns: (key_name, mode, correlation_score)
     """
-    # Separate harmonic component for cleaner pitch analysis
-    y_harmonic = librosa.effects.harmonic(y)
-    
-    # Compute chromagram
-    chroma = librosa.feature.chroma_cqt(y=y_harmonic, sr=sr)
-    chroma_mean = np.mean(chroma, axis=1)
-    
-    # Normalize
-    chroma_mean = chroma_mean / np.sum(chroma_mean)
-    
-    best_corr = -1
-    best_key = 'C'
-    best_mode = 'major'
-    
-    for i, pitch in enumerate(PITCH_CLASSES):
-        # Rotate profiles to test each key
-        major_rotated = np.roll(MAJOR_PROFILE, -i)
-        minor_rotated = np.roll(MINOR_PROFILE, -i)
-        
-        # Normalize profiles
-        major_norm = major_rotated / np.sum(major_rotated)
-        minor_norm = minor_rotated / np.sum(minor_rotated)
-        
-        # Calculate correlation
-        major_corr = np.corrcoef(chroma_mean, major_norm)[0, 1]
-        minor_corr = np.corrcoef(chroma_mean, minor_norm)[0, 1]
-        
-        if major_corr > best_corr:
-            best_corr = major_corr
-            best_key = pitch
-            best_mode = 'major'
-        
-        if minor_corr > best_corr:
-            best_corr = minor_corr
-            best_key = pitch
-            best_mode = 'minor'
-    
-    return best_key, best_mode, best_corr
-
-
-def analyze_rhythm(y, sr):
+    # Harmonic component + chromagram, correlated against all 24 key profiles at once
+    return key_detection.estimate_key(key_detection.harmonic_chroma(y, sr))
+
+
+def analyze_rhythm(y, sr, audio_path=None):
     """
     Analyze rhythmic characteristics.
     Returns dict with tempo, beat positions, rhythm density.
     """
-    # Get tempo and beats
-    tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+    # Get tempo and beats (shared tempo module; cached per track when audio_path is given)
+    grid = tempo.track_beats(audio_path, y=y, sr=sr)
     
-    # Onset detection for rhythm density
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    # Onset detection for rhythm density, on the envelope the beat tracker already computed
+    onset_env = tempo.onset_envelope(y, sr, audio_path=audio_path)
+    return summarize_rhythm(grid, onset_env, sr, librosa.get_duration(y=y, sr=sr))
+
+
+def summarize_rhythm(grid, onset_env, sr, duration):
+    """Rhythm dict from a beat grid and the onset envelope it was tracked on."""
+    beat_times = np.asarray(grid.beats)
     onsets = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr)
     onset_times = librosa.frames_to_time(onsets, sr=sr)
     
     # Calculate rhythm density (onsets per beat)
-    duration = librosa.get_duration(y=y, sr=sr)
     num_beats = len(beat_times)
     onsets_per_beat = len(onset_times) / max(num_beats, 1)
     
     return {
-        'tempo_bpm': float(tempo) if np.isscalar(tempo) else float(tempo[0]),
+        'tempo_bpm': grid.bpm,
+        'beat_confidence': grid.confidence,
         'num_beats': num_beats,
         'duration_seconds': duration,
         'onsets_per_beat': onsets_per_beat,
@@ -108,26 +93,27 @@ def analyze_frequency_balance(y, sr):
     Analyze frequency distribution across bands.
     Returns dict with energy in each frequency band.
     """
-    # Compute spectrogram
-    S = np.abs(librosa.stft(y))
+    return summarize_frequency_balance(frequency_band_frames(y, sr).sum(axis=1))
+
+
+def frequency_band_frames(y, sr, S=None):
+    """
+    Spectral magnitude per frame in each of FREQUENCY_BANDS, plus the total
+    over all bins as the last row. S is the magnitude STFT of y, if already computed.
+    """
+    if S is None:
+        S = np.abs(librosa.stft(y))
     freqs = librosa.fft_frequencies(sr=sr)
-    
-    # Define frequency bands
-    bands = {
-        'sub_bass': (20, 60),
-        'bass': (60, 250),
-        'low_mids': (250, 500),
-        'mids': (500, 2000),
-        'high_mids': (2000, 4000),
-        'highs': (4000, 20000)
-    }
-    
-    total_energy = np.sum(S)
+    rows = [S[(freqs >= low) & (freqs < high)].sum(axis=0) for low, high in FREQUENCY_BANDS.values()]
+    return np.vstack(rows + [S.sum(axis=0)])
+
+
+def summarize_frequency_balance(sums):
+    """Band percentages and overall character from frequency_band_frames summed over time."""
+    total_energy = sums[-1]
     band_energy = {}
     
-    for band_name, (low, high) in bands.items():
-        mask = (freqs >= low) & (freqs < high)
-        energy = np.sum(S[mask, :])
+    for band_name, energy in zip(FREQUENCY_BANDS, sums[:-1]):
         band_energy[band_name] = float(energy / total_energy * 100)  # percentage
     
     # Determine overall character
@@ -144,56 +130,24 @@ def analyze_frequency_balance(y, sr):
     }
 
 
-def detect_structure(y, sr):
+def detect_structure(features):
     """
-    Attempt to detect structural sections using novelty.
-    Returns list of approximate section boundaries.
+    Labelled sections (A/B/A′ with intro/verse/chorus/... roles) from the
+    beat-synchronous self-similarity matrix; see scripts/structure.py.
+    Each section also carries song_generator-style layer modifiers.
     """
-    # Compute mel spectrogram
-    S = librosa.feature.melspectrogram(y=y, sr=sr)
-    
-    # Compute spectral novelty (changes in spectrum)
-    novelty = librosa.onset.onset_strength(S=librosa.power_to_db(S), sr=sr)
-    
-    # Find peaks in novelty (potential section changes)
-    # Use a high threshold to only catch major changes
-    peaks = librosa.util.peak_pick(novelty, pre_max=30, post_max=30, 
-                                    pre_avg=30, post_avg=30, delta=0.1, wait=100)
-    
-    peak_times = librosa.frames_to_time(peaks, sr=sr)
-    
-    # Estimate section lengths
-    duration = librosa.get_duration(y=y, sr=sr)
-    sections = []
-    prev_time = 0
-    
-    for t in peak_times:
-        if t - prev_time > 8:  # Minimum 8 seconds between sections
-            sections.append({
-                'start': prev_time,
-                'end': t,
-                'duration': t - prev_time
-            })
-            prev_time = t
-    
-    # Add final section
-    if duration - prev_time > 8:
-        sections.append({
-            'start': prev_time,
-            'end': duration,
-            'duration': duration - prev_time
-        })
-    
-    return sections
+    return [section.to_dict() for section in detect_sections(features)]
 
 
 def generate_chromagram(y, sr, output_path):
     """Generate and save chromagram visualization."""
-    y_harmonic = librosa.effects.harmonic(y)
-    chroma = librosa.feature.chroma_cqt(y=y_harmonic, sr=sr)
-    
+    plot_chromagram(key_detection.harmonic_chroma(y, sr), sr, output_path)
+
+
+def plot_chromagram(chroma, sr, output_path, hop_length=512):
+    """Save a chromagram image (hop_length is the time step between columns)."""
     plt.figure(figsize=(14, 4))
-    librosa.display.specshow(chroma, sr=sr, x_axis='time', y_axis='chroma')
+    librosa.display.specshow(chroma, sr=sr, hop_length=hop_length, x_axis='time', y_axis='chroma')
     plt.colorbar(label='Intensity')
     plt.title('Chromagram (Pitch Class Energy Over Time)')
     plt.tight_layout()
@@ -204,10 +158,15 @@ def generate_chromagram(y, sr, output_path):
 def generate_spectrogram(y, sr, output_path):
     """Generate and save mel spectrogram visualization."""
     S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128)
+    plot_spectrogram(S, sr, output_path)
+
+
+def plot_spectrogram(S, sr, output_path, hop_length=512):
+    """Save a mel power spectrogram image (hop_length is the time step between columns)."""
     S_db = librosa.power_to_db(S, ref=np.max)
     
     plt.figure(figsize=(14, 6))
-    librosa.display.specshow(S_db, sr=sr, x_axis='time', y_axis='mel')
+    librosa.display.specshow(S_db, sr=sr, hop_length=hop_length, x_axis='time', y_axis='mel')
     plt.colorbar(format='%+2.0f dB', label='Intensity (dB)')
     plt.title('Mel Spectrogram')
     plt.tight_layout()
@@ -254,10 +213,87 @@ def generate_strudel_suggestions(analysis):
     return '\n'.join(suggestions)
 
 
-def analyze_audio(audio_path, output_dir=None):
+# Frame-level intermediates, computed from the signal y at sr (one block of
+# it when streaming). The magnitude STFT feeds the band balance, the drum
+# bands and the mel spectrogram, which in turn gives the onset envelope, and
+# with MUSICMAN_CHROMA=stft the harmonic chroma too; the harmonic chroma
+# feeds the key, the structure and the chromagram.
+FRAME_NODES = [
+    Node('stft', lambda y: np.abs(librosa.stft(y)), deps=['y']),
+    Node('mel', lambda stft, sr: librosa.feature.melspectrogram(S=stft ** 2, sr=sr, n_mels=128),
+         deps=['stft', 'sr']),
+    Node('onset', lambda mel, sr: librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr),
+         deps=['mel', 'sr']),
+    Node('bands', lambda stft, sr: frequency_band_frames(None, sr, S=stft), deps=['stft', 'sr']),
+    Node('drums', lambda stft, sr: drum_energy(None, sr, S=stft), deps=['stft', 'sr']),
+    Node('harmonic_chroma', lambda y, sr, stft: key_detection.harmonic_chroma(y, sr, S=stft),
+         deps=['y', 'sr', 'stft']),
+]
+
+# Track-level nodes and the outputs of the report. Inputs: audio_path, sr,
+# chromagram_path and spectrogram_path.
+ANALYSIS_NODES = [
+    Node('y', lambda audio_path, sr: librosa.load(audio_path, sr=sr)[0], deps=['audio_path', 'sr']),
+    Node('duration', lambda y, sr: len(y) / sr, deps=['y', 'sr']),
+    *FRAME_NODES,
+    Node('grid', lambda audio_path, y, sr, onset: tempo.track_beats(audio_path, y=y, sr=sr, env=onset),
+         deps=['audio_path', 'y', 'sr', 'onset']),
+    Node('rhythm', lambda grid, onset, sr, duration: summarize_rhythm(grid, onset, sr, duration),
+         deps=['grid', 'onset', 'sr', 'duration']),
+    Node('key', lambda harmonic_chroma: key_detection.estimate_key(harmonic_chroma),
+         deps=['harmonic_chroma']),
+    Node('frequency_balance', lambda bands: summarize_frequency_balance(bands.sum(axis=1)),
+         deps=['bands']),
+    Node('beat_features', lambda grid, duration, sr, drums, harmonic_chroma: beat_features_from_frames(
+        grid.beats, duration, sr, grid.bpm, energy=drums, chroma=harmonic_chroma),
+         deps=['grid', 'duration', 'sr', 'drums', 'harmonic_chroma']),
+    Node('structure', lambda beat_features: detect_structure(beat_features), deps=['beat_features']),
+    Node('chromagram', lambda harmonic_chroma, sr, chromagram_path: plot_chromagram(
+        harmonic_chroma, sr, chromagram_path), deps=['harmonic_chroma', 'sr', 'chromagram_path']),
+    Node('spectrogram', lambda mel, sr, spectrogram_path: plot_spectrogram(mel, sr, spectrogram_path),
+         deps=['mel', 'sr', 'spectrogram_path']),
+]
+
+ANALYSIS_OUTPUTS = ['rhythm', 'key', 'frequency_balance', 'structure', 'chromagram', 'spectrogram']
+
+
+def analyze_streaming(audio_path, chromagram_path, spectrogram_path, profile=False):
+    """
+    Block-wise analysis for long files (DJ mixes) in bounded memory.
+    The frame-level nodes run on each block; the report outputs are then
+    planned from the concatenated frames. Returns ({output: value}, stats)
+    and saves the visualizations from time-pooled features.
+    """
+    sr, hop = streaming.STREAM_SR, streaming.HOP_LENGTH
+    pool = streaming.pool_size(streaming.file_duration(audio_path), PLOT_COLUMNS)
+    
+    print(f"Streaming {audio_path}...")
+    frames, duration = streaming.stream_features(audio_path, {
+        'frames': block_extractor(FRAME_NODES, ['onset', 'bands', 'drums', 'harmonic_chroma', 'mel']),
+    }, pool={'mel': pool})
+    
+    print("Analyzing rhythm, key, frequency balance and structure...")
+    grid = tempo.grid_from_envelope(frames['onset'], sr, hop_length=hop)
+    results, stats = run_plan(ANALYSIS_NODES, ['rhythm', 'key', 'frequency_balance', 'structure'],
+                              {**frames, 'grid': grid, 'duration': duration, 'sr': sr},
+                              trace_memory=profile)
+    
+    print("Generating chromagram...")
+    plot_chromagram(streaming.pool_frames(frames['harmonic_chroma'], pool), sr, chromagram_path,
+                    hop_length=hop * pool)
+    
+    print("Generating spectrogram...")
+    plot_spectrogram(frames['mel'], sr, spectrogram_path, hop_length=hop * pool)
+    
+    return results, stats
+
+
+def analyze_audio(audio_path, output_dir=None, stream=None, profile=False):
     """
     Main analysis function.
     Returns comprehensive analysis dict and saves visualizations.
+    Long files (or stream=True) are analysed block-wise in bounded memory.
+    profile prints the time and memory of every node of the feature plan.
     """
     audio_path = Path(audio_path)
     
@@ -266,20 +302,24 @@ def analyze_audio(audio_path, output_dir=None):
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    print(f"Loading {audio_path}...")
-    y, sr = librosa.load(audio_path, sr=22050)
-    
-    print("Analyzing rhythm...")
-    rhythm = analyze_rhythm(y, sr)
+    base_name = audio_path.stem
+    chromagram_path = output_dir / f"{base_name}_chromagram.png"
+    spectrogram_path = output_dir / f"{base_name}_spectrogram.png"
     
-    print("Detecting key...")
-    key, mode, key_confidence = detect_key(y, sr)
+    if streaming.should_stream(audio_path, stream):
+        results, stats = analyze_streaming(audio_path, chromagram_path, spectrogram_path, profile)
+    else:
+        print(f"Analyzing {audio_path}...")
+        results, stats = run_plan(ANALYSIS_NODES, ANALYSIS_OUTPUTS, {
+            'audio_path': audio_path, 'sr': 22050,
+            'chromagram_path': chromagram_path, 'spectrogram_path': spectrogram_path,
+        }, trace_memory=profile)
     
-    print("Analyzing frequency balance...")
-    freq_balance = analyze_frequency_balance(y, sr)
+    if profile:
+        print(format_report(stats))
     
-    print("Detecting structure...")
-    structure = detect_structure(y, sr)
+    rhythm, freq_balance, structure = results['rhythm'], results['frequency_balance'], results['structure']
+    key, mode, key_confidence = results['key']
     
     # Compile analysis
     analysis = {
@@ -295,15 +335,6 @@ def analyze_audio(audio_path, output_dir=None):
         'strudel_scale': f"{key}:{mode}"
     }
     
-    # Generate visualizations
-    base_name = audio_path.stem
-    
-    print("Generating chromagram...")
-    generate_chromagram(y, sr, output_dir / f"{base_name}_chromagram.png")
-    
-    print("Generating spectrogram...")
-    generate_spectrogram(y, sr, output_dir / f"{base_name}_spectrogram.png")
-    
     # Save JSON analysis
     json_path = output_dir / f"{base_name}_analysis.json"
     with open(json_path, 'w') as f:
@@ -345,7 +376,8 @@ def print_analysis(analysis):
     if analysis['structure']:
         print(f"\n📐 STRUCTURE ({len(analysis['structure'])} sections detected):")
         for i, section in enumerate(analysis['structure'][:5]):  # Show first 5
-            print(f"   Section {i+1}: {section['start']:.1f}s - {section['end']:.1f}s ({section['duration']:.1f}s)")
+            print(f"   Section {i+1}: {section['start']:.1f}s - {section['end']:.1f}s ({section['duration']:.1f}s)"
+                  f"  {section['label']} {section['name']}")
     
     print("\n" + "="*60)
 
@@ -354,6 +386,10 @@ def main():
     parser = argparse.ArgumentParser(description='Analyze audio for Strudel composition')
     parser.add_argument('audio_file', help='Path to audio file (mp3, wav, etc.)')
     parser.add_argument('--output-dir', '-o', help='Output directory for analysis files')
+    parser.add_argument('--stream', action='store_true',
+                        help='Analyse block-wise in bounded memory (automatic for files over 10 minutes)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time and peak memory of every analysis step')
     
     args = parser.parse_args()
     
@@ -362,7 +398,9 @@ def main():
         sys.exit(1)
     
     try:
-        analysis, output_dir = analyze_audio(args.audio_file, args.output_dir)
+        analysis, output_dir = analyze_audio(args.audio_file, args.output_dir,
+                                             stream=True if args.stream else None,
+                                             profile=args.profile)
         print_analysis(analysis)
         print(f"\n✅ Analysis saved to: {output_dir}")
     except Exception as e:
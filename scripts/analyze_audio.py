@@ -8,26 +8,19 @@ import argparse
 import json
 import sys
 from pathlib import Path
+from typing import Optional
 
 import librosa
 import numpy as np
 
+from audio_cache import load_audio
+from chroma import chromagram
+from streaming import STREAM_SR, should_stream, stream_features
+from tempo import grid_from_envelope, track_beats
 
-def analyze_audio(audio_path: str) -> dict:
-    """Analyze audio file and extract musical features."""
-
-    print(f"Loading: {audio_path}")
-    y, sr = librosa.load(audio_path, sr=22050)
-    duration = librosa.get_duration(y=y, sr=sr)
-
-    print("Detecting tempo...")
-    tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
-    tempo = float(tempo) if isinstance(tempo, np.ndarray) else tempo
-
-    print("Analyzing pitch/key...")
-    chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-    chroma_mean = np.mean(chroma, axis=1)
 
+def estimate_key_mode(chroma_mean: np.ndarray):
+    """Key name and major/minor from a mean chroma vector."""
     # Map to key names
     key_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
     key_idx = int(np.argmax(chroma_mean))
@@ -42,31 +35,79 @@ def analyze_audio(audio_path: str) -> dict:
     minor_corr = np.corrcoef(np.roll(minor_profile, key_idx), chroma_mean)[0, 1]
 
     mode = "major" if major_corr > minor_corr else "minor"
+    return key, mode
+
+
+def spectral_frames(y: np.ndarray, sr: int) -> np.ndarray:
+    """(2, frames) spectral centroid and bandwidth from one STFT."""
+    S = np.abs(librosa.stft(y))
+    return np.vstack([librosa.feature.spectral_centroid(S=S, sr=sr),
+                      librosa.feature.spectral_bandwidth(S=S, sr=sr)])
+
+
+def analyze_audio(audio_path: str, stream: Optional[bool] = None) -> dict:
+    """Analyze audio file and extract musical features.
+
+    Long files (or stream=True) are analysed block-wise in bounded memory.
+    """
+    if should_stream(audio_path, stream):
+        return analyze_audio_streaming(audio_path)
+
+    print(f"Loading: {audio_path}")
+    y, sr = load_audio(audio_path, sr=22050)
+    duration = librosa.get_duration(y=y, sr=sr)
+
+    print("Detecting tempo...")
+    grid = track_beats(audio_path, y=y, sr=sr)
+
+    print("Analyzing pitch/key...")
+    chroma = chromagram(y, sr)
+    key, mode = estimate_key_mode(np.mean(chroma, axis=1))
 
     print("Analyzing spectral features...")
-    spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
-    spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)
+    spectral = spectral_frames(y, sr)
+
+    return build_analysis(audio_path, duration, grid, key, mode, spectral)
 
-    analysis = {
+
+def analyze_audio_streaming(audio_path: str) -> dict:
+    """The same analysis from one block-wise pass over the file."""
+    print(f"Streaming: {audio_path}")
+    frames, duration = stream_features(audio_path, {
+        "onset": lambda y, sr: librosa.onset.onset_strength(y=y, sr=sr),
+        "chroma": chromagram,
+        "spectral": spectral_frames,
+    })
+
+    print("Detecting tempo...")
+    grid = grid_from_envelope(frames["onset"], STREAM_SR)
+    key, mode = estimate_key_mode(np.mean(frames["chroma"], axis=1))
+    return build_analysis(audio_path, duration, grid, key, mode, frames["spectral"])
+
+
+def build_analysis(audio_path: str, duration: float, grid, key: str, mode: str,
+                   spectral: np.ndarray) -> dict:
+    return {
         "file": str(audio_path),
         "duration_seconds": round(duration, 2),
-        "bpm": round(tempo, 1),
+        "bpm": round(grid.bpm, 1),
         "key": key,
         "mode": mode,
-        "beat_times": librosa.frames_to_time(beat_frames, sr=sr).tolist()[:32],
+        "beat_times": grid.beats[:32],
+        "beat_confidence": grid.confidence,
         "spectral": {
-            "centroid_mean": float(np.mean(spectral_centroid)),
-            "bandwidth_mean": float(np.mean(spectral_bandwidth))
+            "centroid_mean": float(np.mean(spectral[0])),
+            "bandwidth_mean": float(np.mean(spectral[1]))
         }
     }
 
-    return analysis
-
 
 def main():
     parser = argparse.ArgumentParser(description="Analyze audio file")
     parser.add_argument("audio_file", help="Path to audio file (MP3, WAV, etc.)")
     parser.add_argument("-o", "--output", help="Output JSON path")
+    parser.add_argument("--stream", action="store_true",
+                        help="Analyse block-wise in bounded memory (automatic for files over 10 minutes)")
     args = parser.parse_args()
 
     audio_path = Path(args.audio_file)
@@ -74,7 +115,7 @@ def main():
         print(f"Error: File not found: {audio_path}", file=sys.stderr)
         sys.exit(1)
 
-    analysis = analyze_audio(str(audio_path))
+    analysis = analyze_audio(str(audio_path), stream=True if args.stream else None)
 
     output_path = args.output
     if not output_path:
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Decoded-audio cache shared by the analysis scripts.
+
+Decoding an MP3 with librosa is one of the most expensive steps of every
+analysis run, and we re-run analysis on the same reference tracks many times
+while tuning. This module keeps the decoded PCM on disk as ``.npy`` files and
+hands back read-only memory maps on later calls.
+
+Entries are keyed by a content hash of the source file plus the decode
+settings (sample rate, channel layout, offset, duration), so renaming or
+copying a track still hits the cache. The cache directory is size-bounded and
+evicts least-recently-used entries.
+
+It also holds cache_root() and write_atomic(), which every cache in the
+scripts shares. Only the standard library is imported up front (numpy and
+librosa load on the first decode), so numpy-free code can use them too.
+
+Usage:
+    from audio_cache import load_audio
+    y, sr = load_audio("track.mp3", sr=22050)
+
+Environment:
+    MUSICMAN_CACHE_DIR         Root cache directory (default: ~/.cache/musicman)
+    MUSICMAN_AUDIO_CACHE_MB    Size limit for decoded audio (default: 8192)
+    MUSICMAN_AUDIO_CACHE=0     Disable the cache and always decode
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+DEFAULT_CACHE_MB = 8192
+MB = 1024 * 1024
+HASH_CHUNK = 1 << 20
+
+
+def cache_root() -> Path:
+    """Root directory for all Musicman caches."""
+    return Path(os.environ.get("MUSICMAN_CACHE_DIR", Path.home() / ".cache" / "musicman"))
+
+
+def audio_cache_dir() -> Path:
+    """Directory holding decoded audio arrays."""
+    return cache_root() / "audio"
+
+
+def cache_enabled() -> bool:
+    return os.environ.get("MUSICMAN_AUDIO_CACHE", "1") != "0"
+
+
+def cache_limit_bytes() -> int:
+    return int(float(os.environ.get("MUSICMAN_AUDIO_CACHE_MB", DEFAULT_CACHE_MB)) * MB)
+
+
+@lru_cache(maxsize=4096)
+def _hash_file(path: str, size: int, mtime_ns: int) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def audio_hash(path) -> str:
+    """Content hash of an audio file (memoized per path, size and mtime)."""
+    path = os.path.realpath(str(path))
+    st = os.stat(path)
+    return _hash_file(path, st.st_size, st.st_mtime_ns)
+
+
+def cache_key(path, sr: Optional[int], mono: bool = True,
+              offset: float = 0.0, duration: Optional[float] = None) -> str:
+    """Cache key for one decoding of ``path``."""
+    sr_part = "native" if sr is None else str(int(sr))
+    dur_part = "full" if duration is None else f"{float(duration):g}"
+    channels = "mono" if mono else "multi"
+    return f"{audio_hash(path)}_{sr_part}_{channels}_{float(offset):g}_{dur_part}"
+
+
+def _entry_paths(key: str) -> Tuple[Path, Path]:
+    base = audio_cache_dir() / key[:2]
+    return base / f"{key}.npy", base / f"{key}.sr"
+
+
+def _touch(*paths: Path) -> None:
+    for p in paths:
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+
+
+def write_atomic(path: Path, write) -> None:
+    """Create path through write(f) on a temporary file, so readers never see it half-written."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def evict(limit_bytes: Optional[int] = None) -> int:
+    """Remove least-recently-used entries until the cache fits. Returns bytes freed."""
+    limit = cache_limit_bytes() if limit_bytes is None else limit_bytes
+    root = audio_cache_dir()
+    if not root.exists():
+        return 0
+
+    entries = []
+    total = 0
+    for npy in root.glob("*/*.npy"):
+        try:
+            st = npy.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, npy))
+        total += st.st_size
+
+    freed = 0
+    for _, size, npy in sorted(entries):
+        if total <= limit:
+            break
+        npy.unlink(missing_ok=True)
+        npy.with_suffix(".sr").unlink(missing_ok=True)
+        total -= size
+        freed += size
+    if freed:
+        logging.debug(f"Audio cache evicted {freed / MB:.1f} MB")
+    return freed
+
+
+def load_audio(path, sr: Optional[int] = 22050, mono: bool = True,
+               offset: float = 0.0, duration: Optional[float] = None) -> Tuple["np.ndarray", int]:
+    """Drop-in replacement for ``librosa.load`` that reads through the cache.
+
+    Returns a read-only memory-mapped float32 array on cache hits.
+    """
+    import librosa
+    import numpy as np
+
+    if not cache_enabled():
+        return librosa.load(str(path), sr=sr, mono=mono, offset=offset, duration=duration)
+
+    key = cache_key(path, sr, mono, offset, duration)
+    npy_path, sr_path = _entry_paths(key)
+
+    if npy_path.exists() and sr_path.exists():
+        try:
+            y = np.load(npy_path, mmap_mode="r")
+            _touch(npy_path, sr_path)
+            logging.debug(f"Audio cache hit: {path}")
+            return y, int(sr_path.read_text())
+        except (ValueError, OSError) as e:
+            logging.warning(f"Corrupt audio cache entry {npy_path.name}: {e}")
+            npy_path.unlink(missing_ok=True)
+
+    y, out_sr = librosa.load(str(path), sr=sr, mono=mono, offset=offset, duration=duration)
+    try:
+        write_atomic(npy_path, lambda f: np.save(f, np.ascontiguousarray(y, dtype=np.float32)))
+        sr_path.write_text(str(int(out_sr)))
+        evict()
+        y = np.load(npy_path, mmap_mode="r")
+    except OSError as e:
+        logging.warning(f"Could not write audio cache entry: {e}")
+    return y, int(out_sr)
+
+
+def cache_stats() -> dict:
+    """Entry count and total size of the decoded-audio cache."""
+    root = audio_cache_dir()
+    sizes = [p.stat().st_size for p in root.glob("*/*.npy")] if root.exists() else []
+    return {
+        "dir": str(root),
+        "entries": len(sizes),
+        "size_mb": round(sum(sizes) / MB, 1),
+        "limit_mb": round(cache_limit_bytes() / MB, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the decoded-audio cache")
+    parser.add_argument("--prune", action="store_true", help="Evict entries above the size limit")
+    parser.add_argument("--clear", action="store_true", help="Remove every cached entry")
+    parser.add_argument("--warm", nargs="*", default=[], help="Decode these files into the cache")
+    parser.add_argument("--sr", type=int, default=22050, help="Sample rate for --warm")
+    args = parser.parse_args()
+
+    if args.clear:
+        evict(0)
+    elif args.prune:
+        evict()
+    for path in args.warm:
+        load_audio(path, sr=args.sr)
+        print(f"Cached: {path}")
+
+    stats = cache_stats()
+    print(f"{stats['dir']}: {stats['entries']} entries, {stats['size_mb']} / {stats['limit_mb']} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,51 +10,100 @@ Analyzes reference tracks to create training data with:
 
 import argparse
 import json
+import os
+import queue
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import tempfile
 
+from mini_notation import pattern_to_mini
+
 VENV_PYTHON = "/home/ubuntu/.venv/strudel-ml/bin/python"
+SCRIPTS_DIR = Path(__file__).resolve().parent
+EXCERPT_BARS = 16
+FALLBACK_DURATION = 30  # seconds from the start analysed when there is no excerpt
 
 # Analysis script that runs in the ML venv with librosa
 ANALYSIS_SCRIPT = '''
 import librosa
 import numpy as np
 import json
+import os
 import sys
 
+from audio_cache import load_audio
+from beat_features import compute_beat_features
+from chords import PITCH_CLASSES as CHORD_ROOTS
+from chords import dominant_progression, key_prior, recognize_chords
+from drum_patterns import mine_loop
+from feature_store import FeatureStore
+from key_detection import estimate_key
+from pitch_tracking import melody_stats
+from tempo import track_beats
+
+MELODY_MODE = os.environ.get("MUSICMAN_MELODY_MODE", "fast")
+
 KEYS = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
 
-def analyze_audio(audio_path, duration=30):
-    """Full audio analysis returning structured data."""
+def analyze_audio(audio_path, duration=30, stems=None, melody_mode=None):
+    """Full audio analysis returning structured data.
+
+    stems may map "drums" and "no_drums" to Demucs outputs for this file;
+    they then replace HPSS as the percussive and harmonic signals.
+    """
 
     # Load audio
-    y, sr = librosa.load(audio_path, sr=22050, duration=duration)
+    y, sr = load_audio(audio_path, sr=22050, duration=duration)
 
     # === TEMPO & BEAT DETECTION ===
-    tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-    tempo = float(tempo) if hasattr(tempo, "item") else float(tempo)
-    beat_times = librosa.frames_to_time(beats, sr=sr)
+    grid = track_beats(audio_path, y=y, sr=sr, duration=duration)
+    tempo = grid.bpm
+    beat_times = grid.beats
 
     # === HARMONIC/PERCUSSIVE SEPARATION ===
-    y_harmonic, y_percussive = librosa.effects.hpss(y)
+    # HPSS output and the frame-level features below live in the feature
+    # store, so re-running with retuned drum or chord heuristics skips them
+    stems = stems or {}
+    if "drums" in stems and "no_drums" in stems:
+        y_percussive, _ = load_audio(stems["drums"], sr=sr, duration=duration)
+        y_harmonic, _ = load_audio(stems["no_drums"], sr=sr, duration=duration)
+        separation = "demucs"
+        stores = {"percussive": FeatureStore(stems["drums"], duration=duration),
+                  "harmonic": FeatureStore(stems["no_drums"], duration=duration)}
+    else:
+        hpss = FeatureStore(audio_path, sr=sr, duration=duration).get_or_compute(
+            "hpss", {}, lambda: np.stack(librosa.effects.hpss(np.asarray(y))))
+        y_harmonic, y_percussive = hpss
+        separation = "hpss"
+        stores = {part: FeatureStore(audio_path, duration=duration, source=f"hpss_{part}")
+                  for part in ("percussive", "harmonic")}
+
+    # === BEAT-SYNCHRONOUS FEATURES ===
+    # Per-16th drum bands and onsets, per-beat chroma
+    features = compute_beat_features(beat_times, len(y) / sr, tempo,
+                                     percussive=(y_percussive, sr), harmonic=(y_harmonic, sr),
+                                     stores=stores)
 
     # === DRUM PATTERN ANALYSIS ===
-    drums = analyze_drums_detailed(y_percussive, sr, tempo, len(beat_times))
+    drums = analyze_drums_detailed(features)
 
     # === CHORD/HARMONY ANALYSIS ===
-    harmony = analyze_harmony_detailed(y_harmonic, sr, tempo)
+    harmony = analyze_harmony_detailed(features)
 
     # === MELODY ANALYSIS ===
-    melody = analyze_melody(y_harmonic, sr)
+    melody = analyze_melody(y_harmonic, sr, melody_mode)
 
     # === STRUCTURE ANALYSIS ===
     structure = {
         "tempo": round(tempo),
         "beats": len(beat_times),
         "duration": float(len(y) / sr),
-        "beat_duration": round(60 / tempo, 3) if tempo > 0 else 0.5
+        "beat_duration": round(60 / tempo, 3) if tempo > 0 else 0.5,
+        "beat_confidence": grid.confidence,
+        "separation": separation
     }
 
     return {
@@ -65,42 +114,17 @@ def analyze_audio(audio_path, duration=30):
     }
 
 
-def analyze_drums_detailed(y_perc, sr, tempo, n_beats):
-    """Analyze percussive content for drum patterns."""
-
-    # Frequency band separation for different drum sounds
-    # Kick: 20-120 Hz, Snare: 200-400 Hz, Hihat: 6000-16000 Hz
-    # Adjusted ranges to reduce cross-contamination
-
-    # Get spectrogram
-    S = np.abs(librosa.stft(y_perc))
-    freqs = librosa.fft_frequencies(sr=sr)
-
-    # Define frequency bands (tighter ranges)
-    kick_mask = (freqs >= 30) & (freqs <= 120)
-    snare_mask = (freqs >= 200) & (freqs <= 400)
-    hihat_mask = (freqs >= 6000) & (freqs <= 16000)
-
-    # Sum energy in each band over time
-    kick_energy = np.sum(S[kick_mask, :], axis=0)
-    snare_energy = np.sum(S[snare_mask, :], axis=0)
-    hihat_energy = np.sum(S[hihat_mask, :], axis=0)
-
-    # Detect onsets in each band with different thresholds
-    kick_onsets = detect_band_onsets(kick_energy, sr, threshold=0.4)
-    snare_onsets = detect_band_onsets(snare_energy, sr, threshold=0.5)
-    hihat_onsets = detect_band_onsets(hihat_energy, sr, threshold=0.3)
-
-    # Convert to pattern (quantize to 16th notes)
-    beat_duration = 60 / tempo if tempo > 0 else 0.5
-    sixteenth = beat_duration / 4
+def analyze_drums_detailed(features):
+    """Analyze percussive content for drum patterns.
 
-    # Analyze first 4 beats (1 bar) to detect pattern
-    bar_duration = beat_duration * 4
+    Works on the beat-synchronous onset mask: kick, snare and hihat band
+    onsets (bands and thresholds from beat_features.DRUM_BANDS, i.e. the
+    drum config drum_sweep.py tunes), already quantized to 16ths.
+    """
 
-    kick_pattern = quantize_to_pattern(kick_onsets, sixteenth, bar_duration)
-    snare_pattern = quantize_to_pattern(snare_onsets, sixteenth, bar_duration)
-    hihat_pattern = quantize_to_pattern(hihat_onsets, sixteenth, bar_duration)
+    # Most common bar over the whole track (the first bar is often a pickup or fill)
+    loop = mine_loop(features.onset_mask)
+    kick_pattern, snare_pattern, hihat_pattern = loop.rows()
 
     # Apply common pattern heuristics
     kick_pattern = refine_kick_pattern(kick_pattern)
@@ -114,9 +138,11 @@ def analyze_drums_detailed(y_perc, sr, tempo, n_beats):
         "kick_pattern": kick_pattern,
         "snare_pattern": snare_pattern,
         "hihat_pattern": hihat_pattern,
-        "kick_onsets": len(kick_onsets),
-        "snare_onsets": len(snare_onsets),
-        "hihat_onsets": len(hihat_onsets),
+        "kick_onsets": int(features.onset_mask[0].sum()),
+        "snare_onsets": int(features.onset_mask[1].sum()),
+        "hihat_onsets": int(features.onset_mask[2].sum()),
+        "loop_share": round(loop.share, 2),
+        "loop_variations": len(loop.variations),
         "style": style
     }
 
@@ -154,42 +180,6 @@ def refine_hihat_pattern(pattern):
     return pattern
 
 
-def detect_band_onsets(energy, sr, threshold=0.3):
-    """Detect onsets from energy envelope."""
-    # Normalize
-    if np.max(energy) > 0:
-        energy = energy / np.max(energy)
-
-    # Simple peak detection
-    peaks = []
-    hop_length = 512
-    min_gap = int(sr / hop_length * 0.05)  # Minimum 50ms between peaks
-
-    last_peak = -min_gap
-    for i in range(1, len(energy) - 1):
-        if (energy[i] > threshold and 
-            energy[i] > energy[i-1] and 
-            energy[i] > energy[i+1] and
-            i - last_peak >= min_gap):
-            time = librosa.frames_to_time(i, sr=sr, hop_length=hop_length)
-            peaks.append(time)
-            last_peak = i
-
-    return peaks
-
-
-def quantize_to_pattern(onsets, step_duration, bar_duration, steps=16):
-    """Quantize onset times to a 16-step pattern."""
-    pattern = [0] * steps
-
-    for onset in onsets:
-        if onset < bar_duration:
-            step = int(round(onset / step_duration)) % steps
-            pattern[step] = 1
-
-    return pattern
-
-
 def detect_drum_style(kick, snare, hihat):
     """Detect drum style from patterns."""
 
@@ -220,31 +210,14 @@ def detect_drum_style(kick, snare, hihat):
         return "breakbeat"
 
 
-def analyze_harmony_detailed(y_harm, sr, tempo):
-    """Analyze harmonic content for chords and key."""
-
-    # Chromagram
-    chroma = librosa.feature.chroma_cqt(y=y_harm, sr=sr)
-
-    # Average chroma for key detection
-    chroma_avg = np.mean(chroma, axis=1)
+def analyze_harmony_detailed(features):
+    """Analyze harmonic content for chords and key, from per-beat chroma."""
 
-    # Key detection
-    key_idx = int(np.argmax(chroma_avg))
+    # Key detection: all 24 Krumhansl-Schmuckler profiles in one matrix product
+    root, mode, _ = estimate_key(features.chroma)
+    key_idx = CHORD_ROOTS.index(root)
     key = KEYS[key_idx]
 
-    # Major/minor detection using correlation with templates
-    major_template = np.array([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1])
-    minor_template = np.array([1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0])
-
-    rolled_major = np.roll(major_template, key_idx)
-    rolled_minor = np.roll(minor_template, key_idx)
-
-    major_corr = np.corrcoef(rolled_major, chroma_avg)[0, 1]
-    minor_corr = np.corrcoef(rolled_minor, chroma_avg)[0, 1]
-
-    mode = "major" if major_corr > minor_corr else "minor"
-
     # Build chord names relative to detected key
     if mode == "major":
         # I, ii, iii, IV, V, vi, vii°
@@ -260,30 +233,11 @@ def analyze_harmony_detailed(y_harm, sr, tempo):
         note_idx = (key_idx + deg) % 12
         chord_names.append(KEYS[note_idx] + qual)
 
-    # Chord progression detection (analyze per beat)
-    beat_interval = 60/tempo if tempo > 0 else 0.5
-    beat_frames = librosa.time_to_frames(
-        np.arange(0, len(y_harm)/sr, beat_interval),
-        sr=sr
-    )
-
-    chords = []
-
-    # Sample chords at each beat
-    for i in range(min(8, len(beat_frames) - 1)):
-        start_frame = beat_frames[i]
-        end_frame = beat_frames[i + 1] if i + 1 < len(beat_frames) else chroma.shape[1]
-
-        if start_frame < chroma.shape[1]:
-            beat_chroma = np.mean(chroma[:, start_frame:min(end_frame, chroma.shape[1])], axis=1)
-            chord_idx = int(np.argmax(beat_chroma))
-            
-            # Map to scale degree (distance from key)
-            degree = (chord_idx - key_idx) % 12
-            
-            # Find closest scale degree
-            closest = min(range(len(scale_degrees)), key=lambda i: abs(scale_degrees[i] - degree))
-            chords.append(chord_names[closest])
+    # Chord progression detection: every beat of the track, Viterbi-smoothed,
+    # with a small bonus for chords diatonic to the detected key
+    timeline = recognize_chords(features.chroma, features.beat_times, end_time=features.duration,
+                                prior=key_prior(CHORD_ROOTS[key_idx], mode))
+    chords = [to_flat_name(c) for c in dominant_progression(timeline)]
 
     # Simplify chord progression
     if len(chords) >= 4:
@@ -296,56 +250,28 @@ def analyze_harmony_detailed(y_harm, sr, tempo):
         "mode": mode,
         "chords": chords[:8],
         "progression": progression,
-        "chord_names": chord_names  # For reference
+        "chord_names": chord_names,  # For reference
+        "timeline": [dict(seg, chord=to_flat_name(seg["chord"])) for seg in timeline]
     }
 
 
-def analyze_melody(y_harm, sr):
-    """Extract melody characteristics."""
+def to_flat_name(chord):
+    """Spell a chord root with the flat names used by KEYS."""
+    for i, sharp in enumerate(CHORD_ROOTS):
+        if "#" in sharp and chord.startswith(sharp):
+            return KEYS[i] + chord[len(sharp):]
+    return chord
 
-    # Pitch detection using pyin
-    try:
-        f0, voiced_flag, voiced_probs = librosa.pyin(
-            y_harm,
-            fmin=librosa.note_to_hz("C2"),
-            fmax=librosa.note_to_hz("C7"),
-            sr=sr
-        )
 
-        # Get voiced pitches
-        valid_f0 = f0[voiced_flag]
-
-        if len(valid_f0) > 0:
-            # Convert to MIDI notes
-            midi_notes = librosa.hz_to_midi(valid_f0)
-            midi_notes = midi_notes[~np.isnan(midi_notes)]
-
-            if len(midi_notes) > 0:
-                # Find range
-                low_note = int(np.min(midi_notes))
-                high_note = int(np.max(midi_notes))
-                avg_note = int(np.mean(midi_notes))
-
-                # Determine register
-                if avg_note < 48:  # Below C3
-                    register = "bass"
-                elif avg_note < 60:  # Below C4
-                    register = "low"
-                elif avg_note < 72:  # Below C5
-                    register = "mid"
-                else:
-                    register = "high"
-
-                # Note activity
-                activity = len(midi_notes) / (len(f0) + 1)
-
-                return {
-                    "register": register,
-                    "range": high_note - low_note,
-                    "low_midi": low_note,
-                    "high_midi": high_note,
-                    "activity": round(activity, 2)
-                }
+def analyze_melody(y_harm, sr, mode=None):
+    """Extract melody characteristics.
+
+    mode "fast" (the default, or $MUSICMAN_MELODY_MODE) uses the decimated
+    vectorized YIN tracker; "accurate" runs full-range pyin.
+    """
+    try:
+        stats = melody_stats(y_harm, sr, mode or MELODY_MODE)
+        return {k: stats[k] for k in ("register", "range", "low_midi", "high_midi", "activity")}
     except Exception as e:
         pass
 
@@ -358,52 +284,332 @@ def analyze_melody(y_harm, sr):
     }
 
 
+def warm_up(sr=22050):
+    """Run the full analysis once on synthetic audio so numba JIT, the
+    CQT/mel filter banks and the pitch tracker are ready before real work."""
+    t = np.arange(sr * 3) / sr
+    y = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * np.random.default_rng(0).standard_normal(len(t))
+    y = y.astype(np.float32)
+    grid = track_beats(y=y, sr=sr)
+    y_harmonic, y_percussive = librosa.effects.hpss(y)
+    features = compute_beat_features(grid.beats, len(y) / sr, grid.bpm,
+                                     percussive=(y_percussive, sr), harmonic=(y_harmonic, sr))
+    analyze_drums_detailed(features)
+    analyze_harmony_detailed(features)
+    analyze_melody(y_harmonic, sr, "fast")
+    if MELODY_MODE == "accurate":
+        analyze_melody(y_harmonic, sr, "accurate")
+
+
+def handle_request(request):
+    """Answer one JSON-lines request: {"id": ..., "audio_path": ..., "duration": ..., "stems": ...,
+    "melody_mode": ...}."""
+    if request.get("op") == "ping":
+        return {"id": request.get("id"), "ok": True, "result": "pong"}
+    try:
+        kwargs = {}
+        for option in ("duration", "stems", "melody_mode"):
+            if option in request:
+                kwargs[option] = request[option]
+        result = analyze_audio(request["audio_path"], **kwargs)
+        return {"id": request.get("id"), "ok": True, "result": result}
+    except Exception as e:
+        return {"id": request.get("id"), "ok": False, "error": f"{type(e).__name__}: {e}"}
+
+
+def serve(reader, writer):
+    """JSON-lines request/response loop. One response line per request line."""
+    for line in reader:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {"id": None, "ok": False, "error": f"bad request: {e}"}
+        else:
+            if request.get("op") == "shutdown":
+                return False
+            response = handle_request(request)
+        writer.write(json.dumps(response) + "\\n")
+        writer.flush()
+    return True
+
+
+def serve_socket(socket_path):
+    """Serve the JSON-lines protocol on a Unix socket, one client at a time."""
+    import os
+    import socket
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    try:
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile("r") as reader, conn.makefile("w") as writer:
+                if not serve(reader, writer):
+                    break
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
 if __name__ == "__main__":
-    audio_path = sys.argv[1]
-    result = analyze_audio(audio_path)
-    print("ANALYSIS_JSON:" + json.dumps(result))
+    if sys.argv[1] == "--worker":
+        # Keep the protocol channel clean: anything printed by libraries goes to stderr.
+        protocol_out = sys.stdout
+        sys.stdout = sys.stderr
+        warm_up()
+        protocol_out.write(json.dumps({"id": None, "ok": True, "result": "ready"}) + "\\n")
+        protocol_out.flush()
+        if len(sys.argv) > 3 and sys.argv[2] == "--socket":
+            serve_socket(sys.argv[3])
+        else:
+            serve(sys.stdin, protocol_out)
+    else:
+        audio_path = sys.argv[1]
+        options = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+        stems = json.loads(options["--stems"]) if "--stems" in options else None
+        duration = json.loads(options.get("--duration", "30"))
+        result = analyze_audio(audio_path, duration=duration, stems=stems)
+        print("ANALYSIS_JSON:" + json.dumps(result))
 '''
 
 
-def run_demucs(audio_path: Path, output_dir: Path) -> dict:
-    """Separate audio into stems using Demucs."""
-    print(f"[1/5] Separating stems with Demucs...")
+def select_excerpts(audio_paths: list, bars: int = EXCERPT_BARS) -> dict:
+    """Pick each file's most representative `bars`-bar window in one ML venv process.
 
+    Returns {file: excerpt} where excerpt["path"] is the cut audio (see
+    excerpt.py) and {} marks a file whose selection failed. Cuts are cached,
+    so asking again for the same audio is immediate.
+    """
+    cmd = [VENV_PYTHON, str(SCRIPTS_DIR / "excerpt.py"), "--bars", str(bars), "--json"] \
+        + [str(p) for p in audio_paths]
+
+    result = subprocess.run(cmd, capture_output=True, text=True, env=analysis_env())
+    try:
+        return json.loads(result.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        print(f"  Warning: Excerpt selection failed: {result.stderr[-200:]}")
+        return {str(p): {} for p in audio_paths}
+
+
+def separate_stems(audio_paths: list) -> dict:
+    """Separate several files in one ML venv process through the shared stem store.
+
+    The model is loaded once for the whole queue, and files that were already
+    separated (by this script or extract_music.py) are returned immediately.
+    """
     cmd = [
-        VENV_PYTHON, "-m", "demucs",
+        VENV_PYTHON, str(SCRIPTS_DIR / "separation.py"),
         "-n", "htdemucs",
-        "-o", str(output_dir),
         "--two-stems", "drums",
-        str(audio_path)
-    ]
+        "--json",
+    ] + [str(p) for p in audio_paths]
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = subprocess.run(cmd, capture_output=True, text=True, env=analysis_env())
+    try:
+        separated = json.loads(result.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        print(f"  Warning: Separation failed: {result.stderr[-200:]}")
+        return {str(p): {} for p in audio_paths}
+    return {path: {name: Path(stem) for name, stem in stems.items()}
+            for path, stems in separated.items()}
+
+
+def run_demucs(audio_path: Path) -> dict:
+    """Separate audio into stems using Demucs."""
+    print(f"[1/5] Separating stems with Demucs...")
 
-    stem_dir = output_dir / "htdemucs" / audio_path.stem
-    stems = {}
-    if stem_dir.exists():
-        for stem_file in stem_dir.glob("*.wav"):
-            stems[stem_file.stem] = stem_file
+    stems = separate_stems([audio_path]).get(str(audio_path), {})
 
     print(f"  Found stems: {list(stems.keys())}")
     return stems
 
 
-def run_analysis(audio_path: Path) -> dict:
-    """Run detailed audio analysis using librosa."""
-    print(f"[2/5] Running detailed audio analysis...")
+def analysis_env() -> dict:
+    """Environment for the ML venv, with the shared scripts/ modules importable."""
+    env = os.environ.copy()
+    paths = [str(SCRIPTS_DIR)] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+    return env
 
-    # Write analysis script to temp file
+
+DEFAULT_ANALYSIS = {
+    "structure": {"tempo": 120, "beats": 32, "duration": 30},
+    "drums": {"kick_pattern": [1,0,0,0,1,0,0,0,1,0,0,0,1,0,0,0],
+              "snare_pattern": [0,0,0,0,1,0,0,0,0,0,0,0,1,0,0,0],
+              "hihat_pattern": [1,0,1,0,1,0,1,0,1,0,1,0,1,0,1,0],
+              "style": "house"},
+    "harmony": {"key": "C", "mode": "minor", "chords": ["Cm", "Fm", "Gm", "Cm"]},
+    "melody": {"register": "mid", "range": 12}
+}
+
+ANALYSIS_TIMEOUT = 120
+WORKER_STARTUP_TIMEOUT = 300
+
+
+def write_analysis_script() -> str:
+    """Write ANALYSIS_SCRIPT to a temp file and return its path."""
     with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
         f.write(ANALYSIS_SCRIPT)
-        script_path = f.name
+        return f.name
+
+
+class AnalysisWorker:
+    """A long-lived ANALYSIS_SCRIPT process in the ML venv.
+
+    Speaks JSON lines over stdin/stdout, so librosa imports, numba JIT and the
+    filter banks are paid for once per worker instead of once per track.
+    """
+
+    def __init__(self, script_path: str):
+        self.script_path = script_path
+        self.proc = None
+        self.responses = queue.Queue()
+        self.next_id = 0
+        self.start()
+
+    def start(self):
+        env = analysis_env()
+        env.setdefault("LIBROSA_CACHE_DIR", str(Path.home() / ".cache" / "musicman" / "librosa"))
+        self.proc = subprocess.Popen(
+            [VENV_PYTHON, self.script_path, "--worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+            env=env
+        )
+        self.responses = queue.Queue()
+        threading.Thread(target=self._read_responses, args=(self.proc, self.responses),
+                         daemon=True).start()
+        ready = self.responses.get(timeout=WORKER_STARTUP_TIMEOUT)
+        if ready is None or ready.get("result") != "ready":
+            raise RuntimeError("analysis worker failed to start")
+
+    @staticmethod
+    def _read_responses(proc, responses):
+        for line in proc.stdout:
+            try:
+                responses.put(json.loads(line))
+            except ValueError:
+                continue
+        responses.put(None)  # worker exited
+
+    def analyze(self, audio_path: Path, timeout: float = ANALYSIS_TIMEOUT, **options) -> dict:
+        """Analyze one file; raises RuntimeError on failure or timeout."""
+        if self.proc.poll() is not None:
+            self.start()
+        self.next_id += 1
+        request = {"id": self.next_id, "audio_path": str(audio_path), **options}
+        self.proc.stdin.write(json.dumps(request) + "\n")
+        self.proc.stdin.flush()
+
+        try:
+            while True:
+                response = self.responses.get(timeout=timeout)
+                if response is None:
+                    raise RuntimeError("analysis worker exited")
+                if response.get("id") == self.next_id:
+                    break
+        except queue.Empty:
+            # A stuck worker cannot be trusted with the next track; replace it.
+            self.proc.kill()
+            self.proc.wait()
+            self.start()
+            raise RuntimeError("analysis timed out")
+
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "unknown worker error"))
+        return response["result"]
+
+    def close(self):
+        if self.proc and self.proc.poll() is None:
+            try:
+                self.proc.stdin.write(json.dumps({"op": "shutdown"}) + "\n")
+                self.proc.stdin.close()
+                self.proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+
+
+class AnalysisWorkerPool:
+    """A pool of N AnalysisWorkers for batch runs. Safe to call from threads."""
+
+    def __init__(self, n_workers: int = 1):
+        self.script_path = write_analysis_script()
+        self.idle = queue.Queue()
+        self.workers = []
+        try:
+            for _ in range(max(1, n_workers)):
+                worker = AnalysisWorker(self.script_path)
+                self.workers.append(worker)
+                self.idle.put(worker)
+        except Exception:
+            self.close()
+            raise
+
+    def analyze(self, audio_path: Path, **options) -> dict:
+        worker = self.idle.get()
+        try:
+            return worker.analyze(audio_path, **options)
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        Path(self.script_path).unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_analysis(audio_path: Path, pool: AnalysisWorkerPool = None, stems: dict = None,
+                 duration: float = FALLBACK_DURATION) -> dict:
+    """Run detailed audio analysis using librosa.
+
+    With a worker pool the request goes to a warm worker; otherwise a one-shot
+    ML venv process is launched for this file. When Demucs stems are given,
+    the drum stem drives drum detection and no_drums drives harmony and
+    melody, and HPSS is skipped. Only the first `duration` seconds are
+    analysed (None: the whole file, e.g. an excerpt).
+    """
+    print(f"[2/5] Running detailed audio analysis...")
+
+    stem_args = {name: str(path) for name, path in (stems or {}).items()
+                 if name in ("drums", "no_drums")}
+    if len(stem_args) < 2:
+        stem_args = {}
+
+    if pool is not None:
+        try:
+            if stem_args:
+                return pool.analyze(audio_path, duration=duration, stems=stem_args)
+            return pool.analyze(audio_path, duration=duration)
+        except Exception as e:
+            print(f"  Warning: Analysis error: {e}")
+        return DEFAULT_ANALYSIS
+
+    # Write analysis script to temp file
+    script_path = write_analysis_script()
 
     try:
         result = subprocess.run(
-            [VENV_PYTHON, script_path, str(audio_path)],
+            [VENV_PYTHON, script_path, str(audio_path), "--duration", json.dumps(duration)]
+            + (["--stems", json.dumps(stem_args)] if stem_args else []),
             capture_output=True,
             text=True,
-            timeout=120
+            timeout=ANALYSIS_TIMEOUT,
+            env=analysis_env()
         )
 
         # Parse output
@@ -424,78 +630,7 @@ def run_analysis(audio_path: Path) -> dict:
     finally:
         Path(script_path).unlink(missing_ok=True)
 
-    return {
-        "structure": {"tempo": 120, "beats": 32, "duration": 30},
-        "drums": {"kick_pattern": [1,0,0,0,1,0,0,0,1,0,0,0,1,0,0,0],
-                  "snare_pattern": [0,0,0,0,1,0,0,0,0,0,0,0,1,0,0,0],
-                  "hihat_pattern": [1,0,1,0,1,0,1,0,1,0,1,0,1,0,1,0],
-                  "style": "house"},
-        "harmony": {"key": "C", "mode": "minor", "chords": ["Cm", "Fm", "Gm", "Cm"]},
-        "melody": {"register": "mid", "range": 12}
-    }
-
-
-def pattern_to_mini(pattern: list, sound: str) -> str:
-    """Convert binary pattern to Strudel mini notation."""
-    if not any(pattern):
-        return ""
-
-    # Convert simple repeating patterns
-    if pattern == [1,0,0,0,1,0,0,0,1,0,0,0,1,0,0,0]:
-        return f"{sound}*4"
-    if pattern == [1,0,1,0,1,0,1,0,1,0,1,0,1,0,1,0]:
-        return f"{sound}*8"
-    if pattern == [1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1]:
-        return f"{sound}*16"
-    if pattern == [0,0,0,0,1,0,0,0,0,0,0,0,1,0,0,0]:
-        return f"~ {sound} ~ {sound}"  # backbeat
-    if pattern == [0,0,0,0,0,0,0,0,1,0,0,0,0,0,0,0]:
-        return f"~*2 {sound} ~"  # half-time snare
-
-    # Use euclidean if possible
-    hits = sum(pattern)
-    total = len(pattern)
-    if hits > 0 and hits < total:
-        euclidean = generate_euclidean(hits, total)
-        if euclidean == pattern:
-            return f"{sound}({hits},{total})"
-
-    # Group consecutive hits/rests for complex patterns
-    result = []
-    i = 0
-    while i < len(pattern):
-        if pattern[i]:
-            count = 1
-            while i + count < len(pattern) and pattern[i + count]:
-                count += 1
-            if count > 1:
-                result.append(f"{sound}*{count}")
-            else:
-                result.append(sound)
-            i += count
-        else:
-            count = 1
-            while i + count < len(pattern) and not pattern[i + count]:
-                count += 1
-            if count > 1:
-                result.append(f"~*{count}")
-            else:
-                result.append("~")
-            i += count
-
-    return " ".join(result)
-
-
-def generate_euclidean(hits: int, steps: int) -> list:
-    """Generate euclidean rhythm pattern."""
-    pattern = [0] * steps
-    bucket = 0
-    for i in range(steps):
-        bucket += hits
-        if bucket >= steps:
-            bucket -= steps
-            pattern[i] = 1
-    return pattern
+    return DEFAULT_ANALYSIS
 
 
 def generate_strudel_v2(analysis: dict, audio_name: str) -> str:
@@ -574,23 +709,43 @@ def generate_strudel_v2(analysis: dict, audio_name: str) -> str:
     return '\n'.join(lines)
 
 
-def process_audio(audio_path: Path, output_dir: Path, skip_demucs: bool = False) -> dict:
-    """Full pipeline: audio -> detailed analysis -> Strudel code."""
+def process_audio(audio_path: Path, output_dir: Path, skip_demucs: bool = False,
+                  pool: AnalysisWorkerPool = None, stems: dict = None, excerpt: dict = None,
+                  excerpt_bars: int = EXCERPT_BARS) -> dict:
+    """Full pipeline: audio -> excerpt -> detailed analysis -> Strudel code.
+
+    Demucs and the analysis run on the most representative excerpt_bars bars
+    of the track (0: on its first FALLBACK_DURATION seconds). stems and
+    excerpt may be passed in when the caller already separated the excerpt
+    or selected it ({} for a failed selection).
+    """
     output_dir.mkdir(parents=True, exist_ok=True)
 
     print(f"\n{'='*60}")
     print(f"Processing: {audio_path.name}")
     print(f"{'='*60}")
 
+    # Step 0: Pick the window the expensive stages run on
+    if excerpt is None and excerpt_bars:
+        excerpt = select_excerpts([audio_path], excerpt_bars).get(str(audio_path), {})
+    if excerpt:
+        print(f"Excerpt: {excerpt['start']:.1f}-{excerpt['end']:.1f}s "
+              f"({excerpt['bars']} bars of {excerpt['track_duration']:.0f}s)")
+        source, duration = Path(excerpt["path"]), None
+    else:
+        source, duration = audio_path, FALLBACK_DURATION
+
     # Step 1: Separate stems (optional)
-    if not skip_demucs:
-        stems = run_demucs(audio_path, output_dir)
+    if stems is not None:
+        print(f"[1/5] Using separated stems: {list(stems.keys())}")
+    elif not skip_demucs:
+        stems = run_demucs(source)
     else:
         print("[1/5] Skipping Demucs (--skip-demucs)")
         stems = {}
 
     # Step 2-4: Run combined analysis
-    analysis = run_analysis(audio_path)
+    analysis = run_analysis(source, pool, stems, duration)
 
     # Step 5: Generate Strudel code
     code = generate_strudel_v2(analysis, audio_path.name)
@@ -604,6 +759,7 @@ def process_audio(audio_path: Path, output_dir: Path, skip_demucs: bool = False)
     # Save results
     result = {
         "source": str(audio_path),
+        "excerpt": excerpt or None,
         "analysis": analysis,
         "code": code
     }
@@ -621,18 +777,72 @@ def process_audio(audio_path: Path, output_dir: Path, skip_demucs: bool = False)
     return result
 
 
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".flac", ".ogg", ".m4a", ".aiff"}
+
+
+def collect_audio_files(paths: list) -> list:
+    """Expand directories into the audio files they contain."""
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in AUDIO_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+
+def process_batch(audio_files: list, output_dir: Path, skip_demucs: bool = False,
+                  workers: int = 2, excerpt_bars: int = EXCERPT_BARS) -> list:
+    """Process many files against a pool of warm analysis workers."""
+    excerpts = {}
+    if excerpt_bars:
+        print(f"Selecting {excerpt_bars}-bar excerpts of {len(audio_files)} files...")
+        excerpts = select_excerpts(audio_files, excerpt_bars)
+    sources = {str(path): excerpts[str(path)]["path"] if excerpts.get(str(path)) else str(path)
+               for path in audio_files}
+
+    separated = {}
+    if not skip_demucs:
+        print(f"Separating {len(audio_files)} files with one resident Demucs model...")
+        separated = separate_stems(list(sources.values()))
+
+    with AnalysisWorkerPool(workers) as pool, ThreadPoolExecutor(workers) as executor:
+        futures = [executor.submit(process_audio, path, output_dir, skip_demucs, pool,
+                                   separated.get(sources[str(path)]) if not skip_demucs else None,
+                                   excerpts.get(str(path), {}), excerpt_bars)
+                   for path in audio_files]
+        return [f.result() for f in futures]
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Analyze audio and generate Strudel code"
     )
-    parser.add_argument("audio", type=Path, help="Audio file to analyze")
+    parser.add_argument("audio", type=Path, nargs="+",
+                        help="Audio file(s) or directories to analyze")
     parser.add_argument("-o", "--output", type=Path, default=Path("./output"),
                         help="Output directory")
     parser.add_argument("--skip-demucs", action="store_true",
                         help="Skip stem separation (faster)")
+    parser.add_argument("--bars", type=int, default=EXCERPT_BARS,
+                        help="Analyze the most representative N bars of each track "
+                             f"(default: {EXCERPT_BARS}; 0 = the first {FALLBACK_DURATION}s)")
+    parser.add_argument("--accurate-melody", action="store_true",
+                        help="Use full-range pyin for melody statistics (slow)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Persistent analysis workers (default: one-shot process for a "
+                             "single file, 2 workers for batches)")
     args = parser.parse_args()
 
-    if not args.audio.exists():
-        sys.exit(f"Error: {args.audio} not found")
+    missing = [p for p in args.audio if not p.exists()]
+    if missing:
+        sys.exit(f"Error: {missing[0]} not found")
 
-    process_audio(args.audio, args.output, args.skip_demucs)
+    if args.accurate_melody:
+        os.environ["MUSICMAN_MELODY_MODE"] = "accurate"
+
+    audio_files = collect_audio_files(args.audio)
+    if len(audio_files) == 1 and args.workers == 0:
+        process_audio(audio_files[0], args.output, args.skip_demucs, excerpt_bars=args.bars)
+    else:
+        process_batch(audio_files, args.output, args.skip_demucs, args.workers or 2, args.bars)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Batched feature extraction for many short clips (loops, stems, samples).
+
+The training-data phase needs features for thousands of clips a few
+seconds long. Analysing them one at a time pays Python and librosa call
+overhead per clip and runs many tiny FFTs. This module sorts the clips by
+length, groups them into buckets whose lengths differ by at most MAX_PAD,
+zero-pads each bucket into one (clips x samples) array, and computes
+every feature for the whole bucket in one vectorised call each:
+
+    stft     (clips, freqs, frames)   magnitude, one multichannel librosa.stft
+    mel      (clips, mels, frames)    from the STFT power
+    onset    (clips, frames)          onset strength of the log mel
+    chroma   (clips, 12, frames)      STFT chroma (one sparse product) or batched CQT
+    bands    (clips, 3, frames)       kick/snare/hi-hat band energy (one matmul)
+
+Buckets are capped at MAX_BATCH_SECONDS of padded audio so memory stays
+bounded. The log mel behind the onset envelope is floored per clip, so a
+clip's features do not depend on its bucket. Summaries (key, spectral
+centroid and bandwidth, band shares) are also computed per bucket, with
+padded frames masked out; tempo is estimated per clip from its unpadded
+onset envelope. They come back as one ClipFeatures record per clip, in
+input order.
+
+Usage:
+    from batch_features import extract_files
+    records = extract_files(["loop1.wav", "loop2.wav", ...])
+
+    python batch_features.py loops/*.wav [-o features.jsonl] [--chroma stft]
+"""
+
+import argparse
+import json
+import logging
+import sys
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from beat_features import DRUM_BANDS, DRUM_NAMES
+from chroma import chroma_from_stft, chromagram
+from key_detection import estimate_keys
+from onsets import band_energies
+
+BATCH_SR = 22050
+HOP_LENGTH = 512
+N_FFT = 2048
+N_MELS = 128
+MAX_PAD = 0.25              # a bucket's longest clip is at most this much longer than its shortest
+MAX_BATCH_SECONDS = 600.0   # padded audio per bucket (clips x longest clip)
+
+
+@dataclass
+class ClipFeatures:
+    name: str
+    duration: float
+    bpm: float
+    key: str
+    mode: str
+    key_confidence: float
+    centroid_mean: float
+    bandwidth_mean: float
+    band_share: Dict[str, float]                  # share of the kick/snare/hi-hat band energy
+    frames: Optional[Dict[str, np.ndarray]] = None  # per-frame features, with keep_frames
+
+
+def buckets(lengths: Sequence[int], sr: int = BATCH_SR, max_pad: float = MAX_PAD,
+            max_seconds: float = MAX_BATCH_SECONDS) -> List[List[int]]:
+    """Clip indices grouped so each group pads to its longest clip cheaply.
+
+    Clips are taken shortest first; a bucket closes when the next clip would
+    be more than max_pad longer than its first, or would take the padded
+    bucket past max_seconds.
+    """
+    order = np.argsort(lengths, kind="stable")
+    groups: List[List[int]] = []
+    current: List[int] = []
+    for i in order:
+        n = max(int(lengths[i]), 1)
+        if current and (n > (1 + max_pad) * max(lengths[current[0]], 1)
+                        or n * (len(current) + 1) > max_seconds * sr):
+            groups.append(current)
+            current = []
+        current.append(int(i))
+    if current:
+        groups.append(current)
+    return groups
+
+
+def stack(clips: Sequence[np.ndarray]) -> np.ndarray:
+    """(clips x samples) float32 array, zero-padded to the longest clip."""
+    Y = np.zeros((len(clips), max(len(y) for y in clips)), dtype=np.float32)
+    for row, y in zip(Y, clips):
+        row[:len(y)] = y
+    return Y
+
+
+def clip_db(power: np.ndarray, top_db: float = 80.0) -> np.ndarray:
+    """librosa.power_to_db for each clip of a (clips, bins, frames) batch on its own.
+
+    power_to_db on the whole batch would floor every clip at top_db below
+    the loudest clip, flattening quiet clips' onset envelopes.
+    """
+    db = 10.0 * np.log10(np.maximum(power, 1e-10))
+    return np.maximum(db, db.max(axis=(-2, -1), keepdims=True) - top_db)
+
+
+def batch_frames(Y: np.ndarray, sr: int = BATCH_SR, chroma_backend: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """Every frame-level feature of a (clips x samples) batch, clip axis first."""
+    import librosa
+
+    S = np.abs(librosa.stft(Y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    mel = librosa.feature.melspectrogram(S=S ** 2, sr=sr, n_mels=N_MELS)
+    onset = librosa.onset.onset_strength(S=clip_db(mel), sr=sr, hop_length=HOP_LENGTH)
+    if (chroma_backend or "stft") == "stft":
+        C = chroma_from_stft(S, sr, N_FFT)
+    else:
+        C = chromagram(Y, sr, HOP_LENGTH, chroma_backend)
+    return {
+        "stft": S,
+        "mel": mel,
+        "onset": onset,
+        "chroma": C,
+        "bands": band_energies(S, librosa.fft_frequencies(sr=sr, n_fft=N_FFT), DRUM_BANDS),
+    }
+
+
+def spectral_moments(S: np.ndarray, sr: int = BATCH_SR) -> np.ndarray:
+    """(clips, 2, frames) spectral centroid and bandwidth, from one matmul.
+
+    Matches librosa's spectral_centroid and spectral_bandwidth (p=2) but
+    without normalising a copy of S: both follow from the first three
+    moments of each frame's magnitude distribution over frequency.
+    """
+    import librosa
+
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=N_FFT)
+    moments = np.vstack([np.ones_like(freqs), freqs, freqs ** 2]).astype(np.float32) @ S
+    m0, m1, m2 = np.moveaxis(moments.astype(np.float64), -2, 0)
+    m0 = np.maximum(m0, 1e-12)
+    centroid = m1 / m0
+    bandwidth = np.sqrt(np.maximum(m2 / m0 - centroid ** 2, 0.0))
+    return np.stack([centroid, bandwidth], axis=-2)
+
+
+def _masked_mean(X: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Mean over the last (frame) axis of (clips, ..., frames), counting only mask frames."""
+    m = mask.reshape(mask.shape[0], *([1] * (X.ndim - 2)), mask.shape[1])
+    return (X * m).sum(axis=-1) / np.maximum(m.sum(axis=-1), 1)
+
+
+def summarize(frames: Dict[str, np.ndarray], lengths: Sequence[int], names: Sequence[str],
+              sr: int = BATCH_SR, keep_frames: bool = False) -> List[ClipFeatures]:
+    """ClipFeatures for each clip of a batch from batch_frames output."""
+    import librosa
+
+    S = frames["stft"]
+    n_frames = 1 + np.asarray(lengths) // HOP_LENGTH
+    mask = np.arange(S.shape[-1])[None, :] < n_frames[:, None]
+
+    # Per clip on its own frames: padding would stretch the tempogram window
+    bpm = [librosa.feature.tempo(onset_envelope=env[:n], sr=sr, hop_length=HOP_LENGTH)[0]
+           for env, n in zip(frames["onset"], n_frames)]
+    keys = estimate_keys(_masked_mean(frames["chroma"], mask).T)
+    centroid, bandwidth = _masked_mean(spectral_moments(S, sr), mask).T
+    band_sums = _masked_mean(frames["bands"], mask)
+    shares = band_sums / np.maximum(band_sums.sum(axis=1, keepdims=True), 1e-12)
+
+    records = []
+    for i, name in enumerate(names):
+        kept = None
+        if keep_frames:
+            kept = {k: np.ascontiguousarray(frames[k][i, ..., :n_frames[i]])
+                    for k in ("mel", "onset", "chroma", "bands")}
+        key, mode, conf = keys[i]
+        records.append(ClipFeatures(
+            name=str(name), duration=round(lengths[i] / sr, 3), bpm=round(float(bpm[i]), 1),
+            key=key, mode=mode, key_confidence=round(conf, 3),
+            centroid_mean=round(float(centroid[i]), 1), bandwidth_mean=round(float(bandwidth[i]), 1),
+            band_share={band: round(float(v), 3) for band, v in zip(DRUM_NAMES, shares[i])},
+            frames=kept))
+    return records
+
+
+def extract_batch(clips: Sequence[np.ndarray], names: Optional[Sequence[str]] = None,
+                  sr: int = BATCH_SR, keep_frames: bool = False,
+                  chroma_backend: Optional[str] = None) -> List[ClipFeatures]:
+    """Features of mono clips at sr, bucketed by length; records come back in input order.
+
+    The chroma backend defaults to stft, which reuses the batch STFT; "cqt"
+    runs a batched CQT instead.
+    """
+    names = list(names) if names is not None else [str(i) for i in range(len(clips))]
+    lengths = [len(y) for y in clips]
+    records: List[Optional[ClipFeatures]] = [None] * len(clips)
+    for group in buckets(lengths, sr):
+        frames = batch_frames(stack([clips[i] for i in group]), sr, chroma_backend)
+        for i, record in zip(group, summarize(frames, [lengths[i] for i in group],
+                                              [names[i] for i in group], sr, keep_frames)):
+            records[i] = record
+    return records
+
+
+def extract_files(paths: Sequence, sr: int = BATCH_SR, keep_frames: bool = False,
+                  chroma_backend: Optional[str] = None) -> List[ClipFeatures]:
+    """Decode (through the audio cache) and extract features for every file.
+
+    Files that fail to decode are logged and left out.
+    """
+    from audio_cache import load_audio
+
+    clips, names = [], []
+    for path in paths:
+        try:
+            y, _ = load_audio(path, sr=sr, mono=True)
+        except Exception as e:
+            logging.warning(f"Could not load {path}: {e}")
+            continue
+        clips.append(np.asarray(y, dtype=np.float32))
+        names.append(str(path))
+    return extract_batch(clips, names, sr, keep_frames, chroma_backend) if clips else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched features for many short clips")
+    parser.add_argument("audio_files", nargs="+", help="Clips, or directories to search for WAV files")
+    parser.add_argument("-o", "--output", help="Write one JSON record per line here (default: stdout)")
+    parser.add_argument("--chroma", choices=["stft", "cqt"], default="stft",
+                        help="Chroma backend (default: stft, from the batch STFT)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        stream=sys.stderr)
+    paths = []
+    for item in args.audio_files:
+        item = Path(item)
+        paths.extend(sorted(item.rglob("*.wav")) if item.is_dir() else [item])
+
+    records = extract_files(paths, chroma_backend=args.chroma)
+    lines = "".join(json.dumps({k: v for k, v in asdict(r).items() if k != "frames"}) + "\n"
+                    for r in records)
+    if args.output:
+        Path(args.output).write_text(lines)
+        logging.info(f"Wrote {len(records)} records to {args.output}")
+    else:
+        sys.stdout.write(lines)
+
+
+if __name__ == "__main__":
+    main()
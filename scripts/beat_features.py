@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Beat-synchronous feature tensor shared by the drum, bass, chord and
+structure analysers.
+
+Frame-level STFT/CQT data at a 512 hop has tens of thousands of frames per
+track, but the analysers only reason about 16th notes and beats. This module
+computes the expensive transforms once and reduces them onto the beat grid:
+
+    band_energy    (bands x steps)   peak kick/snare/hi-hat band energy per 16th
+    onset_mask     (bands x steps)   1.0 where a band onset lands on the 16th
+    chroma         (12 x beats)      mean chroma per beat
+    bass_salience  (pitches x beats) harmonic-summed low CQT per beat, E1-D#4
+
+All arrays are float32 and travel with the beat and 16th-step times. The
+grid is extended at the regular period to cover the whole signal, so
+step 0 is the first downbeat candidate and every onset has a step.
+
+The drum band edges, onset thresholds and onset gap default to the values
+below and are overridden by the drum config that drum_sweep.py writes
+from a parameter sweep against labelled tracks; its path and values are
+logged whenever one is applied.
+
+Given a FeatureStore per source, the frame-level transforms (percussive
+STFT, chroma, bass salience) are read from or written to the store, so
+retuning the drum bands, onset thresholds or beat grid only redoes the
+cheap reduction.
+
+Usage:
+    from beat_features import compute_beat_features
+    features = compute_beat_features(grid.beats, duration, bpm=grid.bpm,
+                                     percussive=(y_perc, sr), harmonic=(y_harm, sr),
+                                     stores={"percussive": FeatureStore(drums_path, duration=None)})
+
+Environment:
+    MUSICMAN_DRUM_CONFIG   Tuned drum settings (default: $MUSICMAN_CACHE_DIR/drum_config.json)
+"""
+
+import json
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from audio_cache import cache_root
+from chroma import chromagram, default_backend
+from feature_store import FeatureStore
+from multirate import frame_params, to_band_rate
+from onsets import band_energies, pick_band_onsets
+
+STEPS_PER_BEAT = 4
+HOP_LENGTH = 512
+
+# Kick, snare, hi-hat bands (Hz) and their onset thresholds on peak-normalised energy
+DRUM_NAMES = ["kick", "snare", "hihat"]
+DEFAULT_DRUM_BANDS = [(30, 120), (200, 400), (6000, 16000)]
+DEFAULT_DRUM_THRESHOLDS = [0.4, 0.5, 0.3]
+DEFAULT_ONSET_MIN_GAP = 0.05  # seconds between onsets in one band
+
+
+def drum_config_path() -> Path:
+    return Path(os.environ.get("MUSICMAN_DRUM_CONFIG", cache_root() / "drum_config.json"))
+
+
+def load_drum_config(path: Optional[Path] = None) -> Tuple[List[Tuple[float, float]], List[float], float]:
+    """(bands, thresholds, onset gap) from the drum config, or the defaults without one.
+
+    The config has {"bands": {name: [low, high]}, "thresholds": {name: t},
+    "onset_min_gap": seconds}; drums it leaves out keep their defaults.
+    """
+    bands, thresholds = list(DEFAULT_DRUM_BANDS), list(DEFAULT_DRUM_THRESHOLDS)
+    path = Path(path) if path is not None else drum_config_path()
+    if not path.exists():
+        return bands, thresholds, DEFAULT_ONSET_MIN_GAP
+    try:
+        config = json.loads(path.read_text())
+        for i, name in enumerate(DRUM_NAMES):
+            if name in config.get("bands", {}):
+                low, high = config["bands"][name]
+                bands[i] = (float(low), float(high))
+            if name in config.get("thresholds", {}):
+                thresholds[i] = float(config["thresholds"][name])
+        gap = float(config.get("onset_min_gap", DEFAULT_ONSET_MIN_GAP))
+    except (ValueError, TypeError, KeyError, OSError) as e:
+        logging.warning(f"Ignoring drum config {path}: {e}")
+        return list(DEFAULT_DRUM_BANDS), list(DEFAULT_DRUM_THRESHOLDS), DEFAULT_ONSET_MIN_GAP
+    # A warning so it shows even at import, before logging is configured.
+    logging.warning(f"Using drum config {path}: " + ", ".join(
+        f"{name} {bands[i][0]:g}-{bands[i][1]:g} Hz @ {thresholds[i]:g}" for i, name in enumerate(DRUM_NAMES))
+        + f", onset gap {gap:g}s")
+    return bands, thresholds, gap
+
+
+DRUM_BANDS, DRUM_THRESHOLDS, ONSET_MIN_GAP = load_drum_config()
+
+BASS_MIN_MIDI = 28  # E1
+BASS_PITCHES = 36   # E1 .. D#4
+BASS_HARMONICS = [(0, 1.0), (12, 0.5), (19, 1 / 3)]  # (semitones above, weight)
+
+Signal = Tuple[np.ndarray, float]
+
+
+@dataclass
+class BeatFeatures:
+    beat_times: np.ndarray     # (beats,) beat start times in seconds
+    step_times: np.ndarray     # (beats * STEPS_PER_BEAT,) 16th-note times
+    band_energy: np.ndarray    # (len(DRUM_BANDS), steps)
+    onset_mask: np.ndarray     # (len(DRUM_BANDS), steps)
+    chroma: np.ndarray         # (12, beats)
+    bass_salience: np.ndarray  # (BASS_PITCHES, beats)
+    bpm: float
+    duration: float
+
+    @property
+    def n_beats(self) -> int:
+        return len(self.beat_times)
+
+    @property
+    def n_steps(self) -> int:
+        return len(self.step_times)
+
+    @property
+    def bass_midi(self) -> np.ndarray:
+        return np.arange(BASS_MIN_MIDI, BASS_MIN_MIDI + BASS_PITCHES)
+
+    def band(self, name: str) -> int:
+        return DRUM_NAMES.index(name)
+
+    def onset_times(self, name: str) -> np.ndarray:
+        """Quantized onset times of one drum band."""
+        return self.step_times[self.onset_mask[self.band(name)] > 0]
+
+    def as_arrays(self) -> Dict[str, np.ndarray]:
+        """Plain dict of arrays (for shared memory, np.savez and JSON-free storage)."""
+        return {
+            "beat_times": self.beat_times, "step_times": self.step_times,
+            "band_energy": self.band_energy, "onset_mask": self.onset_mask,
+            "chroma": self.chroma, "bass_salience": self.bass_salience,
+            "bpm": np.float32(self.bpm), "duration": np.float32(self.duration),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict) -> "BeatFeatures":
+        fields = {k: np.asarray(arrays[k]) for k in ("beat_times", "step_times", "band_energy",
+                                                      "onset_mask", "chroma", "bass_salience")}
+        return cls(bpm=float(arrays["bpm"]), duration=float(arrays["duration"]), **fields)
+
+
+def regular_beats(bpm: float, duration: float) -> np.ndarray:
+    """A beat every 60/bpm seconds from 0, for callers without a tracked grid."""
+    return np.arange(0.0, duration, 60.0 / bpm if bpm > 0 else 0.5)
+
+
+def extend_grid(beat_times: Sequence[float], duration: float,
+                bpm: Optional[float] = None) -> np.ndarray:
+    """Pad a tracked grid at its median period so it spans [0, duration)."""
+    beats = np.asarray(beat_times, dtype=float)
+    if len(beats) > 1:
+        period = float(np.median(np.diff(beats)))
+    else:
+        period = 60.0 / bpm if bpm else 0.5
+    if len(beats) == 0:
+        return np.arange(0.0, duration, period)
+    before = beats[0] - period * np.arange(int(beats[0] // period), 0, -1)
+    after = beats[-1] + period * np.arange(1, int((duration - beats[-1]) // period) + 1)
+    grid = np.round(np.concatenate([before, beats, after]), 6)
+    return grid[(grid >= 0) & (grid < duration)]
+
+
+def subdivide(beat_times: np.ndarray, duration: float, steps: int = STEPS_PER_BEAT) -> np.ndarray:
+    """Evenly spaced sub-beat times inside every beat."""
+    period = float(np.median(np.diff(beat_times))) if len(beat_times) > 1 else duration
+    ends = np.append(beat_times[1:], min(duration, beat_times[-1] + period))
+    frac = np.arange(steps) / steps
+    return (beat_times[:, None] + frac[None, :] * (ends - beat_times)[:, None]).ravel()
+
+
+def _bounds(times: np.ndarray, sr: float, hop_length: int, n_frames: int) -> np.ndarray:
+    """Frame index where each span starting at times[i] begins (plus the end)."""
+    frames = np.floor(np.asarray(times) * sr / hop_length).astype(int)
+    return np.clip(np.append(frames, n_frames), 0, n_frames)
+
+
+def segment_mean(X: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """Mean of each column span [bounds[i], bounds[i+1]) via one cumulative sum."""
+    cs = np.concatenate([np.zeros((X.shape[0], 1)), np.cumsum(X, axis=1)], axis=1)
+    counts = np.maximum(np.diff(bounds), 1)
+    starts = np.minimum(bounds[:-1], X.shape[1] - 1)
+    empty = np.diff(bounds) == 0
+    means = (cs[:, bounds[1:]] - cs[:, bounds[:-1]]) / counts
+    # Spans shorter than a frame take the frame they fall in
+    means[:, empty] = X[:, starts[empty]]
+    return means.astype(np.float32)
+
+
+def segment_max(X: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    """Max of each column span [bounds[i], bounds[i+1])."""
+    starts = np.minimum(bounds[:-1], X.shape[1] - 1)
+    out = np.maximum.reduceat(X, starts, axis=1)
+    empty = np.diff(bounds) == 0
+    out[:, empty] = X[:, starts[empty]]
+    return out.astype(np.float32)
+
+
+def drum_energy(y: Optional[np.ndarray], sr: float, hop_length: int = HOP_LENGTH,
+                S: Optional[np.ndarray] = None) -> np.ndarray:
+    """(bands x frames) summed STFT magnitude in the kick, snare and hi-hat bands.
+
+    S may be the magnitude STFT of y at n_fft = 4 * hop_length, if already computed.
+    """
+    import librosa
+
+    n_fft = 2048 * hop_length // HOP_LENGTH
+    if S is None:
+        S = np.abs(librosa.stft(np.asarray(y), n_fft=n_fft, hop_length=hop_length))
+    return band_energies(S, librosa.fft_frequencies(sr=sr, n_fft=n_fft), DRUM_BANDS)
+
+
+def _frames(store: Optional[FeatureStore], name: str, params: Dict, compute: Callable[[], np.ndarray],
+            dtype=np.float32) -> np.ndarray:
+    return compute() if store is None else store.get_or_compute(name, params, compute, dtype)
+
+
+def percussive_stft(y: np.ndarray, sr: float, store: Optional[FeatureStore] = None) -> np.ndarray:
+    """Magnitude STFT drum_energy works from; with a store, kept there as float16."""
+    import librosa
+
+    n_fft = 2048
+    return _frames(store, "stft", {"sr": sr, "n_fft": n_fft, "hop_length": HOP_LENGTH},
+                   lambda: np.abs(librosa.stft(np.asarray(y), n_fft=n_fft, hop_length=HOP_LENGTH)),
+                   dtype=np.float16)
+
+
+def percussive_energy(y: np.ndarray, sr: float, store: Optional[FeatureStore] = None) -> np.ndarray:
+    """drum_energy of y, through the stored STFT when there is a store."""
+    if store is None:
+        return drum_energy(y, sr)
+    return drum_energy(None, sr, S=percussive_stft(y, sr, store))
+
+
+def drum_features(energy: np.ndarray, sr: float, step_times: np.ndarray,
+                  hop_length: int = HOP_LENGTH) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-16th band energy and onset mask from frame-level drum band energy."""
+    n_frames = energy.shape[1]
+
+    # Steps own the span centred on them, so an onset counts for its nearest 16th
+    half = np.diff(step_times, append=step_times[-1] + (step_times[-1] - step_times[-2]
+                                                        if len(step_times) > 1 else 0.125)) / 2
+    starts = np.maximum(step_times - np.append(half[:1], half[:-1]), 0)
+    band_energy = segment_max(energy, _bounds(starts, sr, hop_length, n_frames))
+
+    min_gap = int(sr / hop_length * ONSET_MIN_GAP)
+    onset_mask = np.zeros_like(band_energy)
+    for b, frames in enumerate(pick_band_onsets(energy, DRUM_THRESHOLDS, min_gap)):
+        t = frames * hop_length / sr
+        idx = np.searchsorted(step_times + half, t)
+        onset_mask[b, idx[idx < len(step_times)]] = 1.0
+    return band_energy, onset_mask
+
+
+def beat_chroma(y: np.ndarray, sr: float, beat_times: np.ndarray,
+                backend: Optional[str] = None, store: Optional[FeatureStore] = None) -> np.ndarray:
+    """Mean chroma per beat (backend as in chroma.py: cqt, or the faster stft)."""
+    _, hop_length = frame_params(sr)
+    backend = backend or default_backend()
+    chroma = _frames(store, "chroma", {"sr": sr, "hop_length": hop_length, "backend": backend},
+                     lambda: chromagram(y, sr, hop_length, backend))
+    return segment_mean(chroma, _bounds(beat_times, sr, hop_length, chroma.shape[1]))
+
+
+def bass_salience(y: np.ndarray, sr: float, beat_times: np.ndarray,
+                  store: Optional[FeatureStore] = None) -> np.ndarray:
+    """Harmonic-summed low-register CQT magnitude per beat, one row per semitone."""
+    import librosa
+
+    y, sr = to_band_rate(np.asarray(y), sr, "bass")
+    _, hop_length = frame_params(sr)
+
+    def salience():
+        top = max(shift for shift, _ in BASS_HARMONICS)
+        C = np.abs(librosa.cqt(y, sr=sr, hop_length=hop_length, fmin=librosa.midi_to_hz(BASS_MIN_MIDI),
+                               n_bins=BASS_PITCHES + top, bins_per_octave=12))
+        return sum(weight * C[shift:shift + BASS_PITCHES] for shift, weight in BASS_HARMONICS)
+
+    sal = _frames(store, "bass_salience", {"band_sr": sr, "hop_length": hop_length,
+                                           "min_midi": BASS_MIN_MIDI, "pitches": BASS_PITCHES,
+                                           "harmonics": BASS_HARMONICS}, salience)
+    return segment_mean(sal, _bounds(beat_times, sr, hop_length, sal.shape[1]))
+
+
+def _grid(beat_times: Sequence[float], duration: float,
+          bpm: Optional[float]) -> Tuple[np.ndarray, np.ndarray, float]:
+    beats = extend_grid(beat_times, duration, bpm)
+    if len(beats) == 0:
+        beats = np.zeros(1)
+    steps = subdivide(beats, duration)
+    if bpm is None:
+        bpm = 60.0 / float(np.median(np.diff(beats))) if len(beats) > 1 else 120.0
+    return beats, steps, float(bpm)
+
+
+def compute_beat_features(beat_times: Sequence[float], duration: float, bpm: Optional[float] = None,
+                          percussive: Optional[Signal] = None, harmonic: Optional[Signal] = None,
+                          bass: Optional[Signal] = None,
+                          stores: Optional[Dict[str, FeatureStore]] = None) -> BeatFeatures:
+    """Build the tensor from whichever sources are available.
+
+    percussive feeds the drum bands, harmonic the chroma, and bass the bass
+    salience (pass the harmonic signal again when there is no bass stem).
+    Each source is a (signal, sample_rate) pair and may be at its own rate.
+    Missing sources leave zero-row arrays. stores maps a source name to the
+    FeatureStore of that signal, whose context must say how the signal was
+    obtained from the stored audio (duration, separation); its frame-level
+    features are then reused.
+    """
+    beats, steps, bpm = _grid(beat_times, duration, bpm)
+    stores = stores or {}
+
+    if percussive is not None:
+        y, sr = percussive
+        band_energy, onset_mask = drum_features(percussive_energy(y, sr, stores.get("percussive")),
+                                                sr, steps)
+    else:
+        band_energy = onset_mask = np.zeros((0, len(steps)), dtype=np.float32)
+    chroma = (beat_chroma(harmonic[0], harmonic[1], beats, store=stores.get("harmonic"))
+              if harmonic is not None else np.zeros((0, len(beats)), dtype=np.float32))
+    salience = (bass_salience(bass[0], bass[1], beats, store=stores.get("bass")) if bass is not None
+                else np.zeros((0, len(beats)), dtype=np.float32))
+
+    return BeatFeatures(beat_times=beats, step_times=steps, band_energy=band_energy,
+                        onset_mask=onset_mask, chroma=chroma, bass_salience=salience,
+                        bpm=bpm, duration=float(duration))
+
+
+def beat_features_from_frames(beat_times: Sequence[float], duration: float, sr: float,
+                              bpm: Optional[float] = None, hop_length: int = HOP_LENGTH,
+                              energy: Optional[np.ndarray] = None,
+                              chroma: Optional[np.ndarray] = None) -> BeatFeatures:
+    """The tensor from frame-level drum_energy and chroma already in hand.
+
+    For callers that computed the frames themselves, e.g. block-wise in
+    streaming.py; both must be centred frames at hop_length.
+    """
+    beats, steps, bpm = _grid(beat_times, duration, bpm)
+
+    if energy is not None:
+        band_energy, onset_mask = drum_features(np.asarray(energy), sr, steps, hop_length)
+    else:
+        band_energy = onset_mask = np.zeros((0, len(steps)), dtype=np.float32)
+    per_beat = (segment_mean(np.asarray(chroma), _bounds(beats, sr, hop_length, chroma.shape[1]))
+                if chroma is not None else np.zeros((0, len(beats)), dtype=np.float32))
+
+    return BeatFeatures(beat_times=beats, step_times=steps, band_energy=band_energy,
+                        onset_mask=onset_mask, chroma=per_beat,
+                        bass_salience=np.zeros((0, len(beats)), dtype=np.float32),
+                        bpm=bpm, duration=float(duration))
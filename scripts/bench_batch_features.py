@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark: batched clip features vs. looping over analyze_audio.
+
+Writes a set of short synthetic loops (or uses the given clips), then
+times analyze_audio.analyze_audio on each clip in turn and
+batch_features.extract_files on all of them, each against its own empty
+cache directory so neither run reuses the other's decoded audio or beat
+grids. Reports clips per second for both and how often their tempos agree.
+
+Usage:
+    python bench_batch_features.py [clip ...] [--count 200] [--min-seconds 2] [--max-seconds 12]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+SR = 22050
+
+
+def synthetic_loop(seconds: float, seed: int) -> np.ndarray:
+    """A kick/hat/bass loop at a random tempo."""
+    rng = np.random.default_rng(seed)
+    bpm = rng.uniform(90, 140)
+    beat = int(60.0 / bpm * SR)
+    n = int(seconds * SR)
+    t = np.arange(n) / SR
+    y = 0.1 * np.sin(2 * np.pi * 55 * 2 ** (rng.integers(12) / 12) * t)
+    kick = np.sin(2 * np.pi * 60 * t[:2000]) * np.exp(-t[:2000] * 30)
+    hat = rng.standard_normal(600) * np.exp(-np.arange(600) / 100)
+    for start in range(0, n - 2000, beat):
+        y[start:start + 2000] += 0.8 * kick
+        off = start + beat // 2
+        if off + 600 < n:
+            y[off:off + 600] += 0.2 * hat
+    return (y + 0.003 * rng.standard_normal(n)).astype(np.float32)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched clip features vs. a per-clip loop")
+    parser.add_argument("audio_files", nargs="*", help="Clips to use (default: synthetic loops)")
+    parser.add_argument("--count", type=int, default=200, help="Number of synthetic clips")
+    parser.add_argument("--min-seconds", type=float, default=2.0, help="Shortest synthetic clip")
+    parser.add_argument("--max-seconds", type=float, default=12.0, help="Longest synthetic clip")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", message="n_fft=.* is too large")
+
+    import soundfile as sf
+
+    import analyze_audio
+    from batch_features import extract_files
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [Path(p) for p in args.audio_files]
+        if not paths:
+            rng = np.random.default_rng(0)
+            for i in range(args.count):
+                path = Path(tmp) / f"clip_{i:04d}.wav"
+                sf.write(path, synthetic_loop(rng.uniform(args.min_seconds, args.max_seconds), i), SR)
+                paths.append(path)
+
+        # Warm up imports and numba so neither timed run pays for them
+        os.environ["MUSICMAN_CACHE_DIR"] = str(Path(tmp) / "cache_warmup")
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze_audio.analyze_audio(str(paths[0]), stream=False)
+        extract_files(paths[:1])
+
+        os.environ["MUSICMAN_CACHE_DIR"] = str(Path(tmp) / "cache_loop")
+        with contextlib.redirect_stdout(io.StringIO()):
+            looped, t_loop = timed(lambda: [analyze_audio.analyze_audio(str(p), stream=False)
+                                            for p in paths])
+        os.environ["MUSICMAN_CACHE_DIR"] = str(Path(tmp) / "cache_batch")
+        batched, t_batch = timed(lambda: extract_files(paths))
+
+    n = len(paths)
+    bpm_loop = np.array([a["bpm"] for a in looped])
+    bpm_batch = np.array([r.bpm for r in batched])
+    agree = np.mean(np.abs(bpm_loop - bpm_batch) <= 0.04 * bpm_loop) if n else 0.0
+    total = sum(r.duration for r in batched)
+    print(f"{n} clips, {total:.0f}s of audio")
+    print(f"Loop over analyze_audio: {t_loop:7.2f}s  {n / t_loop:7.1f} clips/s")
+    print(f"extract_files (batched): {t_batch:7.2f}s  {n / t_batch:7.1f} clips/s  "
+          f"({t_loop / t_batch:.1f}x)")
+    print(f"Tempo agreement (within 4%): {agree:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmark: STFT chroma vs. CQT chroma on the key and chord outputs.
+
+Runs the key path (harmonic chroma -> estimate_key) and the chord path
+(per-beat chroma at the chords band rate -> recognize_chords with the key
+prior) once per backend on each track, and reports the time of both
+paths per backend and how often their outputs differ: the key per track and
+the chord label per beat. Without audio files it builds a reference set
+of synthetic progressions in random keys, whose true keys and chords are
+also scored.
+
+Usage:
+    python bench_chroma.py [audio_file ...] [--seconds 60] [--tracks 12]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import chords
+from beat_features import beat_chroma
+from chroma import BACKENDS
+from key_detection import PITCH_CLASSES, estimate_key, harmonic_chroma
+from multirate import to_band_rate
+
+SR = 22050
+
+# Scale degree and chord suffix of each bar's chord
+PROGRESSIONS = {
+    "major": [[(0, ""), (9, "m"), (5, ""), (7, "")], [(0, ""), (7, ""), (9, "m"), (5, "")],
+              [(2, "m"), (7, ""), (0, ""), (0, "")]],
+    "minor": [[(0, "m"), (8, ""), (3, ""), (10, "")], [(0, "m"), (5, "m"), (7, "m"), (0, "m")],
+              [(0, "m"), (10, ""), (8, ""), (10, "")]],
+}
+
+
+def _tone(midi: float, t: np.ndarray, partials: int) -> np.ndarray:
+    f = 440.0 * 2 ** ((midi - 69) / 12)
+    return sum(np.sin(2 * np.pi * f * k * t) / k for k in range(1, partials + 1))
+
+
+def synthetic_track(seconds: float, seed: int):
+    """A bass, pad and hi-hat loop in a random key: (y, beat_times, key, mode, chord per beat)."""
+    rng = np.random.default_rng(seed)
+    mode = ["major", "minor"][seed % 2]
+    tonic = int(rng.integers(12))
+    bpm = float(rng.uniform(96, 132))
+    progression = PROGRESSIONS[mode][int(rng.integers(len(PROGRESSIONS[mode])))]
+    beat = 60.0 / bpm
+    n_bars = max(1, int(seconds / (4 * beat)))
+    bar_t = np.arange(int(4 * beat * SR)) / SR
+    env = np.minimum(1.0, bar_t / 0.02) * np.exp(-bar_t / 3.0)
+
+    bars, labels = [], []
+    for i in range(n_bars):
+        degree, suffix = progression[i % len(progression)]
+        root = (tonic + degree) % 12
+        third = 3 if suffix == "m" else 4
+        pad = sum(_tone(60 + (root + iv) % 12, bar_t, 4) for iv in (0, third, 7))
+        bass = _tone(36 + root, bar_t, 6)
+        bars.append(0.08 * env * pad + 0.15 * env * bass)
+        labels.extend([f"{PITCH_CLASSES[root]}{suffix}"] * 4)
+    y = np.concatenate(bars)
+
+    hat_len = int(0.03 * SR)
+    hat = rng.standard_normal(hat_len) * np.exp(-np.arange(hat_len) / (0.005 * SR))
+    for start in np.arange(0, len(y) - hat_len, int(beat * SR / 2)):
+        y[start:start + hat_len] += 0.05 * hat
+    y = y + 0.005 * rng.standard_normal(len(y))
+    return (y.astype(np.float32), np.arange(n_bars * 4) * beat,
+            PITCH_CLASSES[tonic], mode, labels)
+
+
+def analyse(y: np.ndarray, beats: np.ndarray, backend: str):
+    """(key, mode, chord label per beat, (key seconds, chord chroma seconds)) with one backend.
+
+    The key time includes the harmonic separation, which both backends pay.
+    """
+    start = time.perf_counter()
+    key, mode, _ = estimate_key(harmonic_chroma(y, SR, backend))
+    key_time = time.perf_counter() - start
+    y_band, sr_band = to_band_rate(y, SR, "chords")
+    start = time.perf_counter()
+    chroma = beat_chroma(y_band, sr_band, beats, backend)
+    chord_time = time.perf_counter() - start
+    segments = chords.recognize_chords(chroma, beats, end_time=len(y) / SR,
+                                       prior=chords.key_prior(key, mode))
+    return key, mode, chords.beat_labels(segments), (key_time, chord_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark STFT vs. CQT chroma agreement")
+    parser.add_argument("audio_files", nargs="*", help="Tracks to compare (default: synthetic set)")
+    parser.add_argument("--seconds", type=float, default=60, help="Seconds of audio per track")
+    parser.add_argument("--tracks", type=int, default=12, help="Size of the synthetic set")
+    args = parser.parse_args()
+
+    tracks = []
+    if args.audio_files:
+        from audio_cache import load_audio
+        from tempo import track_beats
+        for path in args.audio_files:
+            y, _ = load_audio(path, sr=SR, duration=args.seconds)
+            y = np.asarray(y)
+            tracks.append((path, y, np.asarray(track_beats(y=y, sr=SR).beats), None))
+    else:
+        for seed in range(args.tracks):
+            y, beats, key, mode, labels = synthetic_track(args.seconds, seed)
+            tracks.append((f"synthetic {seed} ({key} {mode})", y, beats, (f"{key} {mode}", labels)))
+
+    # Warm up the filter cache and FFT plans so the first track is not penalised
+    for backend in BACKENDS:
+        analyse(tracks[0][1][:SR * 4], tracks[0][2][:4], backend)
+
+    times = {backend: np.zeros(2) for backend in BACKENDS}
+    key_agree = beats_agree = beats_total = 0
+    truth_keys = dict.fromkeys(BACKENDS, 0)
+    truth_beats = dict.fromkeys(BACKENDS, 0)
+    print(f"{'track':<32} {'key s cqt/stft':>15} {'chord s cqt/stft':>17}  {'key cqt/stft':<20} "
+          f"{'chords':>7}")
+    for name, y, beats, truth in tracks:
+        out = {backend: analyse(y, beats, backend) for backend in BACKENDS}
+        (k1, m1, l1, t1), (k2, m2, l2, t2) = out["cqt"], out["stft"]
+        times["cqt"] += t1
+        times["stft"] += t2
+        n = min(len(l1), len(l2))
+        same = sum(a == b for a, b in zip(l1[:n], l2[:n]))
+        key_agree += (k1, m1) == (k2, m2)
+        beats_agree += same
+        beats_total += n
+        print(f"{str(name)[-32:]:<32} {t1[0]:7.2f}/{t2[0]:<7.2f} {t1[1]:8.2f}/{t2[1]:<8.2f}  "
+              f"{f'{k1} {m1}/{k2} {m2}':<20} {same / max(n, 1):6.0%}")
+        if truth is not None:
+            key, labels = truth
+            for backend, (k, m, lab, _) in out.items():
+                truth_keys[backend] += f"{k} {m}" == key
+                truth_beats[backend] += sum(a == b for a, b in zip(lab, labels))
+
+    print()
+    for i, step in enumerate(["Key (HPSS + chroma)", "Chord chroma"]):
+        cqt, stft = times["cqt"][i], times["stft"][i]
+        print(f"{step}: cqt {cqt:.2f}s, stft {stft:.2f}s ({cqt / max(stft, 1e-9):.1f}x faster)")
+    print(f"Agreement: key {key_agree}/{len(tracks)} tracks, "
+          f"chords {beats_agree / max(beats_total, 1):.1%} of beats")
+    if not args.audio_files:
+        n_beats = sum(len(t[3][1]) for t in tracks)
+        for backend in BACKENDS:
+            print(f"Against the truth, {backend}: key {truth_keys[backend]}/{len(tracks)}, "
+                  f"chords {truth_beats[backend] / max(n_beats, 1):.1%} of beats")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark: fast YIN melody statistics vs. full-range pyin.
+
+Runs both modes of pitch_tracking.melody_stats on each track (or on a
+synthetic melody), reports the speedup, and checks agreement on the values
+analyze_melody keeps: register, range and the low/high notes.
+
+Usage:
+    python bench_melody.py [audio_file ...] [--seconds 30] [--harmonic]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from pitch_tracking import melody_stats
+
+SR = 22050
+
+
+def synthetic_melody(seconds: float, seed: int = 0) -> np.ndarray:
+    """A plucked-synth line over two octaves with rests and a little noise."""
+    rng = np.random.default_rng(seed)
+    note_len = 0.25
+    n_notes = int(seconds / note_len)
+    notes = rng.choice([57, 60, 62, 64, 67, 69, 72, 74, 76, 79], size=n_notes)
+    rests = rng.random(n_notes) < 0.2
+    t = np.arange(int(note_len * SR)) / SR
+    env = np.exp(-t * 4)
+    out = []
+    for note, rest in zip(notes, rests):
+        f = 440.0 * 2 ** ((note - 69) / 12)
+        tone = sum(np.sin(2 * np.pi * f * k * t) / k for k in (1, 2, 3))
+        out.append(np.zeros_like(t) if rest else 0.3 * env * tone)
+    y = np.concatenate(out)
+    return (y + 0.01 * rng.standard_normal(len(y))).astype(np.float32)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fast vs. pyin melody statistics")
+    parser.add_argument("audio_files", nargs="*", help="Tracks to compare (default: synthetic)")
+    parser.add_argument("--seconds", type=float, default=30, help="Seconds of audio per track")
+    parser.add_argument("--harmonic", action="store_true",
+                        help="Run HPSS first, as the analysis script does without stems")
+    args = parser.parse_args()
+
+    tracks = []
+    if args.audio_files:
+        from audio_cache import load_audio
+        for path in args.audio_files:
+            y, _ = load_audio(path, sr=SR, duration=args.seconds)
+            tracks.append((path, np.asarray(y)))
+    else:
+        tracks.append(("synthetic", synthetic_melody(args.seconds)))
+
+    if args.harmonic:
+        import librosa
+        tracks = [(name, librosa.effects.harmonic(y)) for name, y in tracks]
+
+    # Warm up numba/resampler state so the first track is not penalised
+    melody_stats(tracks[0][1][:SR * 2], SR, "fast")
+
+    total_fast = total_pyin = 0.0
+    register_agree = 0
+    print(f"{'track':<32} {'pyin s':>7} {'fast s':>7} {'speedup':>8}  "
+          f"{'register':<11} {'range':<7} {'low/high':<13}")
+    for name, y in tracks:
+        accurate, t_pyin = timed(lambda: melody_stats(y, SR, "accurate"))
+        fast, t_fast = timed(lambda: melody_stats(y, SR, "fast"))
+        total_pyin += t_pyin
+        total_fast += t_fast
+        register_agree += accurate["register"] == fast["register"]
+        print(f"{str(name)[-32:]:<32} {t_pyin:7.2f} {t_fast:7.2f} {t_pyin / t_fast:7.0f}x  "
+              f"{accurate['register']}/{fast['register']:<6} "
+              f"{accurate['range']:>2}/{fast['range']:<4} "
+              f"{accurate['low_midi']}-{accurate['high_midi']}/{fast['low_midi']}-{fast['high_midi']}"
+              f"  (fast read {fast['analyzed_seconds']}s)")
+
+    print(f"\nTotal: pyin {total_pyin:.2f}s, fast {total_fast:.2f}s "
+          f"({total_pyin / total_fast:.0f}x faster); "
+          f"register agreement {register_agree}/{len(tracks)}")
+
+
+if __name__ == "__main__":
+    main()
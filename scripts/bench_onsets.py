@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: vectorized band onset picking vs. the per-frame Python loop.
+
+Builds kick/snare/hi-hat band energies for a synthetic (or real) track,
+runs the old frame-by-frame detector and onsets.pick_band_onsets on them,
+checks that both find the same onsets, and reports the speedup. The batch
+form is timed on --tracks copies of the same energies.
+
+Usage:
+    python bench_onsets.py [audio_file] [--minutes 5] [--repeat 5] [--tracks 32]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from onsets import band_energies, pick_band_onsets, pick_band_onsets_batch
+
+SR = 22050
+HOP = 512
+BANDS = [(30, 120), (200, 400), (6000, 16000)]
+THRESHOLDS = [0.4, 0.5, 0.3]
+
+
+def loop_band_onsets(energy, sr, threshold=0.3):
+    """The original detect_band_onsets from ANALYSIS_SCRIPT, for reference."""
+    import librosa
+
+    if np.max(energy) > 0:
+        energy = energy / np.max(energy)
+    peaks = []
+    min_gap = int(sr / HOP * 0.05)
+    last_peak = -min_gap
+    for i in range(1, len(energy) - 1):
+        if (energy[i] > threshold and
+                energy[i] > energy[i-1] and
+                energy[i] > energy[i+1] and
+                i - last_peak >= min_gap):
+            peaks.append(librosa.frames_to_time(i, sr=sr, hop_length=HOP))
+            last_peak = i
+    return peaks
+
+
+def synthetic_energy(minutes: float, seed: int = 0) -> np.ndarray:
+    """Noisy band envelopes with decaying hits, shaped like a real drum stem."""
+    rng = np.random.default_rng(seed)
+    n = int(minutes * 60 * SR / HOP)
+    energy = rng.gamma(2.0, 0.05, size=(len(BANDS), n)).astype(np.float32)
+    decay = np.exp(-np.arange(8) / 2.0)
+    for band, every in enumerate([21, 43, 5]):
+        hits = np.zeros(n, dtype=np.float32)
+        hits[::every] = rng.uniform(0.6, 1.0, size=len(hits[::every]))
+        energy[band] += np.convolve(hits, decay)[:n]
+    return energy
+
+
+def best_time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vectorized band onset picking")
+    parser.add_argument("audio_file", nargs="?", help="Use this track instead of synthetic energies")
+    parser.add_argument("--minutes", type=float, default=5, help="Length of the synthetic track")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repetitions (best is reported)")
+    parser.add_argument("--tracks", type=int, default=32, help="Tracks for the batch timing")
+    args = parser.parse_args()
+
+    if args.audio_file:
+        import librosa
+        from audio_cache import load_audio
+
+        y, _ = load_audio(args.audio_file, sr=SR)
+        S = np.abs(librosa.stft(np.asarray(y), hop_length=HOP))
+        energy = band_energies(S, librosa.fft_frequencies(sr=SR), BANDS)
+    else:
+        energy = synthetic_energy(args.minutes)
+    min_gap = int(SR / HOP * 0.05)
+    print(f"Energy matrix: {energy.shape[0]} bands x {energy.shape[1]} frames "
+          f"({energy.shape[1] * HOP / SR / 60:.1f} min)")
+
+    loop_result = [loop_band_onsets(e, SR, t) for e, t in zip(energy, THRESHOLDS)]
+    vec_result = pick_band_onsets(energy, THRESHOLDS, min_gap)
+    for name, old, new in zip(["kick", "snare", "hihat"], loop_result, vec_result):
+        new_times = new * HOP / SR
+        same = len(old) == len(new) and np.allclose(old, new_times)
+        print(f"  {name:<6} {len(new):>6} onsets  {'match' if same else 'MISMATCH'}")
+
+    t_loop = best_time(lambda: [loop_band_onsets(e, SR, t) for e, t in zip(energy, THRESHOLDS)],
+                       max(1, args.repeat // 2))
+    t_vec = best_time(lambda: pick_band_onsets(energy, THRESHOLDS, min_gap), args.repeat)
+    print(f"Per-frame loop: {t_loop * 1000:9.1f} ms")
+    print(f"Vectorized:     {t_vec * 1000:9.1f} ms  ({t_loop / t_vec:.0f}x faster)")
+
+    batch = [energy] * args.tracks
+    t_batch = best_time(lambda: pick_band_onsets_batch(batch, THRESHOLDS, min_gap), args.repeat)
+    print(f"Batch of {args.tracks}:    {t_batch * 1000:9.1f} ms  "
+          f"({t_batch / args.tracks * 1000:.2f} ms/track)")
+
+
+if __name__ == "__main__":
+    main()
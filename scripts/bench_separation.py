@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark chunk-parallel Demucs separation against a single-process run.
+
+Separates the same audio once as a whole (the reference) and then with each
+requested chunk configuration, reporting wall time, speedup and per-stem SNR
+against the reference. Nothing is written to the stem store.
+
+Usage:
+    python bench_separation.py track.mp3 [--seconds 180] [--workers 1 2 4]
+        [--chunk-seconds 30 60] [--chunk-overlap 2]
+
+Requirements (ML venv):
+    pip install demucs torch soundfile
+"""
+
+import argparse
+import json
+import time
+from dataclasses import replace
+
+import numpy as np
+
+from audio_cache import load_audio
+from separation import SeparationService, SeparationSettings, default_threads
+
+
+def snr_db(reference: np.ndarray, estimate: np.ndarray) -> float:
+    """Signal-to-noise ratio of estimate against reference, in dB."""
+    noise = np.sum((reference - estimate) ** 2)
+    signal = np.sum(reference ** 2)
+    if noise == 0:
+        return float("inf")
+    return float(10 * np.log10((signal + 1e-12) / noise))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunk-parallel separation")
+    parser.add_argument("audio_file", help="Audio file to separate")
+    parser.add_argument("-n", "--model", default="htdemucs", help="Demucs model name")
+    parser.add_argument("--seconds", type=float, default=180, help="Only use the first N seconds")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to try")
+    parser.add_argument("--chunk-seconds", type=float, nargs="+", default=[30, 60], help="Chunk lengths to try")
+    parser.add_argument("--chunk-overlap", type=float, default=2.0, help="Crossfade overlap in seconds")
+    parser.add_argument("--json", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    reference_service = SeparationService(args.model, device="cpu", threads=default_threads(), workers=1)
+    model = reference_service.load_model()
+    y, sr = load_audio(args.audio_file, sr=model.samplerate, mono=False, duration=args.seconds)
+    wav = np.atleast_2d(np.asarray(y))
+    if wav.shape[0] < model.audio_channels:
+        wav = np.repeat(wav[:1], model.audio_channels, axis=0)
+    wav = wav[:model.audio_channels]
+    audio_seconds = wav.shape[1] / sr
+
+    settings = SeparationSettings(model=args.model)
+    start = time.time()
+    reference = reference_service.separate_array(wav, settings)
+    base_wall = time.time() - start
+    print(f"Audio: {audio_seconds:.1f}s, cores: {default_threads()}")
+    print(f"{'config':<28}{'wall':>8}{'speedup':>9}  SNR vs single process (dB)")
+    print(f"{'single process':<28}{base_wall:>7.1f}s{1.0:>8.2f}x")
+
+    rows = [{"config": "single", "wall_seconds": base_wall, "speedup": 1.0, "snr_db": {}}]
+    for chunk_seconds in args.chunk_seconds:
+        chunked = replace(settings, chunk_seconds=chunk_seconds, chunk_overlap=args.chunk_overlap)
+        for workers in args.workers:
+            service = SeparationService(args.model, device="cpu", workers=workers)
+            if workers > 1:
+                service._chunk_pool()
+                # Warm every worker's model so the timing excludes model loading.
+                list(service.pool.map(_warm_chunk_worker, range(workers)))
+            else:
+                service.model = model
+            start = time.time()
+            stems = service.separate_chunked(wav, sr, chunked)
+            wall = time.time() - start
+            service.close()
+
+            snrs = {name: round(snr_db(reference[name], stems[name]), 1) for name in reference}
+            label = f"{chunk_seconds:g}s chunks x {workers} workers"
+            snr_text = "  ".join(f"{k}={v}" for k, v in snrs.items())
+            print(f"{label:<28}{wall:>7.1f}s{base_wall / wall:>8.2f}x  {snr_text}")
+            rows.append({"config": label, "wall_seconds": wall, "speedup": base_wall / wall,
+                         "snr_db": snrs})
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"file": args.audio_file, "audio_seconds": audio_seconds, "results": rows}, f, indent=2)
+
+
+def _warm_chunk_worker(_):
+    import separation
+    separation._chunk_service.load_model()
+    time.sleep(0.1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Matrix-based chord recognition with Viterbi smoothing.
+
+All rotated chord templates live in one (chords x 12) matrix. Every
+beat-synchronous chroma frame is scored against every template with a single
+matrix multiply (Pearson correlation, via mean-centred unit vectors), and a
+Viterbi pass over the whole track picks a smooth, time-stamped progression.
+The transition model is "stay, or jump anywhere uniformly", which makes each
+Viterbi step O(chords) instead of O(chords^2).
+
+Chord names use Strudel's chord symbols (C, Cm, C7, C^7, Cm7, Cm7b5, Co, ...).
+
+Usage:
+    from chords import beat_chroma, recognize_chords, dominant_progression
+    chroma, times = beat_chroma(y, sr, bpm=120)
+    segments = recognize_chords(chroma, times)
+"""
+
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# Strudel chord suffix -> intervals above the root
+CHORD_QUALITIES = {
+    "": (0, 4, 7),
+    "m": (0, 3, 7),
+    "7": (0, 4, 7, 10),
+    "^7": (0, 4, 7, 11),
+    "m7": (0, 3, 7, 10),
+    "m7b5": (0, 3, 6, 10),
+    "o": (0, 3, 6),
+    "sus": (0, 5, 7),
+    "sus2": (0, 2, 7),
+}
+
+# Diatonic chords per scale degree, used for the optional key prior
+DIATONIC = {
+    "major": [(0, ("", "^7")), (2, ("m", "m7")), (4, ("m", "m7")), (5, ("", "^7")),
+              (7, ("", "7")), (9, ("m", "m7")), (11, ("o", "m7b5"))],
+    "minor": [(0, ("m", "m7")), (2, ("o", "m7b5")), (3, ("", "^7")), (5, ("m", "m7")),
+              (7, ("m", "m7", "7")), (8, ("", "^7")), (10, ("", "7"))],
+}
+
+
+def chord_labels(qualities: Sequence[str] = tuple(CHORD_QUALITIES)) -> List[str]:
+    """Chord names in template-matrix row order (quality-major, root-minor)."""
+    return [f"{root}{q}" for q in qualities for root in PITCH_CLASSES]
+
+
+def template_matrix(qualities: Sequence[str] = tuple(CHORD_QUALITIES)) -> np.ndarray:
+    """(len(qualities) * 12, 12) binary templates, every quality at every root."""
+    base = np.zeros((len(qualities), 12), dtype=np.float32)
+    for i, q in enumerate(qualities):
+        base[i, list(CHORD_QUALITIES[q])] = 1.0
+    # rolled[q, r, :] = roll(base[q], r)
+    idx = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12
+    return base[:, idx].reshape(-1, 12)
+
+
+def _center_unit(x: np.ndarray, axis: int) -> np.ndarray:
+    x = x - x.mean(axis=axis, keepdims=True)
+    norm = np.linalg.norm(x, axis=axis, keepdims=True)
+    return x / np.maximum(norm, 1e-9)
+
+
+def chord_scores(chroma: np.ndarray, templates: Optional[np.ndarray] = None) -> np.ndarray:
+    """Pearson correlation of every template with every chroma frame: (chords x frames)."""
+    templates = template_matrix() if templates is None else templates
+    return _center_unit(templates, axis=1) @ _center_unit(np.asarray(chroma, dtype=np.float32), axis=0)
+
+
+def key_prior(key: str, mode: str, weight: float = 0.1,
+              qualities: Sequence[str] = tuple(CHORD_QUALITIES)) -> np.ndarray:
+    """Additive score bonus for chords diatonic to key/mode."""
+    labels = chord_labels(qualities)
+    tonic = PITCH_CLASSES.index(key) if key in PITCH_CLASSES else 0
+    bonus = np.zeros(len(labels), dtype=np.float32)
+    index = {name: i for i, name in enumerate(labels)}
+    for degree, suffixes in DIATONIC.get(mode, DIATONIC["major"]):
+        root = PITCH_CLASSES[(tonic + degree) % 12]
+        for suffix in suffixes:
+            if f"{root}{suffix}" in index:
+                bonus[index[f"{root}{suffix}"]] = weight
+    return bonus
+
+
+def viterbi_path(scores: np.ndarray, stay: float = 0.9, sharpness: float = 10.0) -> np.ndarray:
+    """Most likely state sequence for (states x frames) scores.
+
+    Emissions are a softmax of sharpness * score per frame; transitions keep
+    the current chord with probability `stay` and spread the rest uniformly.
+    """
+    n_states, n_frames = scores.shape
+    if n_frames == 0:
+        return np.zeros(0, dtype=int)
+    log_emit = sharpness * scores
+    log_emit = log_emit - np.logaddexp.reduce(log_emit, axis=0, keepdims=True)
+    log_stay = np.log(stay)
+    log_move = np.log((1.0 - stay) / max(n_states - 1, 1))
+
+    delta = log_emit[:, 0] - np.log(n_states)
+    backptr = np.empty((n_frames, n_states), dtype=np.int32)
+    backptr[0] = np.arange(n_states)
+    for t in range(1, n_frames):
+        best = int(np.argmax(delta))
+        from_stay = delta + log_stay
+        from_best = delta[best] + log_move
+        moved = from_best > from_stay
+        backptr[t] = np.where(moved, best, np.arange(n_states))
+        delta = np.maximum(from_stay, from_best) + log_emit[:, t]
+
+    path = np.empty(n_frames, dtype=int)
+    path[-1] = int(np.argmax(delta))
+    for t in range(n_frames - 1, 0, -1):
+        path[t - 1] = backptr[t, path[t]]
+    return path
+
+
+def beat_chroma(y: np.ndarray, sr: int, bpm: Optional[float] = None,
+                beat_times: Optional[np.ndarray] = None, hop_length: int = 512,
+                chroma: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean chroma per beat and the beat start times.
+
+    The beat grid is beat_times if given, else a regular grid at bpm, else
+    the shared beat tracker (tempo.track_beats). Chroma, when not given,
+    comes from the default chroma backend (see chroma.py).
+    """
+    import librosa
+
+    from chroma import chromagram
+
+    if chroma is None:
+        chroma = chromagram(y, sr, hop_length)
+    duration = chroma.shape[1] * hop_length / sr
+    if beat_times is None:
+        if bpm:
+            beat_times = np.arange(0, duration, 60.0 / bpm)
+        else:
+            from tempo import track_beats
+            beat_times = track_beats(y=np.asarray(y), sr=sr, hop_length=hop_length).beats
+    beat_times = np.asarray(beat_times, dtype=float)
+    beat_frames = librosa.time_to_frames(beat_times, sr=sr, hop_length=hop_length)
+    beat_frames = np.unique(np.clip(beat_frames, 0, chroma.shape[1]))
+    synced = librosa.util.sync(chroma, beat_frames, aggregate=np.mean, pad=True)
+    starts = np.concatenate([[0], beat_frames[beat_frames > 0]])
+    starts = starts[:synced.shape[1]]
+    return synced, librosa.frames_to_time(starts, sr=sr, hop_length=hop_length)
+
+
+def recognize_chords(chroma: np.ndarray, times: np.ndarray, end_time: Optional[float] = None,
+                     prior: Optional[np.ndarray] = None, stay: float = 0.9,
+                     qualities: Sequence[str] = tuple(CHORD_QUALITIES)) -> List[Dict]:
+    """Time-stamped chord segments for beat-synchronous chroma."""
+    labels = chord_labels(qualities)
+    scores = chord_scores(chroma, template_matrix(qualities))
+    if prior is not None:
+        scores = scores + prior[:, None]
+    path = viterbi_path(scores, stay=stay)
+    if len(path) == 0:
+        return []
+
+    change = np.flatnonzero(np.diff(path)) + 1
+    starts = np.concatenate([[0], change])
+    ends = np.concatenate([change, [len(path)]])
+    times = np.asarray(times, dtype=float)
+    if end_time is None:
+        end_time = times[-1] + (times[-1] - times[-2] if len(times) > 1 else 0.5)
+    bounds = np.append(times, end_time)
+    return [{"chord": labels[path[a]], "start": round(float(bounds[a]), 3),
+             "end": round(float(bounds[b]), 3), "beats": int(b - a)}
+            for a, b in zip(starts, ends)]
+
+
+def beat_labels(segments: List[Dict]) -> List[str]:
+    """Expand segments back into one chord label per beat."""
+    return [seg["chord"] for seg in segments for _ in range(seg["beats"])]
+
+
+def dominant_progression(segments: List[Dict], beats_per_bar: int = 4,
+                         bars: int = 4) -> List[str]:
+    """Most frequent `bars`-bar chord loop (one chord per bar) across the track."""
+    per_beat = beat_labels(segments)
+    n_bars = len(per_beat) // beats_per_bar
+    if n_bars == 0:
+        return [per_beat[0]] if per_beat else []
+    bar_chords = [Counter(per_beat[i * beats_per_bar:(i + 1) * beats_per_bar]).most_common(1)[0][0]
+                  for i in range(n_bars)]
+    if n_bars < bars:
+        return bar_chords
+    loops = Counter(tuple(bar_chords[i:i + bars]) for i in range(0, n_bars - bars + 1, bars))
+    return list(loops.most_common(1)[0][0])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Selectable chroma backends: the accurate CQT, or a fast chroma from an STFT.
+
+chroma_cqt runs a constant-Q transform over seven octaves, which is one of
+the most expensive steps of the analysis. The fast backend instead folds
+the power spectrum of an STFT onto the 12 pitch classes with a
+precomputed filter matrix. The matrix is sparse (each FFT bin feeds two or
+three pitch classes, and bins outside C3-B7 feed none), so a frame block
+costs one sparse matrix product. When the caller already holds
+the magnitude STFT (the band balance, drum bands and mel spectrogram all
+use one) the fast chroma needs no transform at all.
+
+The STFT cannot resolve low notes (10.8 Hz bins at 22.05 kHz / 2048), so
+bass notes below C3 only count through their overtones. The CQT, which
+does resolve them, stays the default; bench_chroma.py measures how often the key
+and chord outputs of the two backends disagree.
+
+Usage:
+    from chroma import chromagram
+    C = chromagram(y, sr)                          # default backend ($MUSICMAN_CHROMA)
+    C = chromagram(y, sr, backend="stft", S=mag)   # from a magnitude STFT in hand
+
+Environment:
+    MUSICMAN_CHROMA   "cqt" (default) or "stft"
+"""
+
+import os
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+BACKENDS = ("cqt", "stft")
+HOP_LENGTH = 512
+FMIN = 130.81    # C3: below it semitones are narrower than the default 10.8 Hz FFT bins
+FMAX = 3951.07   # B7, the highest CQT chroma bin
+SPARSE_FLOOR = 0.05  # filter weights below this fraction of a bin's largest are dropped
+
+
+def default_backend() -> str:
+    return os.environ.get("MUSICMAN_CHROMA", "cqt")
+
+
+def n_fft_for(hop_length: int) -> int:
+    """The STFT size used with hop_length (the usual 4 hops per window)."""
+    return 4 * hop_length
+
+
+@lru_cache(maxsize=32)
+def chroma_filter(sr: float, n_fft: int):
+    """(12, 1 + n_fft // 2) sparse CSR matrix mapping a power spectrum to chroma."""
+    import librosa
+    from scipy import sparse
+
+    weights = librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=0.0)
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    weights[:, (freqs < FMIN) | (freqs > FMAX)] = 0.0
+    peak = weights.max(axis=0, keepdims=True)
+    weights[weights < SPARSE_FLOOR * peak] = 0.0
+    return sparse.csr_matrix(weights.astype(np.float32))
+
+
+def chroma_from_stft(S: np.ndarray, sr: float, n_fft: int) -> np.ndarray:
+    """Chroma (..., 12, frames), each frame scaled to max 1, from a (..., freqs, frames) magnitude STFT.
+
+    Leading axes (channels, or clips of a batch) go through the same single
+    sparse product.
+    """
+    P = np.asarray(S, dtype=np.float32) ** 2
+    flat = np.moveaxis(P, -2, 0).reshape(P.shape[-2], -1)
+    C = np.asarray(chroma_filter(sr, n_fft) @ flat).reshape(12, *P.shape[:-2], P.shape[-1])
+    C = np.moveaxis(C, 0, -2)
+    peak = C.max(axis=-2, keepdims=True)
+    return np.divide(C, peak, out=np.zeros_like(C), where=peak > 0)
+
+
+def chromagram(y: Optional[np.ndarray], sr: float, hop_length: int = HOP_LENGTH,
+               backend: Optional[str] = None, S: Optional[np.ndarray] = None) -> np.ndarray:
+    """Chromagram of y with the selected backend (centred frames at hop_length).
+
+    With the stft backend, S may be the magnitude STFT of y at
+    n_fft_for(hop_length); the cqt backend always transforms y.
+    """
+    import librosa
+
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown chroma backend {backend!r} (use one of {', '.join(BACKENDS)})")
+    if backend == "cqt":
+        return librosa.feature.chroma_cqt(y=np.asarray(y), sr=sr, hop_length=hop_length)
+    n_fft = n_fft_for(hop_length)
+    if S is None:
+        S = np.abs(librosa.stft(np.asarray(y), n_fft=n_fft, hop_length=hop_length))
+    return chroma_from_stft(S, sr, n_fft)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Parameter sweep for the drum band edges, onset thresholds and onset gap.
+
+The drum analysis finds kick, snare and hi-hat onsets as peaks of summed
+STFT magnitude in one frequency band per drum (beat_features.DRUM_BANDS,
+DRUM_THRESHOLDS, ONSET_MIN_GAP). This script scores a grid of those
+settings against labelled onsets without re-running any analysis:
+
+    1. Each track's percussive magnitude STFT is computed once, or read
+       from the feature store when an analysis run already stored it.
+    2. A cumulative sum over frequency gives the energy of every candidate
+       band as one subtraction, so all band edges of a drum are one array.
+    3. onsets.sweep_band_onsets picks onsets for every band at every
+       threshold in one pass (once per onset gap).
+    4. Detections are matched to the labels within TOLERANCE seconds and
+       counted per setting, and the F-measure is taken over all tracks.
+
+The bands are scored independently, since a drum's onsets depend only on
+its own band and threshold; the gap is shared, so the one with the best
+mean F-measure wins. The best settings are written to the drum config
+(see beat_features.load_drum_config), which every analysis then reads.
+
+Labels are JSON files with onset times in seconds, next to each track or in
+--labels-dir, named <track stem>.drums.json:
+
+    {"kick": [0.0, 0.49, ...], "snare": [0.98, ...], "hihat": [0.0, 0.24, ...]}
+
+Without tracks the sweep runs on a synthetic labelled set of drum loops
+over bass and pad parts, and only writes a config when -o is given.
+
+Usage:
+    python drum_sweep.py stems/*.wav [--labels-dir labels/] [--source audio|hpss] [-o drum_config.json]
+    python drum_sweep.py --tracks 16          # synthetic set, report only
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from beat_features import (DEFAULT_DRUM_BANDS, DEFAULT_DRUM_THRESHOLDS, DEFAULT_ONSET_MIN_GAP,
+                           DRUM_NAMES, HOP_LENGTH, drum_config_path, percussive_stft)
+from feature_store import FeatureStore
+from onsets import sweep_band_onsets
+
+SR = 22050
+N_FFT = 2048
+TOLERANCE = 0.05  # seconds between a detection and the label it matches
+
+# Candidate (low, high) band edges in Hz; pairs with low >= high are skipped
+EDGE_GRID = {
+    "kick": ([20, 30, 40, 50, 60], [90, 120, 150, 200, 250]),
+    "snare": ([150, 200, 250, 300, 500], [300, 400, 600, 1000, 2000]),
+    "hihat": ([3000, 4000, 6000, 8000], [10000, 12000, 16000]),
+}
+THRESHOLD_GRID = np.round(np.arange(0.1, 0.91, 0.05), 2)
+GAP_GRID = [0.03, 0.05, 0.08, 0.1]
+
+
+@dataclass
+class Track:
+    name: str
+    S: np.ndarray                  # (freqs, frames) magnitude STFT at SR, N_FFT, HOP_LENGTH
+    labels: Dict[str, np.ndarray]  # drum -> sorted onset times in seconds
+
+
+@dataclass
+class SweepResult:
+    edges: Dict[str, List[Tuple[float, float]]]
+    thresholds: np.ndarray
+    gaps: List[float]
+    f_measure: Dict[str, np.ndarray]  # drum -> (gaps, edges, thresholds)
+    n_tracks: int
+    seconds: float
+
+    @property
+    def n_settings(self) -> int:
+        """Distinct per-drum settings scored (edges x thresholds x gaps, summed over drums)."""
+        return sum(f.size for f in self.f_measure.values())
+
+    def best(self) -> Tuple[float, Dict[str, Tuple[Tuple[float, float], float, float]]]:
+        """(gap, {drum: (band, threshold, F)}) with the gap maximising the mean best F."""
+        per_gap = np.mean([f.reshape(len(self.gaps), -1).max(axis=1) for f in self.f_measure.values()],
+                          axis=0)
+        g = int(np.argmax(per_gap))
+        settings = {}
+        for name, f in self.f_measure.items():
+            e, t = np.unravel_index(int(np.argmax(f[g])), f[g].shape)
+            settings[name] = (self.edges[name][e], float(self.thresholds[t]), float(f[g, e, t]))
+        return self.gaps[g], settings
+
+    def score(self, name: str, band: Tuple[float, float], threshold: float, gap: float) -> Optional[float]:
+        """F-measure of one setting, if it is on the grid (bands compare by FFT bins)."""
+        e = [band_bins(b) for b in self.edges[name]]
+        t = np.flatnonzero(np.isclose(self.thresholds, threshold))
+        if band_bins(band) not in e or gap not in self.gaps or not len(t):
+            return None
+        return float(self.f_measure[name][self.gaps.index(gap), e.index(band_bins(band)), t[0]])
+
+
+def band_bins(band: Tuple[float, float], sr: float = SR) -> Tuple[int, int]:
+    """[start, stop) FFT bins of an inclusive [low, high] Hz band."""
+    freqs = np.fft.rfftfreq(N_FFT, 1.0 / sr)
+    return int(np.searchsorted(freqs, band[0], "left")), int(np.searchsorted(freqs, band[1], "right"))
+
+
+def edge_pairs(name: str, sr: float = SR) -> List[Tuple[float, float]]:
+    """Candidate bands of a drum, without pairs that select the same FFT bins."""
+    lows, highs = EDGE_GRID[name]
+    pairs, seen = [], set()
+    for low in lows:
+        for high in highs:
+            bins = band_bins((low, high), sr)
+            if low < high and bins[0] < bins[1] and bins not in seen:
+                seen.add(bins)
+                pairs.append((float(low), float(high)))
+    return pairs
+
+
+def band_grid(S: np.ndarray, pairs: Sequence[Tuple[float, float]], sr: float = SR) -> np.ndarray:
+    """(len(pairs), frames) energy of every band, from one cumulative sum over frequency.
+
+    Matches onsets.band_energies: each band sums the bins in [low, high].
+    """
+    cs = np.zeros((S.shape[0] + 1, S.shape[1]))
+    np.cumsum(S, axis=0, dtype=np.float64, out=cs[1:])
+    lo, hi = np.array([band_bins(p, sr) for p in pairs]).T
+    return (cs[hi] - cs[lo]).astype(np.float32)
+
+
+def _nearest(sorted_values: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """Distance from each query to the nearest of sorted_values."""
+    idx = np.searchsorted(sorted_values, queries)
+    left = sorted_values[np.maximum(idx - 1, 0)]
+    right = sorted_values[np.minimum(idx, len(sorted_values) - 1)]
+    return np.minimum(np.abs(queries - left), np.abs(right - queries))
+
+
+def match_counts(pairs: np.ndarray, times: np.ndarray, n_pairs: int, labels: np.ndarray,
+                 tolerance: float = TOLERANCE) -> Tuple[np.ndarray, np.ndarray]:
+    """(true positives, detections) per setting, from every setting's detections at once.
+
+    pairs and times are sorted by pair, then time. A detection counts as
+    correct if a label lies within tolerance and a label as found if a
+    detection of that setting does; the true positives are the smaller of
+    the two counts, which equals one-to-one matching unless onsets are
+    closer together than the tolerance.
+    """
+    n_det = np.bincount(pairs, minlength=n_pairs)
+    if len(labels) == 0 or len(times) == 0:
+        return np.zeros(n_pairs), n_det
+    det_hits = np.bincount(pairs, weights=_nearest(labels, times) <= tolerance, minlength=n_pairs)
+
+    # Offset each setting's detections so one sorted array holds them all
+    span = max(times.max(), labels.max()) + 1.0
+    keys = pairs * span + times
+    queries = (np.arange(n_pairs)[:, None] * span + labels[None, :]).ravel()
+    found = (_nearest(keys, queries) <= tolerance).reshape(n_pairs, -1).sum(axis=1)
+    return np.minimum(det_hits, found), n_det
+
+
+def sweep(tracks: Sequence[Track], thresholds: Sequence[float] = THRESHOLD_GRID,
+          gaps: Sequence[float] = GAP_GRID, tolerance: float = TOLERANCE) -> SweepResult:
+    """Score every band, threshold and gap of the grid on every track."""
+    start = time.perf_counter()
+    thresholds = np.asarray(thresholds, dtype=float)
+    edges = {name: edge_pairs(name) for name in DRUM_NAMES}
+    counts = {name: np.zeros((3, len(gaps), len(edges[name]) * len(thresholds))) for name in DRUM_NAMES}
+    for track in tracks:
+        for name in DRUM_NAMES:
+            labels = np.sort(np.asarray(track.labels.get(name, []), dtype=float))
+            energy = band_grid(track.S, edges[name])
+            n_pairs = len(edges[name]) * len(thresholds)
+            for g, gap in enumerate(gaps):
+                pairs, frames = sweep_band_onsets(energy, thresholds, int(SR / HOP_LENGTH * gap))
+                tp, n_det = match_counts(pairs, frames * HOP_LENGTH / SR, n_pairs, labels, tolerance)
+                counts[name][:, g] += [tp, n_det, np.full(n_pairs, len(labels))]
+
+    f_measure = {}
+    for name, (tp, n_det, n_lab) in counts.items():
+        f = np.divide(2 * tp, n_det + n_lab, out=np.zeros_like(tp), where=(n_det + n_lab) > 0)
+        f_measure[name] = f.reshape(len(gaps), len(edges[name]), len(thresholds))
+    return SweepResult(edges=edges, thresholds=thresholds, gaps=list(gaps), f_measure=f_measure,
+                       n_tracks=len(tracks), seconds=time.perf_counter() - start)
+
+
+def write_config(result: SweepResult, path: Path) -> dict:
+    gap, settings = result.best()
+    config = {
+        "bands": {name: list(band) for name, (band, _, _) in settings.items()},
+        "thresholds": {name: t for name, (_, t, _) in settings.items()},
+        "onset_min_gap": gap,
+        "sweep": {"tracks": result.n_tracks, "settings": result.n_settings, "tolerance": TOLERANCE,
+                  "f_measure": {name: round(f, 4) for name, (_, _, f) in settings.items()}},
+    }
+    Path(path).write_text(json.dumps(config, indent=2) + "\n")
+    return config
+
+
+def load_labels(path: Path) -> Dict[str, np.ndarray]:
+    labels = json.loads(Path(path).read_text())
+    return {name: np.sort(np.asarray(labels.get(name, []), dtype=float)) for name in DRUM_NAMES}
+
+
+def labels_path(audio_path: Path, labels_dir: Optional[Path] = None) -> Path:
+    return (labels_dir or audio_path.parent) / f"{audio_path.stem}.drums.json"
+
+
+def track_stft(audio_path: Path, source: str = "audio") -> np.ndarray:
+    """Percussive magnitude STFT of a track, shared with analysis runs through the feature store.
+
+    source "audio" uses the file as it is (e.g. a drum stem); "hpss" uses
+    the percussive part of HPSS, as the analysis does without stems.
+    """
+    from audio_cache import load_audio
+
+    y, _ = load_audio(audio_path, sr=SR, mono=True)
+    if source == "hpss":
+        import librosa
+
+        hpss = FeatureStore(audio_path, sr=SR, duration=None).get_or_compute(
+            "hpss", {}, lambda: np.stack(librosa.effects.hpss(np.asarray(y))))
+        return percussive_stft(hpss[1], SR, FeatureStore(audio_path, duration=None,
+                                                         source="hpss_percussive"))
+    return percussive_stft(y, SR, FeatureStore(audio_path, duration=None))
+
+
+def _drum_hit(name: str, rng: np.random.Generator) -> np.ndarray:
+    t = np.arange(int({"kick": 0.35, "snare": 0.2, "hihat": 0.05}[name] * SR)) / SR
+    if name == "kick":
+        phase = 2 * np.pi * np.cumsum(50 + 70 * np.exp(-t * 30)) / SR
+        return np.sin(phase) * np.exp(-t * 12)
+    if name == "snare":
+        noise = rng.standard_normal(len(t))
+        return 0.5 * np.sin(2 * np.pi * 190 * t) * np.exp(-t * 25) + 0.6 * noise * np.exp(-t * 20)
+    return 0.3 * np.diff(rng.standard_normal(len(t) + 1)) * np.exp(-t * 80)
+
+
+def synthetic_track(seconds: float, seed: int) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """A drum loop with ghost notes over a bass line and pad, and its onset labels."""
+    rng = np.random.default_rng(seed)
+    step = 60.0 / rng.uniform(90, 140) / 4
+    n_steps = int(seconds / step)
+    y = np.zeros(int(seconds * SR) + SR)
+    hat_every = int(rng.choice([1, 2]))
+    hits = {
+        "kick": [s for s in range(n_steps) if s % 8 == 0 or rng.random() < 0.12],
+        "snare": [s for s in range(n_steps) if s % 16 in (4, 12) or rng.random() < 0.05],
+        "hihat": [s for s in range(n_steps) if s % hat_every == 0 and rng.random() < 0.9],
+    }
+    labels = {}
+    for name, steps in hits.items():
+        starts = (np.asarray(steps) * step * SR).astype(int)
+        for start in starts:
+            hit = _drum_hit(name, rng) * rng.uniform(0.5, 1.0)
+            y[start:start + len(hit)] += hit
+        labels[name] = starts / SR
+
+    t = np.arange(len(y)) / SR
+    notes = rng.integers(40, 52, size=n_steps // 2 + 1)  # E2-D#3, one per 8th
+    bass_hz = np.repeat(440.0 * 2 ** ((notes - 69) / 12), int(2 * step * SR))[:len(y)]
+    bass_hz = np.pad(bass_hz, (0, len(y) - len(bass_hz)), mode="edge")
+    y += rng.uniform(0.2, 0.4) * np.sin(2 * np.pi * np.cumsum(bass_hz) / SR)
+    y += 0.05 * sum(np.sin(2 * np.pi * f * t) for f in rng.uniform(220, 440, size=3))
+    y += 0.01 * rng.standard_normal(len(y))
+    return y[:int(seconds * SR)].astype(np.float32), labels
+
+
+def synthetic_set(n: int, seconds: float) -> List[Track]:
+    import librosa
+
+    tracks = []
+    for seed in range(n):
+        y, labels = synthetic_track(seconds, seed)
+        S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+        tracks.append(Track(f"synthetic {seed}", S, labels))
+    return tracks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep drum band edges and onset thresholds against labels")
+    parser.add_argument("audio_files", nargs="*", help="Labelled tracks (default: synthetic set)")
+    parser.add_argument("--labels-dir", type=Path, help="Directory of <track stem>.drums.json labels")
+    parser.add_argument("--source", choices=["audio", "hpss"], default="audio",
+                        help="Signal the onsets are picked from (default: the file as it is)")
+    parser.add_argument("--tracks", type=int, default=16, help="Size of the synthetic set")
+    parser.add_argument("--seconds", type=float, default=30, help="Length of each synthetic track")
+    parser.add_argument("-o", "--output", type=Path,
+                        help="Config to write (default with labelled tracks: $MUSICMAN_DRUM_CONFIG, "
+                             "else drum_config.json in the cache directory)")
+    parser.add_argument("--dry-run", action="store_true", help="Report only, write no config")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        stream=sys.stderr)
+    start = time.perf_counter()
+    if args.audio_files:
+        tracks = []
+        for path in map(Path, args.audio_files):
+            labels = labels_path(path, args.labels_dir)
+            if not labels.exists():
+                logging.warning(f"No labels for {path} ({labels}), skipping")
+                continue
+            tracks.append(Track(str(path), track_stft(path, args.source), load_labels(labels)))
+        if not tracks:
+            sys.exit("No labelled tracks")
+        output = args.output or drum_config_path()
+    else:
+        tracks = synthetic_set(args.tracks, args.seconds)
+        output = args.output
+    prepare = time.perf_counter() - start
+
+    result = sweep(tracks)
+    gap, best = result.best()
+    print(f"{result.n_tracks} tracks, {result.n_settings} settings: "
+          f"features {prepare:.2f}s, sweep {result.seconds:.2f}s")
+    print(f"{'drum':<6} {'default band':>16} {'thr':>5} {'F':>6}   {'best band':>16} {'thr':>5} {'F':>6}")
+    for i, name in enumerate(DRUM_NAMES):
+        default = result.score(name, DEFAULT_DRUM_BANDS[i], DEFAULT_DRUM_THRESHOLDS[i], DEFAULT_ONSET_MIN_GAP)
+        band, threshold, f = best[name]
+        default_f = f"{default:.3f}" if default is not None else "-"
+        print(f"{name:<6} {str(DEFAULT_DRUM_BANDS[i]):>16} {DEFAULT_DRUM_THRESHOLDS[i]:>5.2f} "
+              f"{default_f:>6}   {str(band):>16} {threshold:>5.2f} {f:>6.3f}")
+    print(f"onset gap: default {DEFAULT_ONSET_MIN_GAP}s, best {gap}s")
+
+    if output and not args.dry_run:
+        write_config(result, output)
+        print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
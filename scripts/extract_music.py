@@ -12,11 +12,15 @@ Pipeline:
 5. Global Features - BPM, key, structure
 
 Usage:
-    python extract_music.py <audio_file> [--output-dir OUTPUT_DIR]
+    python extract_music.py <audio_file> [--output-dir OUTPUT_DIR] [--bars N]
+    python extract_music.py --batch DIR [--jobs N] [--retry-failed]
+    python extract_music.py <dj_mix> --mix [--tracks N] [--jobs N] [--bars N]
 
 Output:
     - analysis.json with all extracted features
-    - Separated stems in output/stems/
+      (mix mode: one per track plus <mix>_timeline.json; see analyze_mix)
+      (batch mode: named after the path under DIR, e.g. a__intro_mp3_analysis.json)
+    - Separated stems in the shared stem store (see separation.py)
     - Suggested Strudel code
 
 Requirements:
@@ -27,14 +31,28 @@ Requirements:
 import argparse
 import json
 import logging
-import subprocess
+import os
 import sys
-from dataclasses import dataclass, asdict
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict, field
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
+import chords as chord_engine
+import excerpt
+import key_detection
+import tempo
+from audio_cache import load_audio
+from beat_features import BeatFeatures, compute_beat_features, regular_beats
+from drum_patterns import DrumLoop, mine_loop
+from feature_store import FeatureStore
+from mix_segmentation import MIN_TRACK_SECONDS, segment_mix
+from multirate import band_rate, to_band_rate
+from stage_scheduler import Stage, run_stages
+
 # Lazy imports for optional heavy dependencies
 librosa = None
 madmom = None
@@ -59,12 +77,6 @@ def import_dependencies():
         madmom = None
 
 
-# Krumhansl-Schmuckler key profiles
-MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
-PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-
-
 @dataclass
 class DrumPattern:
     """Extracted drum pattern info."""
@@ -90,6 +102,7 @@ class ChordProgression:
     """Extracted chord progression."""
     progression: List[str]
     strudel: str
+    timeline: List[Dict] = field(default_factory=list)
 
 
 @dataclass
@@ -105,184 +118,122 @@ class AnalysisResult:
     chords: Optional[Dict]
     suggested_strudel: str
     stems_dir: str
+    excerpt: Optional[Dict] = None  # the window analysed, when not the whole track
 
 
-def detect_bpm_madmom(audio_path: str) -> float:
-    """Detect BPM using madmom (more accurate than librosa)."""
-    if madmom is None:
-        return detect_bpm_librosa(audio_path)
+def detect_beats(audio_path: str) -> tempo.BeatGrid:
+    """Beat grid from madmom (more accurate than librosa) when it is installed.
 
-    try:
-        from madmom.features.beats import RNNBeatProcessor, BeatTrackingProcessor
+    The RNN runs on the busiest BEAT_EXCERPT_SECONDS of the track; the grid is
+    cached, so later scripts asking for this track's tempo do not re-track it.
+    """
+    return tempo.track_beats(audio_path, sr=ANALYSIS_SR, backend="madmom" if madmom else "librosa",
+                             excerpt=BEAT_EXCERPT_SECONDS)
 
-        proc = RNNBeatProcessor()
-        act = proc(audio_path)
-        beat_proc = BeatTrackingProcessor(fps=100)
-        beats = beat_proc(act)
 
-        if len(beats) < 2:
-            return detect_bpm_librosa(audio_path)
+def snap_bpm(grid: tempo.BeatGrid) -> float:
+    """BPM of a beat grid, snapped to the nearest common tempo when madmom tracked it."""
+    if grid.backend != "madmom":
+        return grid.bpm
 
-        intervals = np.diff(beats)
-        median_interval = np.median(intervals)
-        bpm = 60.0 / median_interval
+    common_bpms = [60, 70, 80, 85, 90, 95, 100, 105, 110, 115, 120, 125, 128, 130, 135, 140, 145, 150, 160, 170, 180]
+    bpm = min(common_bpms, key=lambda x: abs(x - grid.bpm))
+    return float(bpm)
 
-        common_bpms = [60, 70, 80, 85, 90, 95, 100, 105, 110, 115, 120, 125, 128, 130, 135, 140, 145, 150, 160, 170, 180]
-        bpm = min(common_bpms, key=lambda x: abs(x - bpm))
-        return float(bpm)
-    except Exception as e:
-        logging.warning(f"madmom BPM detection failed: {e}, using librosa")
-        return detect_bpm_librosa(audio_path)
+
+def detect_bpm_madmom(audio_path: str) -> float:
+    """Detect BPM using madmom (more accurate than librosa)."""
+    return snap_bpm(detect_beats(audio_path))
 
 
 def detect_bpm_librosa(audio_path: str) -> float:
     """Fallback BPM detection using librosa."""
-    y, sr = librosa.load(audio_path, sr=22050, mono=True)
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-    if hasattr(tempo, '__iter__'):
-        tempo = tempo[0]
-    return float(tempo)
+    return tempo.track_beats(audio_path, sr=ANALYSIS_SR, backend="librosa").bpm
 
 
 def detect_key(y: np.ndarray, sr: int) -> Tuple[str, str, float]:
     """Detect musical key using Krumhansl-Schmuckler algorithm."""
-    y_harmonic = librosa.effects.harmonic(y)
-    chroma = librosa.feature.chroma_cqt(y=y_harmonic, sr=sr)
-    chroma_mean = np.mean(chroma, axis=1)
-    chroma_mean = chroma_mean / (np.sum(chroma_mean) + 1e-6)
-
-    best_corr = -1
-    best_key = 'C'
-    best_mode = 'major'
-
-    for i, pitch in enumerate(PITCH_CLASSES):
-        major_rotated = np.roll(MAJOR_PROFILE, i)
-        minor_rotated = np.roll(MINOR_PROFILE, i)
-        major_rotated = major_rotated / np.sum(major_rotated)
-        minor_rotated = minor_rotated / np.sum(minor_rotated)
-
-        major_corr = np.corrcoef(chroma_mean, major_rotated)[0, 1]
-        minor_corr = np.corrcoef(chroma_mean, minor_rotated)[0, 1]
-
-        if major_corr > best_corr:
-            best_corr = major_corr
-            best_key = pitch
-            best_mode = 'major'
-        if minor_corr > best_corr:
-            best_corr = minor_corr
-            best_key = pitch
-            best_mode = 'minor'
-
-    return best_key, best_mode, float(best_corr)
+    return key_detection.estimate_key(key_detection.harmonic_chroma(y, sr))
 
 
-def run_demucs(audio_path: str, output_dir: str) -> Dict[str, str]:
-    """Run Demucs source separation."""
-    audio_path = Path(audio_path)
-    output_dir = Path(output_dir)
-
-    cmd = ["demucs", "-o", str(output_dir), str(audio_path)]
-    logging.info(f"Running Demucs: {' '.join(cmd)}")
-
+def run_demucs(audio_path: str, threads: Optional[int] = None) -> Dict[str, str]:
+    """Run Demucs source separation through the shared stem store."""
     try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Demucs failed: {e.stderr}")
-        raise
-    except FileNotFoundError:
+        import separation
+        return separation.separate(audio_path, threads=threads)
+    except ImportError:
         logging.error("Demucs not installed. Run: pip install demucs")
         raise
 
-    stem_dir = output_dir / "htdemucs" / audio_path.stem
-    stems = {}
-    for stem_name in ["drums", "bass", "vocals", "other"]:
-        stem_path = stem_dir / f"{stem_name}.wav"
-        if stem_path.exists():
-            stems[stem_name] = str(stem_path)
-    return stems
-
 
 def analyze_drums(drums_path: str, bpm: float, sr: int = 22050) -> DrumPattern:
     """Analyze drum stem to extract kick, snare, hi-hat patterns."""
-    y, sr = librosa.load(drums_path, sr=sr, mono=True)
-    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-    onsets = librosa.onset.onset_detect(y=y, sr=sr, onset_envelope=onset_env, backtrack=True, units='time')
-
-    S = np.abs(librosa.stft(y))
-    freqs = librosa.fft_frequencies(sr=sr)
-    kick_times, snare_times, hihat_times = [], [], []
-    hop_length = 512
-
-    for onset_time in onsets:
-        frame = librosa.time_to_frames(onset_time, sr=sr, hop_length=hop_length)
-        if frame >= S.shape[1]:
-            continue
-        spectrum = S[:, frame]
-        centroid = np.sum(freqs * spectrum) / (np.sum(spectrum) + 1e-6)
-
-        if centroid < 200:
-            kick_times.append(onset_time)
-        elif centroid < 2000:
-            snare_times.append(onset_time)
-        else:
-            hihat_times.append(onset_time)
-
-    beat_duration = 60.0 / bpm
-    sixteenth = beat_duration / 4
+    y, sr = load_audio(drums_path, sr=sr, mono=True)
+    duration = len(y) / sr
+    features = compute_beat_features(regular_beats(bpm, duration), duration, bpm, percussive=(y, sr),
+                                     stores={"percussive": FeatureStore(drums_path)})
+    return analyze_drums_features(features)
 
-    def quantize(times):
-        return [round(t / sixteenth) * sixteenth for t in times]
 
-    kick_times = quantize(kick_times)
-    snare_times = quantize(snare_times)
-    hihat_times = quantize(hihat_times)
+def analyze_drums_features(features: BeatFeatures) -> DrumPattern:
+    """Drum analysis on the beat-synchronous onset mask (kick/snare/hi-hat bands)."""
+    kick_times = features.onset_times("kick").round(4).tolist()
+    snare_times = features.onset_times("snare").round(4).tolist()
+    hihat_times = features.onset_times("hihat").round(4).tolist()
 
-    duration = librosa.get_duration(y=y, sr=sr)
-    num_beats = duration / beat_duration
-    hihat_density = int(len(hihat_times) / max(num_beats, 1))
+    hihat_density = int(len(hihat_times) / max(features.n_beats, 1))
     hihat_density = min(max(hihat_density, 2), 16)
 
-    pattern = generate_drum_pattern(kick_times, snare_times, hihat_density, bpm)
+    loop = mine_loop(features.onset_mask)
+    pattern = generate_drum_pattern(loop, hihat_density)
     return DrumPattern(pattern=pattern, kick_times=kick_times[:32], snare_times=snare_times[:32],
                        hihat_times=hihat_times[:32], hihat_density=hihat_density)
 
 
-def generate_drum_pattern(kicks: List[float], snares: List[float], hihat_density: int, bpm: float) -> str:
-    """Generate Strudel mini-notation for drums."""
-    beat_dur = 60.0 / bpm
+def generate_drum_pattern(loop: DrumLoop, hihat_density: int) -> str:
+    """Generate Strudel mini-notation for drums from the track's dominant bar."""
     kick_pattern, snare_pattern = [], []
+    kick, snare = loop.pattern[0], loop.pattern[1]
 
     for beat in range(4):
-        beat_start = beat * beat_dur
-        beat_end = (beat + 1) * beat_dur
-        has_kick = any(beat_start <= k < beat_end for k in kicks[:16])
-        has_snare = any(beat_start <= s < beat_end for s in snares[:16])
-        kick_pattern.append("bd" if has_kick else "~")
-        snare_pattern.append("sd" if has_snare else "~")
+        steps = slice(beat * 4, (beat + 1) * 4)
+        kick_pattern.append("bd" if kick[steps].any() else "~")
+        snare_pattern.append("sd" if snare[steps].any() else "~")
 
     kick_str = " ".join(kick_pattern)
     snare_str = " ".join(snare_pattern)
     return f's("{kick_str}, {snare_str}, hh*{hihat_density}")'
 
 
-def analyze_bass(bass_path: str, key: str, mode: str, sr: int = 22050) -> BassPattern:
+def analyze_bass(bass_path: str, key: str, mode: str, sr: int = 22050,
+                 bpm: Optional[float] = None) -> BassPattern:
     """Analyze bass stem to extract pitch pattern."""
-    y, sr = librosa.load(bass_path, sr=sr, mono=True)
-    pitches, magnitudes = librosa.piptrack(y=y, sr=sr, fmin=30, fmax=500)
-    pitch_values = []
+    y, sr = load_audio(bass_path, sr=sr, mono=True)
+    duration = len(y) / sr
+    beats = regular_beats(bpm, duration) if bpm else tempo.track_beats(bass_path, y=y, sr=sr).beats
+    features = compute_beat_features(beats, duration, bpm, bass=to_band_rate(y, sr, "bass"),
+                                     stores={"bass": FeatureStore(bass_path)})
+    return analyze_bass_features(features, key, mode)
+
+
+# Beats whose strongest bass pitch is below this fraction of the track's
+# strongest are treated as rests.
+BASS_VOICING = 0.1
 
-    for t in range(pitches.shape[1]):
-        index = magnitudes[:, t].argmax()
-        pitch = pitches[index, t]
-        if pitch > 0:
-            pitch_values.append(pitch)
 
-    if not pitch_values:
+def analyze_bass_features(features: BeatFeatures, key: str, mode: str) -> BassPattern:
+    """Bass analysis on per-beat low-register pitch salience (one note per beat)."""
+    salience = features.bass_salience
+    strength = salience.max(axis=0) if salience.size else np.zeros(0)
+    voiced = strength >= BASS_VOICING * strength.max() if strength.size and strength.max() > 0 \
+        else np.zeros(len(strength), dtype=bool)
+
+    if not voiced.any():
         scale = f"{key}:minor" if mode == "minor" else f"{key}:major"
         return BassPattern(pattern='n("0").scale("C2:minor")', notes=["C2"],
                           scale_degrees=[0], root_note="C2", scale=scale)
 
-    midi_notes = librosa.hz_to_midi(np.array(pitch_values))
+    midi_notes = features.bass_midi[salience.argmax(axis=0)][voiced]
     root_midi = librosa.note_to_midi(f"{key}2")
     scale_intervals = [0, 2, 3, 5, 7, 8, 10] if mode == "minor" else [0, 2, 4, 5, 7, 9, 11]
 
@@ -299,38 +250,33 @@ def analyze_bass(bass_path: str, key: str, mode: str, sr: int = 22050) -> BassPa
                       scale_degrees=scale_degrees[:8], root_note=f"{key}2", scale=scale_name)
 
 
-def analyze_chords(other_path: str, key: str, mode: str, sr: int = 22050) -> ChordProgression:
+def analyze_chords(other_path: str, key: str, mode: str, sr: int = 22050,
+                   bpm: Optional[float] = None) -> ChordProgression:
     """Analyze harmonic content for chord progression."""
-    y, sr = librosa.load(other_path, sr=sr, mono=True)
-    chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-
-    chord_templates = {
-        'maj': [1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0],
-        'min': [1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0],
-        '7': [1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 1, 0],
-        'm7': [1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0],
-    }
-
-    n_segments = 4
-    segment_len = chroma.shape[1] // n_segments
-    progression = []
-
-    for i in range(n_segments):
-        segment_chroma = np.mean(chroma[:, i*segment_len:(i+1)*segment_len], axis=1)
-        best_score, best_chord = -1, f"{key}m" if mode == "minor" else key
-
-        for root_idx, root in enumerate(PITCH_CLASSES):
-            for chord_type, template in chord_templates.items():
-                rotated = np.roll(template, root_idx)
-                score = np.corrcoef(segment_chroma, rotated)[0, 1]
-                if score > best_score:
-                    best_score = score
-                    suffix = "" if chord_type == "maj" else "m" if chord_type == "min" else chord_type
-                    best_chord = f"{root}{suffix}"
-        progression.append(best_chord)
+    y, sr = load_audio(other_path, sr=sr, mono=True)
+    duration = len(y) / sr
+    beats = regular_beats(bpm, duration) if bpm else tempo.track_beats(other_path, y=y, sr=sr).beats
+    features = compute_beat_features(beats, duration, bpm, harmonic=to_band_rate(y, sr, "chords"),
+                                     stores={"harmonic": FeatureStore(other_path)})
+    return analyze_chords_features(features, key, mode)
+
+
+def analyze_chords_features(features: BeatFeatures, key: str, mode: str) -> ChordProgression:
+    """Chord analysis on per-beat chroma.
+
+    Every beat is scored against all chord templates and the whole track is
+    Viterbi-smoothed; the Strudel pattern uses the most common 4-bar loop.
+    """
+    timeline = chord_engine.recognize_chords(features.chroma, features.beat_times,
+                                             end_time=features.duration,
+                                             prior=chord_engine.key_prior(key, mode))
+    progression = chord_engine.dominant_progression(timeline)
+    if not progression:
+        progression = [f"{key}m" if mode == "minor" else key]
 
     chord_str = " ".join(progression)
-    return ChordProgression(progression=progression, strudel=f'chord("<{chord_str}>").voicing()')
+    return ChordProgression(progression=progression, strudel=f'chord("<{chord_str}>").voicing()',
+                            timeline=timeline)
 
 
 def generate_strudel_code(analysis: AnalysisResult) -> str:
@@ -360,8 +306,120 @@ def generate_strudel_code(analysis: AnalysisResult) -> str:
     return '\n'.join(lines)
 
 
-def analyze_audio(audio_path: str, output_dir: str = "output") -> AnalysisResult:
-    """Main analysis pipeline."""
+ANALYSIS_SR = 22050
+BEAT_EXCERPT_SECONDS = 60
+
+
+# Pipeline stages. Each takes the results of the stages it depends on as
+# keyword arguments named after them; see build_stages() for the graph.
+
+def _stage_audio(audio_path: str) -> np.ndarray:
+    y, _ = load_audio(audio_path, sr=ANALYSIS_SR, mono=True)
+    return np.asarray(y)
+
+
+def _stage_key(audio: np.ndarray) -> Tuple[str, str, float]:
+    return detect_key(audio, ANALYSIS_SR)
+
+
+def _stage_stems(audio_path: str, threads: Optional[int] = None) -> Dict[str, str]:
+    logging.info("Running source separation...")
+    return run_demucs(audio_path, threads)
+
+
+# Stem -> band whose rate its analyser runs at (see multirate.BAND_NYQUIST)
+STEM_BANDS = {"drums": "drums", "bass": "bass", "other": "chords"}
+
+
+def _stage_stem_audio(stems: Dict[str, str]) -> Dict[str, np.ndarray]:
+    """Decode the stems once, each resampled to the rate its analyser needs;
+    the analysers receive them through shared memory."""
+    decoded = {}
+    for name, band in STEM_BANDS.items():
+        if name in stems:
+            y, _ = load_audio(stems[name], sr=ANALYSIS_SR, mono=True)
+            decoded[name], _ = to_band_rate(y, ANALYSIS_SR, band)
+    return decoded
+
+
+def _stage_beats(audio_path: str) -> Dict:
+    grid = detect_beats(audio_path)
+    return {"bpm": snap_bpm(grid), "beat_times": np.asarray(grid.beats)}
+
+
+# Stem -> the source it feeds in compute_beat_features
+STEM_SOURCES = {"drums": "percussive", "other": "harmonic", "bass": "bass"}
+
+
+def _stage_features(stems: Dict[str, str], stem_audio: Dict[str, np.ndarray], beats: Dict) -> Optional[Dict]:
+    """The beat-synchronous tensor all stem analysers work from.
+
+    Frame-level stem features come from each stem's feature store when an
+    earlier run computed them, so only the beat-grid reduction is redone.
+    """
+    if not stem_audio:
+        return None
+    sources = {name: (np.asarray(y), band_rate(STEM_BANDS[name], ANALYSIS_SR))
+               for name, y in stem_audio.items()}
+    duration = max(len(y) / rate for y, rate in sources.values())
+    stores = {STEM_SOURCES[name]: FeatureStore(stems[name]) for name in stem_audio}
+    features = compute_beat_features(beats["beat_times"], duration, beats["bpm"],
+                                     percussive=sources.get("drums"), harmonic=sources.get("other"),
+                                     bass=sources.get("bass"), stores=stores)
+    return features.as_arrays()
+
+
+def _stage_drums(features: Dict) -> Optional[Dict]:
+    features = BeatFeatures.from_arrays(features)
+    if features.onset_mask.size == 0:
+        return None
+    return asdict(analyze_drums_features(features))
+
+
+def _stage_bass(features: Dict, key: Tuple[str, str, float]) -> Optional[Dict]:
+    features = BeatFeatures.from_arrays(features)
+    if features.bass_salience.size == 0:
+        return None
+    return asdict(analyze_bass_features(features, key[0], key[1]))
+
+
+def _stage_chords(features: Dict, key: Tuple[str, str, float]) -> Optional[Dict]:
+    features = BeatFeatures.from_arrays(features)
+    if features.chroma.size == 0:
+        return None
+    return asdict(analyze_chords_features(features, key[0], key[1]))
+
+
+def build_stages(audio_path: str, separation_threads: Optional[int] = None) -> List[Stage]:
+    """The analysis DAG. Beats, key and separation are independent; the stems
+    are reduced onto the beat grid once, and the stem analysers work from
+    that tensor plus the global feature they need."""
+    return [
+        Stage("audio", _stage_audio, kwargs={"audio_path": audio_path}, in_process=True),
+        Stage("beats", _stage_beats, kwargs={"audio_path": audio_path}),
+        Stage("key", _stage_key, deps=["audio"]),
+        Stage("stems", _stage_stems, kwargs={"audio_path": audio_path, "threads": separation_threads}),
+        Stage("stem_audio", _stage_stem_audio, deps=["stems"], in_process=True),
+        Stage("features", _stage_features, deps=["stems", "stem_audio", "beats"]),
+        Stage("drums", _stage_drums, deps=["features"]),
+        Stage("bass", _stage_bass, deps=["features", "key"]),
+        Stage("chords", _stage_chords, deps=["features", "key"]),
+    ]
+
+
+def analyze_audio(audio_path: str, output_dir: str = "output",
+                  stage_workers: Optional[int] = None, excerpt_bars: Optional[int] = None,
+                  separation_threads: Optional[int] = None, name: Optional[str] = None) -> AnalysisResult:
+    """Main analysis pipeline.
+
+    stage_workers sets how many independent stages run concurrently
+    (default: one per core, up to the width of the stage graph; 1 = serial).
+    separation_threads caps the torch threads of source separation
+    (default: all cores). The outputs are analysis/<name>_analysis.json and
+    analysis/<name>.js, name defaulting to the file's stem.
+    With excerpt_bars every stage runs on the track's most representative
+    excerpt_bars bars (see excerpt.py) instead of the whole track.
+    """
     import_dependencies()
     audio_path, output_dir = Path(audio_path), Path(output_dir)
 
@@ -369,75 +427,317 @@ def analyze_audio(audio_path: str, output_dir: str = "output") -> AnalysisResult
         raise FileNotFoundError(f"Audio file not found: {audio_path}")
 
     logging.info(f"Analyzing: {audio_path}")
-    stems_dir = output_dir / "stems" / audio_path.stem
     analysis_dir = output_dir / "analysis"
-    stems_dir.mkdir(parents=True, exist_ok=True)
     analysis_dir.mkdir(parents=True, exist_ok=True)
 
-    y, sr = librosa.load(str(audio_path), sr=22050, mono=True)
-    duration = librosa.get_duration(y=y, sr=sr)
-
-    logging.info("Detecting BPM...")
-    bpm = detect_bpm_madmom(str(audio_path))
-    logging.info("Detecting key...")
-    key, mode, confidence = detect_key(y, sr)
+    source, window = audio_path, None
+    if excerpt_bars:
+        window = excerpt.excerpt_audio(audio_path, excerpt_bars)
+        source = Path(window.path)
+        logging.info(f"Analyzing {excerpt_bars} bars: {window.start:.1f}-{window.end:.1f}s")
+
+    if stage_workers is None:
+        stage_workers = min(available_cores(), 4)
+    stages = build_stages(str(source), separation_threads)
+    results = run_stages(stages, max_workers=stage_workers, initializer=import_dependencies)
+
+    if results["audio"] is None:
+        raise RuntimeError(f"Could not decode {audio_path}")
+    duration = window.track_duration if window else len(results["audio"]) / ANALYSIS_SR
+    bpm = results["beats"]["bpm"] if results["beats"] is not None else 120.0
+    key, mode, confidence = results["key"] if results["key"] is not None else ("C", "major", 0.0)
     logging.info(f"BPM: {bpm}, Key: {key} {mode} (confidence: {confidence:.2f})")
-
-    stems = {}
-    try:
-        logging.info("Running source separation...")
-        stems = run_demucs(str(audio_path), str(output_dir / "stems"))
-    except Exception as e:
-        logging.warning(f"Source separation failed: {e}")
-
-    drums_analysis = bass_analysis = chords_analysis = None
-
-    if "drums" in stems:
-        try:
-            drums_analysis = asdict(analyze_drums(stems["drums"], bpm))
-        except Exception as e:
-            logging.warning(f"Drum analysis failed: {e}")
-
-    if "bass" in stems:
-        try:
-            bass_analysis = asdict(analyze_bass(stems["bass"], key, mode))
-        except Exception as e:
-            logging.warning(f"Bass analysis failed: {e}")
-
-    if "other" in stems:
-        try:
-            chords_analysis = asdict(analyze_chords(stems["other"], key, mode))
-        except Exception as e:
-            logging.warning(f"Chord analysis failed: {e}")
+    stems = results["stems"] or {}
+    if not stems:
+        logging.warning("Source separation failed; skipping stem analysis")
+    stems_dir = str(Path(next(iter(stems.values()))).parent) if stems else ""
 
     result = AnalysisResult(
         file=str(audio_path.name), bpm=bpm, key=key, mode=mode,
-        duration_seconds=duration, drums=drums_analysis, bass=bass_analysis,
-        chords=chords_analysis, suggested_strudel="", stems_dir=str(stems_dir)
+        duration_seconds=duration, drums=results["drums"], bass=results["bass"],
+        chords=results["chords"], suggested_strudel="", stems_dir=stems_dir,
+        excerpt=asdict(window) if window else None
     )
     result.suggested_strudel = generate_strudel_code(result)
 
-    with open(analysis_dir / f"{audio_path.stem}_analysis.json", 'w') as f:
+    name = name or audio_path.stem
+    with open(analysis_dir / f"{name}_analysis.json", 'w') as f:
         json.dump(asdict(result), f, indent=2)
-    with open(analysis_dir / f"{audio_path.stem}.js", 'w') as f:
+    with open(analysis_dir / f"{name}.js", 'w') as f:
         f.write(result.suggested_strudel)
 
     logging.info(f"Analysis saved to: {analysis_dir}")
     return result
 
 
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".flac", ".ogg", ".m4a", ".aiff"}
+MANIFEST_NAME = "batch_manifest.json"
+
+
+def available_cores() -> int:
+    """CPU cores this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def load_manifest(manifest_path: Path) -> Dict:
+    if manifest_path.exists():
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {"files": {}}
+
+
+def save_manifest(manifest: Dict, manifest_path: Path) -> None:
+    """Write the manifest atomically so a crash never leaves it half-written."""
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def _init_batch_worker(log_level: int) -> None:
+    logging.basicConfig(level=log_level, format="%(asctime)s - %(levelname)s - %(message)s")
+    import_dependencies()
+
+
+def worker_threads(jobs: int) -> int:
+    """CPU threads each of jobs pool workers may use, so together they fill the cores once."""
+    return max(1, available_cores() // jobs)
+
+
+def batch_output_name(rel: str) -> str:
+    """Output name for a batch file from its path under the batch root.
+
+    Directories and the extension are kept, so a/intro.mp3, b/intro.mp3 and
+    a/intro.wav do not overwrite each other's results: a__intro_mp3.
+    """
+    rel = Path(rel)
+    return "__".join(rel.with_suffix("").parts) + "_" + rel.suffix.lstrip(".")
+
+
+def _analyze_for_batch(audio_path: str, output_dir: str, excerpt_bars: Optional[int] = None,
+                       threads: Optional[int] = None, name: Optional[str] = None) -> Dict:
+    """Process-pool entry point: never raises, always returns a manifest entry."""
+    start = time.time()
+    try:
+        # Files already run in parallel; keep each file's stages serial.
+        result = analyze_audio(audio_path, output_dir, stage_workers=1, excerpt_bars=excerpt_bars,
+                               separation_threads=threads, name=name)
+        name = name or Path(audio_path).stem
+        return {"status": "completed", "duration_seconds": result.duration_seconds,
+                "bpm": result.bpm, "key": f"{result.key} {result.mode}",
+                "analysis": f"{name}_analysis.json", "strudel": f"{name}.js",
+                "wall_seconds": round(time.time() - start, 2)}
+    except Exception as e:
+        return {"status": "failed", "error": f"{type(e).__name__}: {e}",
+                "wall_seconds": round(time.time() - start, 2)}
+
+
+def analyze_batch(batch_dir: str, output_dir: str = "output", jobs: Optional[int] = None,
+                  retry_failed: bool = False, excerpt_bars: Optional[int] = None) -> Dict:
+    """Analyze every audio file under batch_dir in a process pool.
+
+    Progress is recorded in output/analysis/batch_manifest.json after each file,
+    so an interrupted run resumes where it left off. Each completed entry
+    names its outputs, which are unique per path (see batch_output_name).
+    """
+    batch_dir, output_dir = Path(batch_dir), Path(output_dir)
+    analysis_dir = output_dir / "analysis"
+    analysis_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = analysis_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    entries = manifest["files"]
+
+    audio_files = sorted(p for p in batch_dir.rglob("*") if p.suffix.lower() in AUDIO_EXTENSIONS)
+    todo, skipped = [], 0
+    for path in audio_files:
+        rel = str(path.relative_to(batch_dir))
+        previous = entries.get(rel, {}).get("status")
+        if previous == "completed" or (previous == "failed" and not retry_failed):
+            skipped += 1
+            continue
+        if path.stat().st_size == 0:
+            entries[rel] = {"status": "skipped", "error": "empty file"}
+            skipped += 1
+            continue
+        todo.append((rel, path))
+    save_manifest(manifest, manifest_path)
+
+    jobs = min(jobs or available_cores(), max(len(todo), 1))
+    logging.info(f"Batch: {len(todo)} to analyze, {skipped} skipped, {jobs} workers")
+
+    start = time.time()
+    audio_seconds = 0.0
+    counts = {"completed": 0, "failed": 0}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(logging.getLogger().level,)) as executor:
+        futures = {executor.submit(_analyze_for_batch, str(path), str(output_dir), excerpt_bars,
+                                   worker_threads(jobs), batch_output_name(rel)): rel
+                   for rel, path in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            rel = futures[future]
+            entry = future.result()
+            entries[rel] = entry
+            counts[entry["status"]] += 1
+            audio_seconds += entry.get("duration_seconds", 0.0)
+            save_manifest(manifest, manifest_path)
+            logging.info(f"[{done}/{len(todo)}] {entry['status']}: {rel}")
+
+    wall = time.time() - start
+    summary = {
+        "completed": counts["completed"],
+        "failed": counts["failed"],
+        "skipped": skipped,
+        "audio_seconds": round(audio_seconds, 1),
+        "wall_seconds": round(wall, 1),
+        "realtime_factor": round(audio_seconds / wall, 2) if wall > 0 else 0.0,
+        "manifest": str(manifest_path),
+    }
+    manifest["last_run"] = summary
+    save_manifest(manifest, manifest_path)
+    return summary
+
+
+def write_segment(audio_path: Path, start: float, end: float, out_path: Path) -> None:
+    """Copy [start, end) seconds of audio_path to a 16-bit WAV, reading only that span."""
+    import soundfile as sf
+
+    info = sf.info(str(audio_path))
+    y, sr = sf.read(str(audio_path), start=int(start * info.samplerate),
+                    stop=int(end * info.samplerate), dtype="float32", always_2d=True)
+    sf.write(str(out_path), y, sr, subtype="PCM_16")
+
+
+def _analyze_for_mix(audio_path: str, output_dir: str, excerpt_bars: Optional[int] = None,
+                     threads: Optional[int] = None) -> Dict:
+    """Process-pool entry point for one track of a mix: never raises."""
+    start = time.time()
+    try:
+        result = analyze_audio(audio_path, output_dir, stage_workers=1, excerpt_bars=excerpt_bars,
+                               separation_threads=threads)
+        return {"status": "completed", "result": asdict(result),
+                "wall_seconds": round(time.time() - start, 2)}
+    except Exception as e:
+        return {"status": "failed", "error": f"{type(e).__name__}: {e}",
+                "wall_seconds": round(time.time() - start, 2)}
+
+
+def analyze_mix(audio_path: str, output_dir: str = "output", jobs: Optional[int] = None,
+                tracks: Optional[int] = None, min_track: float = MIN_TRACK_SECONDS,
+                excerpt_bars: Optional[int] = None) -> Dict:
+    """Split a DJ mix into tracks and analyze them in a process pool.
+
+    Boundaries come from mix_segmentation (one cheap block-wise pass); each
+    track is cut to output/mix/<mix>/<mix>_NN.wav and gets the full
+    single-file analysis, so every track has its own AnalysisResult and
+    Strudel suggestion (of its most representative excerpt_bars bars, if
+    given). The timeline (start, end, bpm, key and status of each
+    track) is written to output/analysis/<mix>_timeline.json and returned.
+    """
+    audio_path, output_dir = Path(audio_path), Path(output_dir)
+    if not audio_path.exists():
+        raise FileNotFoundError(f"Audio file not found: {audio_path}")
+    analysis_dir = output_dir / "analysis"
+    analysis_dir.mkdir(parents=True, exist_ok=True)
+    segment_dir = output_dir / "mix" / audio_path.stem
+    segment_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.time()
+    segments = segment_mix(audio_path, tracks, min_track)
+    logging.info(f"Mix: {len(segments)} tracks found in {time.time() - start:.1f}s")
+    paths = []
+    for i, segment in enumerate(segments, 1):
+        path = segment_dir / f"{audio_path.stem}_{i:02d}.wav"
+        write_segment(audio_path, segment.start, segment.end, path)
+        paths.append(path)
+
+    jobs = min(jobs or available_cores(), max(len(segments), 1))
+    entries: List[Optional[Dict]] = [None] * len(segments)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(logging.getLogger().level,)) as executor:
+        futures = {executor.submit(_analyze_for_mix, str(path), str(output_dir), excerpt_bars,
+                                   worker_threads(jobs)): i
+                   for i, path in enumerate(paths)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            entries[i] = future.result()
+            logging.info(f"[{done}/{len(segments)}] {entries[i]['status']}: {paths[i].name}")
+
+    timeline = []
+    for i, (segment, path, entry) in enumerate(zip(segments, paths, entries), 1):
+        item = {"track": i, "start": segment.start, "end": segment.end,
+                "boundary_score": segment.score, "file": path.name, "status": entry["status"]}
+        if entry["status"] == "completed":
+            result = entry["result"]
+            item.update(bpm=result["bpm"], key=result["key"], mode=result["mode"],
+                        analysis=f"{path.stem}_analysis.json", strudel=f"{path.stem}.js")
+        else:
+            item["error"] = entry["error"]
+        timeline.append(item)
+
+    summary = {"file": audio_path.name, "duration_seconds": segments[-1].end if segments else 0.0,
+               "wall_seconds": round(time.time() - start, 1), "tracks": timeline}
+    with open(analysis_dir / f"{audio_path.stem}_timeline.json", 'w') as f:
+        json.dump(summary, f, indent=2)
+    logging.info(f"Timeline saved to: {analysis_dir / f'{audio_path.stem}_timeline.json'}")
+    return summary
+
+
 def main():
     parser = argparse.ArgumentParser(description="Extract musical features from audio for Strudel composition")
-    parser.add_argument("audio_file", help="Path to audio file (mp3, wav, etc.)")
+    parser.add_argument("audio_file", nargs="?", help="Path to audio file (mp3, wav, etc.)")
+    parser.add_argument("--batch", metavar="DIR", help="Analyze every audio file under DIR")
+    parser.add_argument("--mix", action="store_true",
+                        help="Treat audio_file as a DJ mix: split it into tracks and analyze each")
+    parser.add_argument("--tracks", type=int, help="Number of tracks in the --mix, if known")
+    parser.add_argument("--min-track", type=float, default=MIN_TRACK_SECONDS,
+                        help="Shortest track in seconds for --mix")
+    parser.add_argument("--jobs", "-j", type=int,
+                        help="Worker processes for --batch and --mix (default: all cores)")
+    parser.add_argument("--stage-workers", type=int,
+                        help="Concurrent pipeline stages for a single file (1 = serial)")
+    parser.add_argument("--bars", type=int,
+                        help="Analyze only the most representative N bars of each track (default: all)")
+    parser.add_argument("--retry-failed", action="store_true", help="Re-run files marked failed in the manifest")
     parser.add_argument("--output-dir", "-o", default="output", help="Output directory")
     parser.add_argument("--verbose", "-v", action="store_true", help="Verbose logging")
     args = parser.parse_args()
 
+    if bool(args.audio_file) == bool(args.batch):
+        parser.error("give exactly one of audio_file or --batch DIR")
+    if args.mix and not args.audio_file:
+        parser.error("--mix needs an audio_file")
+
     logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
                        format="%(asctime)s - %(levelname)s - %(message)s")
 
+    if args.batch:
+        summary = analyze_batch(args.batch, args.output_dir, args.jobs, args.retry_failed, args.bars)
+        print(f"\n{'='*60}\nBATCH COMPLETE\n{'='*60}")
+        print(f"Completed: {summary['completed']}  Failed: {summary['failed']}  Skipped: {summary['skipped']}")
+        print(f"Audio: {summary['audio_seconds']:.0f}s in {summary['wall_seconds']:.0f}s wall "
+              f"({summary['realtime_factor']:.2f} audio-s per wall-s)")
+        print(f"Manifest: {summary['manifest']}")
+        sys.exit(1 if summary['failed'] else 0)
+
+    if args.mix:
+        summary = analyze_mix(args.audio_file, args.output_dir, args.jobs, args.tracks, args.min_track,
+                              args.bars)
+        print(f"\n{'='*60}\nMIX COMPLETE\n{'='*60}")
+        for track in summary["tracks"]:
+            when = f"{track['start'] // 60:02.0f}:{track['start'] % 60:04.1f}"
+            if track["status"] == "completed":
+                print(f"{track['track']:>3}  {when}  {track['bpm']:>6.1f} BPM  {track['key']} {track['mode']}")
+            else:
+                print(f"{track['track']:>3}  {when}  failed: {track['error']}")
+        print(f"Wall: {summary['wall_seconds']:.0f}s  Timeline and Strudel code in: "
+              f"{Path(args.output_dir) / 'analysis'}")
+        sys.exit(1 if any(t["status"] != "completed" for t in summary["tracks"]) else 0)
+
     try:
-        result = analyze_audio(args.audio_file, args.output_dir)
+        result = analyze_audio(args.audio_file, args.output_dir, args.stage_workers, args.bars)
         print(f"\n{'='*60}\nANALYSIS COMPLETE\n{'='*60}")
         print(f"File: {result.file}\nBPM: {result.bpm}\nKey: {result.key} {result.mode}")
         print(f"Duration: {result.duration_seconds:.1f}s\n\nSuggested Strudel Code:\n{'-'*60}")
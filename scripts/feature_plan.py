@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Declarative feature plans: compute each intermediate representation once.
+
+An analysis is a table of nodes. Each node names the nodes (or inputs) it
+is computed from, like a Stage in stage_scheduler.py, and each output the
+caller asks for (key, tempo, band balance, structure, plots) is just
+another node. run_plan resolves the minimal DAG for the requested outputs,
+computes every node in it exactly once, and drops each intermediate as soon
+as its last consumer has run, so one magnitude STFT can feed the band
+balance, the drum bands and the mel spectrogram without any of them being
+held longer than needed.
+
+Every run reports per-node wall time and result size and, when traced,
+the memory live when each node started and its peak above that.
+
+Example:
+    nodes = [
+        Node("stft", lambda y: np.abs(librosa.stft(y)), deps=["y"]),
+        Node("mel", lambda stft, sr: librosa.feature.melspectrogram(S=stft ** 2, sr=sr),
+             deps=["stft", "sr"]),
+        Node("bands", band_sums, deps=["stft", "sr"]),
+    ]
+    results, stats = run_plan(nodes, ["mel", "bands"], {"y": y, "sr": sr}, trace_memory=True)
+    print(format_report(stats))
+
+    # The same plan per block of a long file (see streaming.py)
+    frames, duration = stream_features(path, {"plan": block_extractor(nodes, ["mel", "bands"])})
+"""
+
+import logging
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+MB = 1024 * 1024
+
+
+@dataclass
+class Node:
+    """One intermediate or output.
+
+    func is called with the values of ``deps`` as keyword arguments (named
+    after the dependency) plus ``kwargs``. A dependency is another node or
+    one of the inputs passed to run_plan.
+    """
+    name: str
+    func: Callable
+    deps: List[str] = field(default_factory=list)
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class NodeStats:
+    name: str
+    seconds: float
+    live_mb: float               # traced memory already held when the node started
+    peak_mb: float               # peak traced allocation above that level while it ran
+    result_mb: float             # size of the value the node produced
+    freed_after: Optional[str]   # node whose completion released the value (None: returned)
+
+
+Nodes = Union[Sequence[Node], Dict[str, Node]]
+
+
+def _table(nodes: Nodes) -> Dict[str, Node]:
+    return dict(nodes) if isinstance(nodes, dict) else {node.name: node for node in nodes}
+
+
+def resolve(nodes: Nodes, outputs: Iterable[str], inputs: Iterable[str] = ()) -> List[Node]:
+    """The nodes needed for outputs, in an order where every dependency comes first.
+
+    Ties keep the order of the node table, so a table written in pipeline
+    order runs in pipeline order.
+    """
+    table, inputs = _table(nodes), set(inputs)
+    needed = set()
+    stack = [name for name in outputs if name not in inputs]
+    while stack:
+        name = stack.pop()
+        if name in needed:
+            continue
+        if name not in table:
+            raise KeyError(f"no node or input named {name!r}")
+        needed.add(name)
+        stack.extend(d for d in table[name].deps if d not in inputs)
+
+    ordered, done = [], set(inputs)
+    pending = [node for name, node in table.items() if name in needed]
+    while pending:
+        ready = [node for node in pending if all(d in done for d in node.deps)]
+        if not ready:
+            raise ValueError(f"dependency cycle among {', '.join(n.name for n in pending)}")
+        for node in ready:
+            ordered.append(node)
+            done.add(node.name)
+            pending.remove(node)
+    return ordered
+
+
+def nbytes(value: Any) -> int:
+    """Bytes of array data reachable from value (arrays, containers, dataclasses)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if hasattr(value, "__dict__"):
+        return sum(nbytes(v) for v in vars(value).values())
+    return 0
+
+
+def run_plan(nodes: Nodes, outputs: Sequence[str], inputs: Optional[Dict[str, Any]] = None,
+             trace_memory: bool = False) -> Tuple[Dict[str, Any], List[NodeStats]]:
+    """Compute outputs from inputs and return ({output: value}, per-node stats).
+
+    Inputs and intermediates are released once every planned consumer has
+    run; only the outputs are returned. Times are always recorded; with
+    trace_memory, memory is measured with tracemalloc (numpy reports its
+    buffers to it), started for the run unless the caller already traces.
+    Tracing roughly doubles the run time, so it is for profiling only.
+    A node that raises aborts the run.
+    """
+    values = dict(inputs or {})
+    order = resolve(nodes, outputs, values)
+    wanted = set(outputs)
+    consumers: Dict[str, int] = {}
+    for node in order:
+        for d in node.deps:
+            consumers[d] = consumers.get(d, 0) + 1
+    for name in list(values):
+        if name not in consumers and name not in wanted:
+            del values[name]
+
+    stats: Dict[str, NodeStats] = {}
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        for node in order:
+            kwargs = {**node.kwargs, **{d: values[d] for d in node.deps}}
+            base = 0
+            if trace_memory:
+                base = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            values[node.name] = node.func(**kwargs)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - base if trace_memory else 0
+            del kwargs
+            stats[node.name] = NodeStats(name=node.name, seconds=elapsed,
+                                         live_mb=base / MB if trace_memory else 0.0,
+                                         peak_mb=max(peak, 0) / MB,
+                                         result_mb=nbytes(values[node.name]) / MB, freed_after=None)
+
+            for d in node.deps:
+                consumers[d] -= 1
+                if consumers[d] == 0 and d not in wanted:
+                    del values[d]
+                    if d in stats:
+                        stats[d].freed_after = node.name
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    _log_report(list(stats.values()))
+    return {name: values[name] for name in outputs}, list(stats.values())
+
+
+def block_extractor(nodes: Nodes, outputs: Sequence[str]) -> Callable[[np.ndarray, int], Dict[str, np.ndarray]]:
+    """A streaming.py extractor running the plan on each block (inputs y and sr).
+
+    Returns {output: frames}; stream_features pools and concatenates each
+    output under its own name. Per-block stats are not traced.
+    """
+    def extract(y: np.ndarray, sr: int) -> Dict[str, np.ndarray]:
+        results, _ = run_plan(nodes, outputs, {"y": y, "sr": sr})
+        return results
+    return extract
+
+
+def format_report(stats: List[NodeStats]) -> str:
+    """Table of per-node time, memory and result size; the total row has the run's peak."""
+    lines = [f"{'node':<20} {'time':>8} {'live':>10} {'peak':>10} {'result':>10}  freed after"]
+    for s in stats:
+        lines.append(f"{s.name:<20} {s.seconds:>7.2f}s {s.live_mb:>8.1f}MB {s.peak_mb:>8.1f}MB "
+                     f"{s.result_mb:>8.1f}MB  {s.freed_after or '-'}")
+    total = sum(s.seconds for s in stats)
+    peak = max((s.live_mb + s.peak_mb for s in stats), default=0.0)
+    lines.append(f"{'total':<20} {total:>7.2f}s {'':>10} {peak:>8.1f}MB")
+    return "\n".join(lines)
+
+
+def _log_report(stats: List[NodeStats]) -> None:
+    if stats:
+        summary = ", ".join(f"{s.name}={s.seconds:.2f}s/{s.peak_mb:.0f}MB" for s in stats)
+        logging.debug(f"Plan nodes: {summary}")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Per-track store of frame-level features: STFTs, chroma, onset envelopes,
+HPSS signals and beat grids.
+
+Analysis runs used to keep only their summary JSON, so retuning a drum
+threshold or band meant decoding, separating and transforming every track
+again. Each track now gets a directory
+
+    $MUSICMAN_CACHE_DIR/features/<audio hash>/
+        <name>-<params hash>.npy     one array per feature and parameter set
+        <name>-<params hash>.json    its name, parameters, dtype, shape and attrs
+        index.json                   every entry of the track, for browsing
+
+Entries are keyed by the content hash of the audio (see audio_cache.py) and
+by every parameter that changes the array (sample rate, duration, hop,
+backend, which signal it was computed from), so a changed parameter is a
+miss rather than a stale hit. Arrays are written atomically and their JSON
+last, so an entry without its JSON is never read; index.json is rebuilt
+from the entry files on every write.
+
+Arrays come back as read-only memory maps. This module needs only numpy,
+so training and evaluation code can read features without librosa.
+
+Usage:
+    from feature_store import FeatureStore
+    store = FeatureStore("track.mp3", sr=22050, duration=None)
+    S = store.get_or_compute("stft", {"n_fft": 2048, "hop_length": 512},
+                             lambda: np.abs(librosa.stft(y)), dtype=np.float16)
+
+    # Reading by hash, without the audio or librosa
+    for entry in FeatureStore(track_id=h).find("chroma"):
+        print(entry.params, entry.load().shape)
+
+    python feature_store.py [track.mp3 | <audio hash> ...]   # list entries
+
+Environment:
+    MUSICMAN_FEATURE_STORE=0   Always compute and never write features
+                               (MUSICMAN_AUDIO_CACHE=0 also disables the store)
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from audio_cache import audio_hash, cache_enabled, cache_root, write_atomic
+
+INDEX_NAME = "index.json"
+MB = 1024 * 1024
+
+
+def store_dir() -> Path:
+    """Directory holding one feature directory per track."""
+    return cache_root() / "features"
+
+
+def store_enabled() -> bool:
+    return cache_enabled() and os.environ.get("MUSICMAN_FEATURE_STORE", "1") != "0"
+
+
+def params_key(params: Dict[str, Any]) -> str:
+    digest = hashlib.blake2b(json.dumps(params, sort_keys=True, default=str).encode(), digest_size=6)
+    return digest.hexdigest()
+
+
+@dataclass
+class Entry:
+    name: str
+    params: Dict[str, Any]
+    dtype: str
+    shape: List[int]
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    path: str = ""
+
+    def load(self) -> np.ndarray:
+        return np.load(self.path, mmap_mode="r")
+
+
+class FeatureStore:
+    """Features of one track.
+
+    Give either the audio path or its hash (track_id). Keyword context
+    (sr, duration, source, ...) is merged into the parameters of every
+    entry, so one store object describes one decoding of one signal.
+    None values are dropped, so FeatureStore(path, duration=None) and
+    FeatureStore(path) name the same entries.
+    """
+
+    def __init__(self, audio_path=None, track_id: Optional[str] = None, **context):
+        if track_id is None:
+            if audio_path is None:
+                raise ValueError("FeatureStore needs an audio path or a track id")
+            track_id = audio_hash(audio_path)
+        self.track_id = track_id
+        self.context = {k: v for k, v in context.items() if v is not None}
+        self.path = store_dir() / track_id
+
+    def _files(self, name: str, params: Optional[Dict[str, Any]]):
+        key = f"{name}-{params_key({**self.context, **(params or {})})}"
+        return self.path / f"{key}.npy", self.path / f"{key}.json"
+
+    def entry(self, name: str, params: Optional[Dict[str, Any]] = None) -> Optional[Entry]:
+        """The stored entry for name and params, or None."""
+        npy, meta = self._files(name, params)
+        if not (meta.exists() and npy.exists()):
+            return None
+        try:
+            return Entry(**json.loads(meta.read_text()), path=str(npy))
+        except (ValueError, TypeError, OSError):
+            return None
+
+    def get(self, name: str, params: Optional[Dict[str, Any]] = None) -> Optional[np.ndarray]:
+        """The stored array as a read-only memory map, or None on a miss."""
+        if not store_enabled():
+            return None
+        entry = self.entry(name, params)
+        if entry is None:
+            return None
+        try:
+            return entry.load()
+        except (ValueError, OSError) as e:
+            logging.warning(f"Corrupt feature store entry {Path(entry.path).name}: {e}")
+            Path(entry.path).unlink(missing_ok=True)
+            return None
+
+    def attrs(self, name: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        entry = self.entry(name, params)
+        return entry.attrs if entry is not None else {}
+
+    def put(self, name: str, params: Optional[Dict[str, Any]], value: np.ndarray,
+            dtype=np.float32, attrs: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """Store value as dtype and return it at that dtype."""
+        value = np.ascontiguousarray(value, dtype=dtype)
+        if not store_enabled():
+            return value
+        npy, meta = self._files(name, params)
+        record = {"name": name, "params": {**self.context, **(params or {})},
+                  "dtype": value.dtype.str, "shape": list(value.shape), "attrs": attrs or {}}
+        try:
+            write_atomic(npy, lambda f: np.save(f, value))
+            write_atomic(meta, lambda f: f.write(json.dumps(record, default=str).encode()))
+            self._write_index()
+        except OSError as e:
+            logging.warning(f"Could not store feature {name}: {e}")
+        return value
+
+    def get_or_compute(self, name: str, params: Optional[Dict[str, Any]], compute: Callable[[], Any],
+                       dtype=np.float32, attrs: Optional[Dict[str, Any]] = None) -> np.ndarray:
+        """The stored array, or compute() stored at dtype.
+
+        A miss returns the array at the stored dtype too, so results do not
+        depend on whether the feature was already in the store.
+        """
+        value = self.get(name, params)
+        if value is not None:
+            logging.debug(f"Feature store hit: {name} ({self.track_id[:8]})")
+            return value
+        return self.put(name, params, compute(), dtype, attrs)
+
+    def entries(self) -> List[Entry]:
+        """Every entry of the track, from index.json."""
+        index = self.path / INDEX_NAME
+        if not index.exists():
+            return []
+        try:
+            records = json.loads(index.read_text())["entries"]
+        except (ValueError, KeyError, OSError):
+            return []
+        return [Entry(**record, path=str(self.path / f"{key}.npy")) for key, record in records.items()]
+
+    def find(self, name: str, **params) -> List[Entry]:
+        """Entries called name whose parameters include the given values."""
+        return [e for e in self.entries()
+                if e.name == name and all(e.params.get(k) == v for k, v in params.items())]
+
+    def _write_index(self) -> None:
+        records = {}
+        for meta in sorted(self.path.glob("*.json")):
+            if meta.name == INDEX_NAME or not meta.with_suffix(".npy").exists():
+                continue
+            try:
+                records[meta.stem] = json.loads(meta.read_text())
+            except (ValueError, OSError):
+                continue
+        index = {"track_id": self.track_id, "entries": records}
+        write_atomic(self.path / INDEX_NAME, lambda f: f.write(json.dumps(index, indent=1).encode()))
+
+
+def tracks() -> List[str]:
+    """Hashes of every track with stored features."""
+    root = store_dir()
+    return sorted(p.parent.name for p in root.glob(f"*/{INDEX_NAME}")) if root.exists() else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the stored features of tracks")
+    parser.add_argument("tracks", nargs="*", help="Audio files or audio hashes (default: every track)")
+    args = parser.parse_args()
+
+    for item in args.tracks or tracks():
+        store = FeatureStore(item) if Path(item).exists() else FeatureStore(track_id=item)
+        entries = store.entries()
+        size = sum(Path(e.path).stat().st_size for e in entries if Path(e.path).exists())
+        print(f"{store.track_id}: {len(entries)} features, {size / MB:.1f} MB")
+        for e in entries:
+            params = ", ".join(f"{k}={v}" for k, v in sorted(e.params.items()))
+            print(f"  {e.name:<16} {'x'.join(map(str, e.shape)):>14} {np.dtype(e.dtype).name:<8} {params}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,36 +13,70 @@ import librosa.display
 import matplotlib.pyplot as plt
 import numpy as np
 
+from audio_cache import load_audio
+from chroma import chromagram
+from streaming import (HOP_LENGTH, STREAM_SR, file_duration, frame_peaks, pool_size,
+                       should_stream, stream_features)
+
+# Time columns kept when a long file is streamed instead of loaded
+PLOT_COLUMNS = 4000
+
+
+def streamed_plot_data(audio_path: str, fmax: float = None):
+    """Time-pooled waveform peaks, mel power and chroma of a file, read block-wise.
+
+    Returns (peaks, mel, chroma, hop) where hop is the samples per column at
+    STREAM_SR; memory stays bounded however long the file is.
+    """
+    pool = pool_size(file_duration(audio_path), PLOT_COLUMNS)
+    print(f"Streaming: {audio_path} ({pool} frames per column)")
+    frames, _ = stream_features(audio_path, {
+        "peaks": frame_peaks,
+        "mel": lambda y, sr: librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128, fmax=fmax),
+        "chroma": chromagram,
+    }, pool={"peaks": (pool, np.max), "mel": pool, "chroma": pool})
+    return frames["peaks"][0], frames["mel"], frames["chroma"], HOP_LENGTH * pool
+
 
 def generate_spectrogram(audio_path: str, output_path: str = None,
-                         show: bool = False) -> str:
-    """Generate and save a spectrogram from an audio file."""
+                         show: bool = False, stream: bool = None) -> str:
+    """Generate and save a spectrogram from an audio file.
 
-    print(f"Loading: {audio_path}")
-    y, sr = librosa.load(audio_path, sr=22050)
+    Long files (or stream=True) are read block-wise and plotted from
+    time-pooled features.
+    """
 
     # Create figure with subplots
     fig, axes = plt.subplots(3, 1, figsize=(14, 10))
+    ax1, ax2, ax3 = axes
+
+    if should_stream(audio_path, stream):
+        peaks, S, chroma, hop = streamed_plot_data(audio_path, fmax=8000)
+        sr = STREAM_SR
+        times = np.arange(len(peaks)) * hop / sr
+        ax1.fill_between(times, -peaks, peaks, color='steelblue', linewidth=0)
+        ax1.set_xlim(0, times[-1] if len(times) else 1)
+    else:
+        print(f"Loading: {audio_path}")
+        y, sr = load_audio(audio_path, sr=22050)
+        hop = HOP_LENGTH
+        librosa.display.waveshow(y, sr=sr, ax=ax1, color='steelblue')
+        S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128, fmax=8000)
+        chroma = chromagram(y, sr)
 
     # 1. Waveform
-    ax1 = axes[0]
-    librosa.display.waveshow(y, sr=sr, ax=ax1, color='steelblue')
     ax1.set_title('Waveform')
     ax1.set_xlabel('')
 
     # 2. Mel Spectrogram
-    ax2 = axes[1]
-    S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128, fmax=8000)
     S_dB = librosa.power_to_db(S, ref=np.max)
-    img = librosa.display.specshow(S_dB, x_axis='time', y_axis='mel',
-                                    sr=sr, fmax=8000, ax=ax2, cmap='magma')
+    img = librosa.display.specshow(S_dB, x_axis='time', y_axis='mel', sr=sr, hop_length=hop,
+                                    fmax=8000, ax=ax2, cmap='magma')
     ax2.set_title('Mel Spectrogram')
     fig.colorbar(img, ax=ax2, format='%+2.0f dB')
 
     # 3. Chromagram
-    ax3 = axes[2]
-    chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-    img2 = librosa.display.specshow(chroma, y_axis='chroma', x_axis='time',
+    img2 = librosa.display.specshow(chroma, y_axis='chroma', x_axis='time', sr=sr, hop_length=hop,
                                      ax=ax3, cmap='coolwarm')
     ax3.set_title('Chromagram (Pitch Classes)')
     fig.colorbar(img2, ax=ax3)
@@ -64,41 +98,35 @@ def generate_spectrogram(audio_path: str, output_path: str = None,
     return str(output_path)
 
 
-def compare_spectrograms(audio1: str, audio2: str, output_path: str = None):
+def mel_and_chroma(audio_path: str, stream: bool = None):
+    """(mel power, chroma, sr, hop) of a file, streamed and time-pooled when long."""
+    if should_stream(audio_path, stream):
+        _, S, chroma, hop = streamed_plot_data(audio_path)
+        return S, chroma, STREAM_SR, hop
+    y, sr = load_audio(audio_path, sr=22050)
+    S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128)
+    chroma = chromagram(y, sr)
+    return S, chroma, sr, HOP_LENGTH
+
+
+def compare_spectrograms(audio1: str, audio2: str, output_path: str = None, stream: bool = None):
     """Generate side-by-side comparison of two audio files."""
 
     print(f"Comparing: {audio1} vs {audio2}")
 
-    y1, sr1 = librosa.load(audio1, sr=22050)
-    y2, sr2 = librosa.load(audio2, sr=22050)
-
     fig, axes = plt.subplots(2, 2, figsize=(16, 10))
 
-    # First audio
-    S1 = librosa.feature.melspectrogram(y=y1, sr=sr1, n_mels=128)
-    S1_dB = librosa.power_to_db(S1, ref=np.max)
-
-    librosa.display.specshow(S1_dB, x_axis='time', y_axis='mel',
-                              sr=sr1, ax=axes[0, 0], cmap='magma')
-    axes[0, 0].set_title(f'Audio 1: {Path(audio1).name}')
-
-    chroma1 = librosa.feature.chroma_cqt(y=y1, sr=sr1)
-    librosa.display.specshow(chroma1, y_axis='chroma', x_axis='time',
-                              ax=axes[1, 0], cmap='coolwarm')
-    axes[1, 0].set_title('Chromagram 1')
-
-    # Second audio
-    S2 = librosa.feature.melspectrogram(y=y2, sr=sr2, n_mels=128)
-    S2_dB = librosa.power_to_db(S2, ref=np.max)
+    for col, audio in enumerate([audio1, audio2]):
+        S, chroma, sr, hop = mel_and_chroma(audio, stream)
+        S_dB = librosa.power_to_db(S, ref=np.max)
 
-    librosa.display.specshow(S2_dB, x_axis='time', y_axis='mel',
-                              sr=sr2, ax=axes[0, 1], cmap='magma')
-    axes[0, 1].set_title(f'Audio 2: {Path(audio2).name}')
+        librosa.display.specshow(S_dB, x_axis='time', y_axis='mel', sr=sr, hop_length=hop,
+                                  ax=axes[0, col], cmap='magma')
+        axes[0, col].set_title(f'Audio {col + 1}: {Path(audio).name}')
 
-    chroma2 = librosa.feature.chroma_cqt(y=y2, sr=sr2)
-    librosa.display.specshow(chroma2, y_axis='chroma', x_axis='time',
-                              ax=axes[1, 1], cmap='coolwarm')
-    axes[1, 1].set_title('Chromagram 2')
+        librosa.display.specshow(chroma, y_axis='chroma', x_axis='time', sr=sr, hop_length=hop,
+                                  ax=axes[1, col], cmap='coolwarm')
+        axes[1, col].set_title(f'Chromagram {col + 1}')
 
     plt.tight_layout()
 
@@ -116,7 +144,10 @@ def main():
     parser.add_argument("-o", "--output", help="Output image path")
     parser.add_argument("--compare", help="Second audio file for comparison")
     parser.add_argument("--show", action="store_true", help="Display plot")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read block-wise in bounded memory (automatic for files over 10 minutes)")
     args = parser.parse_args()
+    stream = True if args.stream else None
 
     if not Path(args.audio_file).exists():
         print(f"Error: File not found: {args.audio_file}", file=sys.stderr)
@@ -126,9 +157,9 @@ def main():
         if not Path(args.compare).exists():
             print(f"Error: File not found: {args.compare}", file=sys.stderr)
             sys.exit(1)
-        compare_spectrograms(args.audio_file, args.compare, args.output)
+        compare_spectrograms(args.audio_file, args.compare, args.output, stream)
     else:
-        generate_spectrogram(args.audio_file, args.output, args.show)
+        generate_spectrogram(args.audio_file, args.output, args.show, stream)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Vectorized Krumhansl-Schmuckler key estimation.
+
+The 24 rotated major/minor profiles form one (24 x 12) matrix, so scoring a
+chroma vector against every key is one matrix product (Pearson correlation
+via mean-centred unit vectors), and scoring thousands of tracks or windows
+is the same product with more columns.
+
+The sliding-window mode takes beat-synchronous chroma, builds every window
+sum from one cumulative sum, and reports key changes with timestamps.
+
+Usage:
+    python key_detection.py track1.mp3 track2.mp3 ...   # global key per file
+    python key_detection.py track.mp3 --windowed         # key changes over time
+"""
+
+import argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chroma import HOP_LENGTH, chroma_from_stft, chromagram, n_fft_for
+from chroma import default_backend as chroma_backend
+
+# Krumhansl-Schmuckler key profiles
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+MODES = ['major', 'minor']
+
+
+def _center_unit(x: np.ndarray, axis: int) -> np.ndarray:
+    x = x - x.mean(axis=axis, keepdims=True)
+    norm = np.linalg.norm(x, axis=axis, keepdims=True)
+    return x / np.maximum(norm, 1e-12)
+
+
+def profile_matrix() -> np.ndarray:
+    """(24 x 12) profiles: rows 0-11 major keys on C..B, rows 12-23 minor keys."""
+    idx = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12
+    return np.vstack([MAJOR_PROFILE[idx], MINOR_PROFILE[idx]])
+
+
+_PROFILES = _center_unit(profile_matrix(), axis=1)
+
+
+def key_scores(chroma: np.ndarray) -> np.ndarray:
+    """Correlation of each key profile with each column of a (12 x n) chroma matrix."""
+    chroma = np.asarray(chroma, dtype=float)
+    if chroma.ndim == 1:
+        chroma = chroma[:, None]
+    return _PROFILES @ _center_unit(chroma, axis=0)
+
+
+def key_name(index: int) -> Tuple[str, str]:
+    """(pitch class, mode) for a row of profile_matrix()."""
+    return PITCH_CLASSES[index % 12], MODES[index // 12]
+
+
+def estimate_keys(chroma_vectors: np.ndarray) -> List[Tuple[str, str, float]]:
+    """Best key for every column of a (12 x n) matrix of chroma summaries."""
+    scores = key_scores(chroma_vectors)
+    best = np.argmax(scores, axis=0)
+    conf = scores[best, np.arange(scores.shape[1])]
+    return [(*key_name(i), float(c)) for i, c in zip(best, conf)]
+
+
+def estimate_key(chroma: np.ndarray) -> Tuple[str, str, float]:
+    """Global key of a chroma vector (12,) or chromagram (12 x frames).
+
+    Returns: (key_name, mode, correlation_score)
+    """
+    chroma = np.asarray(chroma, dtype=float)
+    summary = chroma.mean(axis=1) if chroma.ndim == 2 else chroma
+    return estimate_keys(summary[:, None])[0]
+
+
+def windowed_keys(beat_chroma: np.ndarray, beat_times: Sequence[float], window: int = 32,
+                  hop: int = 4, min_windows: int = 2, end_time: Optional[float] = None) -> List[Dict]:
+    """Key segments over time from beat-synchronous chroma (12 x beats).
+
+    Each hop-th beat gets the key of the window-beat span centred on it. All
+    window sums come from one cumulative sum, and every window is scored in
+    one matrix product. Runs shorter than min_windows are merged into the
+    preceding segment so one odd window does not count as a modulation.
+    """
+    beat_chroma = np.asarray(beat_chroma, dtype=float)
+    beat_times = np.asarray(beat_times, dtype=float)
+    n = beat_chroma.shape[1]
+    if n == 0:
+        return []
+
+    cs = np.concatenate([np.zeros((12, 1)), np.cumsum(beat_chroma, axis=1)], axis=1)
+    centers = np.arange(0, n, hop)
+    lo = np.clip(centers - window // 2, 0, n)
+    hi = np.clip(centers + window // 2, 1, n)
+    sums = cs[:, hi] - cs[:, lo]
+
+    scores = key_scores(sums)
+    labels = np.argmax(scores, axis=0)
+    conf = scores[labels, np.arange(len(labels))]
+
+    # Collapse short runs into their predecessor
+    change = np.flatnonzero(np.diff(labels)) + 1
+    starts = np.concatenate([[0], change])
+    ends = np.concatenate([change, [len(labels)]])
+    keep_label = labels.copy()
+    for a, b in zip(starts[1:], ends[1:]):
+        if b - a < min_windows:
+            keep_label[a:b] = keep_label[a - 1]
+    change = np.flatnonzero(np.diff(keep_label)) + 1
+    starts = np.concatenate([[0], change])
+    ends = np.concatenate([change, [len(keep_label)]])
+
+    if end_time is None:
+        end_time = beat_times[-1] + (beat_times[-1] - beat_times[-2] if n > 1 else 0.5)
+    segments = []
+    for a, b in zip(starts, ends):
+        key, mode = key_name(int(keep_label[a]))
+        start = 0.0 if a == 0 else float(beat_times[centers[a]])
+        end = float(end_time) if b == len(keep_label) else float(beat_times[centers[b]])
+        segments.append({"key": key, "mode": mode, "start": round(start, 3), "end": round(end, 3),
+                         "confidence": round(float(np.mean(conf[a:b])), 3)})
+    return segments
+
+
+def harmonic_chroma(y: Optional[np.ndarray], sr: int, backend: Optional[str] = None,
+                    S: Optional[np.ndarray] = None) -> np.ndarray:
+    """Chromagram of the harmonic component, as the key detectors have always used.
+
+    With the stft chroma backend the harmonic part is separated on the
+    magnitude STFT (S, if the caller holds it) and folded to chroma
+    directly, skipping the inverse STFT and the CQT.
+    """
+    import librosa
+
+    backend = backend or chroma_backend()
+    if backend == "stft":
+        n_fft = n_fft_for(HOP_LENGTH)
+        if S is None:
+            S = np.abs(librosa.stft(np.asarray(y), n_fft=n_fft, hop_length=HOP_LENGTH))
+        return chroma_from_stft(librosa.decompose.hpss(S)[0], sr, n_fft)
+    y_harmonic = librosa.effects.harmonic(np.asarray(y))
+    return chromagram(y_harmonic, sr, HOP_LENGTH, backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate musical key(s) of audio files")
+    parser.add_argument("audio_files", nargs="+", help="Audio files")
+    parser.add_argument("--windowed", action="store_true", help="Report key changes over time")
+    parser.add_argument("--window", type=int, default=32, help="Window length in beats")
+    parser.add_argument("--chroma", choices=["cqt", "stft"],
+                        help="Chroma backend (default: $MUSICMAN_CHROMA or cqt)")
+    args = parser.parse_args()
+
+    import librosa
+
+    from audio_cache import load_audio
+    from tempo import track_beats
+
+    for path in args.audio_files:
+        y, sr = load_audio(path, sr=22050)
+        chroma = harmonic_chroma(y, sr, args.chroma)
+        key, mode, conf = estimate_key(chroma)
+        print(f"{path}\t{key} {mode}\t{conf:.2f}")
+        if args.windowed:
+            beats = track_beats(path, y=y, sr=sr).beat_frames(sr)
+            synced = librosa.util.sync(chroma, beats, aggregate=np.mean, pad=True)
+            starts = np.concatenate([[0], beats[beats > 0]])[:synced.shape[1]]
+            times = librosa.frames_to_time(starts, sr=sr)
+            for seg in windowed_keys(synced, times, window=args.window, end_time=len(y) / sr):
+                print(f"  {seg['start']:7.1f}s - {seg['end']:7.1f}s  {seg['key']} {seg['mode']}"
+                      f"  ({seg['confidence']:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Shortest Strudel mini-notation for binary step patterns, by table lookup.
+
+Every 8- and 16-step pattern is searched once, offline, over the forms
+mini-notation offers for a single cycle:
+
+    x ~                 steps and rests (a slot's hit sounds at its start)
+    [a b]               bracket subdivision of one slot
+    a*n                 n repeats inside one slot
+    x(k,n) x(k,n,r)     Euclidean rhythms and their rotations (left, as in Tidal)
+
+and the shortest rendering of each is stored with "x" standing in for the
+sound. Patterns longer than a bar are split into 16-step bars and joined
+with <> alternation, one bar per cycle. The tables are an offset array plus
+one byte blob per length, cached under MUSICMAN_CACHE_DIR, so a lookup is
+one index computation and one slice.
+
+Only the standard library is used (audio_cache imports nothing else up
+front): the host side of audio_to_strudel runs without numpy.
+
+Usage:
+    from mini_notation import pattern_to_mini
+    pattern_to_mini([0,0,0,0,1,0,0,0,0,0,0,0,1,0,0,0], "sd")   # "[~ sd]*2"
+
+    python mini_notation.py build        # prebuild the tables
+    python mini_notation.py 1000100010001010 --sound bd
+"""
+
+import argparse
+from array import array
+from functools import lru_cache
+from math import gcd
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple
+
+from audio_cache import cache_root, write_atomic
+
+TABLE_STEPS = (8, 16)
+BAR_STEPS = 16
+TABLE_VERSION = 1
+PLACEHOLDER = "x"
+SOUND_CHARS = 2  # Rank candidates as if the sound name were this long (bd, sd, hh)
+
+Pattern = Tuple[int, ...]
+Candidate = Tuple[int, str, bool]  # (cost, template, is a bare sequence)
+
+
+def bjorklund(hits: int, steps: int) -> Pattern:
+    """Euclidean rhythm as Strudel/Tidal lay it out, e.g. (3,8) -> x..x..x."""
+    a: List[List[int]] = [[1]] * hits
+    b: List[List[int]] = [[0]] * (steps - hits)
+    while len(b) > 1:
+        m = min(len(a), len(b))
+        a, b = [a[i] + b[i] for i in range(m)], (a[m:] if len(a) > m else b[m:])
+    return tuple(v for group in a + b for v in group)
+
+
+@lru_cache(maxsize=None)
+def euclid_forms(steps: int) -> Dict[Pattern, str]:
+    """Every rotated Euclidean pattern over `steps`, mapped to its template."""
+    forms: Dict[Pattern, str] = {}
+    for hits in range(2, steps):
+        base = bjorklund(hits, steps)
+        for rotation in range(steps):
+            pattern = base[rotation:] + base[:rotation]
+            args = f"{hits},{steps}" + (f",{rotation}" if rotation else "")
+            forms.setdefault(pattern, f"{PLACEHOLDER}({args})")
+    return forms
+
+
+def _cost(template: str) -> int:
+    return len(template) + template.count(PLACEHOLDER) * (SOUND_CHARS - 1)
+
+
+def _reduce(pattern: Pattern) -> Pattern:
+    """The pattern on its coarsest grid: x ~ ~ ~ x ~ ~ ~ plays the same as x x."""
+    step = len(pattern)
+    for i, v in enumerate(pattern):
+        if v:
+            step = gcd(step, i)
+    return pattern[::step] if step else pattern
+
+
+def _divisors(n: int) -> List[int]:
+    return [d for d in range(2, n + 1) if n % d == 0]
+
+
+def _wrap(candidate: Candidate) -> str:
+    return f"[{candidate[1]}]" if candidate[2] else candidate[1]
+
+
+@lru_cache(maxsize=None)
+def best_template(pattern: Pattern) -> Candidate:
+    """Shortest mini-notation for one cycle of `pattern` (exhaustive, memoised)."""
+    pattern = _reduce(tuple(pattern))
+    n = len(pattern)
+    if not any(pattern):
+        return 1, "~", False
+    if n == 1:
+        return _cost(PLACEHOLDER), PLACEHOLDER, False
+
+    candidates: List[Candidate] = []
+    euclid = euclid_forms(n).get(pattern)
+    if euclid:
+        candidates.append((_cost(euclid), euclid, False))
+    for k in _divisors(n):
+        size = n // k
+        if pattern[:size] * k == pattern:
+            t = f"{_wrap(best_template(pattern[:size]))}*{k}"
+            candidates.append((_cost(t), t, False))
+        t = " ".join(_wrap(best_template(pattern[i * size:(i + 1) * size])) for i in range(k))
+        candidates.append((_cost(t), t, True))
+    return min(candidates)
+
+
+def _is_sequence(template: str) -> bool:
+    """True when a template has more than one element at its top level."""
+    depth = 0
+    for c in template:
+        depth += (c in "[(") - (c in "])")
+        if c == " " and depth == 0:
+            return True
+    return False
+
+
+def pattern_index(pattern: Sequence[int]) -> int:
+    """Table row of a pattern: step i is bit i."""
+    index = 0
+    for i, v in enumerate(pattern):
+        if v:
+            index |= 1 << i
+    return index
+
+
+def table_dir() -> Path:
+    return cache_root() / "mini"
+
+
+def table_path(steps: int) -> Path:
+    return table_dir() / f"mini{steps}_v{TABLE_VERSION}.bin"
+
+
+def build_table(steps: int) -> Tuple[array, bytes]:
+    """(offsets, blob): template i is blob[offsets[i]:offsets[i + 1]]."""
+    offsets = array("I", [0])
+    chunks = []
+    for index in range(1 << steps):
+        pattern = tuple((index >> i) & 1 for i in range(steps))
+        template = best_template(pattern)[1].encode() if index else b""
+        chunks.append(template)
+        offsets.append(offsets[-1] + len(template))
+    best_template.cache_clear()
+    return offsets, b"".join(chunks)
+
+
+def write_table(steps: int) -> Path:
+    offsets, blob = build_table(steps)
+    path = table_path(steps)
+    write_atomic(path, lambda f: f.write(offsets.tobytes() + blob))
+    return path
+
+
+@lru_cache(maxsize=None)
+def load_table(steps: int) -> Tuple[array, bytes]:
+    """Offsets and blob for `steps`, building and caching them on first use."""
+    path = table_path(steps)
+    n = (1 << steps) + 1
+    try:
+        data = path.read_bytes()
+    except OSError:
+        try:
+            data = write_table(steps).read_bytes()
+        except OSError:
+            return build_table(steps)
+    offsets = array("I")
+    offsets.frombytes(data[:n * offsets.itemsize])
+    return offsets, data[n * offsets.itemsize:]
+
+
+def cycle_template(pattern: Sequence[int]) -> str:
+    """Template for one cycle; "" when the pattern is silent."""
+    if not any(pattern):
+        return ""
+    steps = len(pattern)
+    if steps in TABLE_STEPS:
+        offsets, blob = load_table(steps)
+        i = pattern_index(pattern)
+        return blob[offsets[i]:offsets[i + 1]].decode()
+    return best_template(tuple(1 if v else 0 for v in pattern))[1]
+
+
+def mini_template(pattern: Sequence[int]) -> str:
+    """Template for a pattern of any length; whole bars past 16 steps alternate with <>."""
+    steps = len(pattern)
+    if steps <= BAR_STEPS or steps % BAR_STEPS:
+        return cycle_template(pattern)
+    bars = [cycle_template(pattern[i:i + BAR_STEPS]) or "~" for i in range(0, steps, BAR_STEPS)]
+    if not any(b != "~" for b in bars):
+        return ""
+    if all(b == bars[0] for b in bars):
+        return bars[0]
+    return "<" + " ".join(f"[{b}]" if _is_sequence(b) else b for b in bars) + ">"
+
+
+def pattern_to_mini(pattern: Sequence[int], sound: str) -> str:
+    """Binary step pattern as Strudel mini-notation for `sound`."""
+    return mini_template(pattern).replace(PLACEHOLDER, sound)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shortest mini-notation for step patterns")
+    parser.add_argument("pattern", help="'build' to prebuild the tables, or a pattern like 1000100010001010")
+    parser.add_argument("--sound", default="bd", help="Sound name to render with")
+    args = parser.parse_args()
+
+    if args.pattern == "build":
+        for steps in TABLE_STEPS:
+            print(f"{steps} steps: {write_table(steps)}")
+        return
+    print(pattern_to_mini([int(c) for c in args.pattern], args.sound))
+
+
+if __name__ == "__main__":
+    main()
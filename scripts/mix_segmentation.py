@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Track boundaries in DJ mixes from tempo, key and timbre novelty.
+
+A mix is one file holding many tracks, so a single BPM and key describes
+none of them. This module finds where one track hands over to the next
+using only cheap, low-resolution features, read block-wise so memory stays
+flat for mixes of any length (see streaming.py):
+
+    tempo    autocorrelation tempogram of the onset envelope (lags up to 3 s)
+    key      STFT chroma, scored against the 24 key profiles
+    timbre   MFCCs (without c0, so level changes alone do not count)
+
+All three come from one STFT per block at SEGMENT_SR and are mean-pooled to
+one column per second. Each feature gets a novelty curve comparing the
+NOVELTY_SECONDS before every column with the NOVELTY_SECONDS after it (all
+window means from one cumulative sum); the curves are scaled to comparable
+ranges and summed, and the strongest peaks at least min_track seconds apart
+become boundaries. Beatmatched transitions keep the tempo curve flat, but
+the key and timbre curves still move.
+
+Usage:
+    from mix_segmentation import segment_mix
+    segments = segment_mix("mix.flac")                  # [Segment(start, end, score), ...]
+    segments = segment_mix("mix.flac", tracks=12)       # exactly 12 tracks
+
+    python mix_segmentation.py mix.flac [--tracks 12] [--min-track 90]
+"""
+
+import argparse
+import json
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import key_detection
+from streaming import file_duration, stream_features
+
+SEGMENT_SR = 11025
+SEGMENT_HOP = 512
+SEGMENT_N_FFT = 2048
+COLUMN_SECONDS = 1.0    # target column length; the real one is a whole number of hops
+TEMPO_WIN = 192         # tempogram window in envelope frames (~8.9 s)
+TEMPO_LAGS = 64         # keep lags up to ~3 s (20 BPM and up)
+N_MFCC = 13
+CONTEXT_SECONDS = 5.0   # > half the tempogram window
+NOVELTY_SECONDS = 32.0
+MIN_TRACK_SECONDS = 60.0
+PEAK_THRESHOLD = 1.0    # boundaries must exceed the mean novelty by this many std devs
+NOVELTY_WEIGHTS = {"tempo": 1.0, "key": 1.0, "timbre": 1.0}
+
+# Row ranges of each feature in the stacked block output
+_ROWS = {"tempo": slice(0, TEMPO_LAGS), "chroma": slice(TEMPO_LAGS, TEMPO_LAGS + 12),
+         "mfcc": slice(TEMPO_LAGS + 12, TEMPO_LAGS + 12 + N_MFCC - 1)}
+
+
+@dataclass
+class Segment:
+    start: float      # seconds
+    end: float
+    score: float      # novelty at the start boundary (0 for the first segment)
+
+
+def _block_features(y: np.ndarray, sr: int) -> np.ndarray:
+    """Tempogram, chroma and MFCC rows of one block, all from one STFT."""
+    import librosa
+
+    S = np.abs(librosa.stft(y, n_fft=SEGMENT_N_FFT, hop_length=SEGMENT_HOP)) ** 2
+    log_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=S, sr=sr, n_mels=64))
+    env = librosa.onset.onset_strength(S=log_mel, sr=sr, hop_length=SEGMENT_HOP)
+    tg = librosa.feature.tempogram(onset_envelope=env, sr=sr, hop_length=SEGMENT_HOP,
+                                   win_length=TEMPO_WIN)[:TEMPO_LAGS]
+    chroma = librosa.feature.chroma_stft(S=S, sr=sr, n_fft=SEGMENT_N_FFT)
+    mfcc = librosa.feature.mfcc(S=log_mel, n_mfcc=N_MFCC)[1:]
+    return np.vstack([tg, chroma, mfcc])
+
+
+def mix_features(path) -> Dict[str, np.ndarray]:
+    """Per-second tempo, chroma and timbre columns of a file, read block-wise.
+
+    Returns {"tempo": (lags, cols), "chroma": (12, cols), "mfcc": (12, cols),
+    "duration": seconds, "column_seconds": the exact length of a column}.
+    """
+    pool = max(1, int(round(COLUMN_SECONDS * SEGMENT_SR / SEGMENT_HOP)))
+    frames, duration = stream_features(path, {"mix": _block_features}, sr=SEGMENT_SR,
+                                       hop_length=SEGMENT_HOP, pool={"mix": pool},
+                                       context_seconds=CONTEXT_SECONDS)
+    X = frames["mix"]
+    features = {name: X[rows] for name, rows in _ROWS.items()}
+    features["duration"] = duration
+    features["column_seconds"] = pool * SEGMENT_HOP / SEGMENT_SR
+    return features
+
+
+def _window_means(X: np.ndarray, width: int):
+    """Mean of the `width` columns before and after every column (clipped at the ends)."""
+    n = X.shape[1]
+    cs = np.concatenate([np.zeros((X.shape[0], 1)), np.cumsum(X, axis=1)], axis=1)
+    t = np.arange(n)
+    lo, hi = np.maximum(t - width, 0), np.minimum(t + width, n)
+    left = (cs[:, t] - cs[:, lo]) / np.maximum(t - lo, 1)
+    right = (cs[:, hi] - cs[:, t]) / np.maximum(hi - t, 1)
+    return left, right
+
+
+def _unit_columns(X: np.ndarray) -> np.ndarray:
+    X = X - X.mean(axis=0, keepdims=True)
+    return X / np.maximum(np.linalg.norm(X, axis=0, keepdims=True), 1e-9)
+
+
+def novelty_curves(features: Dict[str, np.ndarray], width: int) -> Dict[str, np.ndarray]:
+    """Tempo, key and timbre novelty per column (before-window vs after-window)."""
+    left, right = _window_means(features["tempo"], width)
+    tempo = 1.0 - np.sum(_unit_columns(left) * _unit_columns(right), axis=0)
+
+    left, right = _window_means(features["chroma"], width)
+    key = 1.0 - np.sum(_unit_columns(key_detection.key_scores(left)) *
+                       _unit_columns(key_detection.key_scores(right)), axis=0)
+
+    mfcc = features["mfcc"]
+    z = (mfcc - mfcc.mean(axis=1, keepdims=True)) / np.maximum(mfcc.std(axis=1, keepdims=True), 1e-9)
+    left, right = _window_means(z, width)
+    timbre = np.linalg.norm(left - right, axis=0)
+    return {"tempo": tempo, "key": key, "timbre": timbre}
+
+
+def combined_novelty(curves: Dict[str, np.ndarray]) -> np.ndarray:
+    """Weighted sum of the curves, each scaled by its 95th percentile."""
+    total = 0.0
+    for name, curve in curves.items():
+        scale = np.percentile(curve, 95) if len(curve) else 0.0
+        total = total + NOVELTY_WEIGHTS[name] * curve / max(scale, 1e-9)
+    return np.asarray(total, dtype=float)
+
+
+def pick_boundaries(novelty: np.ndarray, min_gap: int, count: Optional[int] = None,
+                    threshold: float = PEAK_THRESHOLD) -> List[int]:
+    """Columns of the strongest novelty peaks, at least min_gap apart and from the ends.
+
+    With count, the count best peaks are taken whatever their height;
+    otherwise every peak `threshold` std devs above the mean qualifies.
+    """
+    n = len(novelty)
+    if n == 0:
+        return []
+    peaks = np.flatnonzero((novelty >= np.roll(novelty, 1)) & (novelty >= np.roll(novelty, -1)))
+    peaks = peaks[(peaks >= min_gap) & (peaks <= n - min_gap)]
+    if count is None:
+        peaks = peaks[novelty[peaks] > novelty.mean() + threshold * novelty.std()]
+    chosen: List[int] = []
+    for p in peaks[np.argsort(-novelty[peaks], kind="stable")]:
+        if count is not None and len(chosen) >= count:
+            break
+        if all(abs(int(p) - c) >= min_gap for c in chosen):
+            chosen.append(int(p))
+    return sorted(chosen)
+
+
+def segment_mix(path, tracks: Optional[int] = None,
+                min_track: float = MIN_TRACK_SECONDS) -> List[Segment]:
+    """Split a mix into tracks. tracks fixes the count; by default it is inferred."""
+    if file_duration(path) is None:
+        raise RuntimeError(f"Cannot read {path} block-wise; convert it to WAV or FLAC first")
+    features = mix_features(path)
+    duration = features["duration"]
+    n_cols = features["tempo"].shape[1]
+    if n_cols == 0:
+        return []
+    column_seconds = features["column_seconds"]
+    width = max(1, int(round(NOVELTY_SECONDS / column_seconds)))
+    novelty = combined_novelty(novelty_curves(features, width))
+    min_gap = max(1, int(round(min_track / column_seconds)))
+    cols = pick_boundaries(novelty, min_gap, None if tracks is None else max(tracks - 1, 0))
+
+    edges = [0.0] + [c * column_seconds for c in cols] + [duration]
+    scores = [0.0] + [float(novelty[c]) for c in cols]
+    return [Segment(start=round(a, 2), end=round(b, 2), score=round(s, 3))
+            for a, b, s in zip(edges[:-1], edges[1:], scores)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find track boundaries in a DJ mix")
+    parser.add_argument("audio_file", help="Mix to segment (any format soundfile reads)")
+    parser.add_argument("--tracks", type=int, help="Number of tracks, if known")
+    parser.add_argument("--min-track", type=float, default=MIN_TRACK_SECONDS,
+                        help="Shortest track in seconds")
+    args = parser.parse_args()
+
+    segments = segment_mix(args.audio_file, args.tracks, args.min_track)
+    print(json.dumps([asdict(s) for s in segments], indent=2))
+
+
+if __name__ == "__main__":
+    main()
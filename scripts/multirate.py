@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Multirate analysis: run each stem analysis at the lowest rate its band needs.
+
+The stems are decoded once at REFERENCE_SR. Each analysis then receives a
+copy decimated by the largest power of two whose Nyquist frequency still
+covers the band it looks at. FFT sizes and hops shrink by the same factor,
+so frequency resolution (Hz per bin) and frame timing are unchanged while
+every spectrogram has that many times fewer bins to compute and store.
+
+Usage:
+    from multirate import to_band_rate, frame_params
+    y_bass, sr_bass = to_band_rate(y, 22050, "bass")     # ~2.8 kHz
+    n_fft, hop = frame_params(sr_bass)                   # 256, 64
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+REFERENCE_SR = 22050
+REFERENCE_N_FFT = 2048
+REFERENCE_HOP = 512
+MAX_FACTOR = 16
+
+# Nyquist frequency each analysis needs, with room for the decimation
+# filter's transition band. None means the full reference band.
+BAND_NYQUIST = {
+    "bass": 1000.0,     # piptrack searches 30-500 Hz
+    "chords": 4800.0,   # chroma_cqt tops out at B7 (3951 Hz)
+    "drums": None,      # the hi-hat band (beat_features.DRUM_BANDS) reaches 16 kHz
+}
+
+
+def decimation_factor(nyquist: Optional[float], sr: float = REFERENCE_SR) -> int:
+    """Largest power-of-two factor that keeps sr / (2 * factor) >= nyquist."""
+    if not nyquist:
+        return 1
+    factor = 1
+    while factor < MAX_FACTOR and sr / (4 * factor) >= nyquist:
+        factor *= 2
+    return factor
+
+
+def band_rate(name: str, sr: float = REFERENCE_SR) -> float:
+    """Analysis sample rate for a band in BAND_NYQUIST."""
+    return sr / decimation_factor(BAND_NYQUIST.get(name), sr)
+
+
+def frame_params(sr: float) -> Tuple[int, int]:
+    """(n_fft, hop_length) at sr with the reference resolution in Hz and seconds."""
+    scale = sr / REFERENCE_SR
+    return max(16, int(round(REFERENCE_N_FFT * scale))), max(1, int(round(REFERENCE_HOP * scale)))
+
+
+def decimate(y: np.ndarray, factor: int) -> np.ndarray:
+    """Low-pass and downsample y by an integer factor (polyphase FIR)."""
+    if factor == 1:
+        return np.asarray(y)
+    from scipy.signal import resample_poly
+
+    return resample_poly(np.asarray(y, dtype=np.float32), 1, factor).astype(np.float32)
+
+
+def to_band_rate(y: np.ndarray, sr: float, name: str) -> Tuple[np.ndarray, float]:
+    """y resampled for the named band's analysis, and its new rate."""
+    factor = decimation_factor(BAND_NYQUIST.get(name), sr)
+    return decimate(y, factor), sr / factor
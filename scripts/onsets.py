@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Vectorized multi-band onset picking.
+
+Takes a (bands x frames) energy matrix, normalises each band to its peak,
+and returns the frames that are strict local maxima above a per-band
+threshold and at least ``min_gap`` frames after the previous accepted onset
+in that band. This is the same rule the drum analysis used to apply one
+frame at a time in Python, done for every band in one pass.
+sweep_band_onsets does the same for a whole grid of thresholds at once
+(see drum_sweep.py).
+
+Usage:
+    from onsets import band_energies, pick_band_onsets
+    E = band_energies(S, freqs, [(30, 120), (200, 400), (6000, 16000)])
+    kick, snare, hihat = pick_band_onsets(E, thresholds=[0.4, 0.5, 0.3], min_gap=2)
+"""
+
+from typing import List, Sequence, Tuple, Union
+
+import numpy as np
+
+Thresholds = Union[float, Sequence[float], np.ndarray]
+
+
+def band_matrix(freqs: np.ndarray, bands: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """(bands x freqs) 0/1 matrix selecting each inclusive [low, high] Hz band."""
+    freqs = np.asarray(freqs)
+    lows = np.array([b[0] for b in bands], dtype=float)[:, None]
+    highs = np.array([b[1] for b in bands], dtype=float)[:, None]
+    return ((freqs[None, :] >= lows) & (freqs[None, :] <= highs)).astype(np.float32)
+
+
+def band_energies(S: np.ndarray, freqs: np.ndarray, bands: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Summed magnitude per band and frame, as one matrix product."""
+    return band_matrix(freqs, bands) @ S
+
+
+def _normalize(energy: np.ndarray) -> np.ndarray:
+    peak = energy.max(axis=-1, keepdims=True)
+    return np.divide(energy, peak, out=np.array(energy, dtype=np.float32, copy=True), where=peak > 0)
+
+
+def _enforce_min_gap(bands: np.ndarray, frames: np.ndarray, min_gap: int) -> np.ndarray:
+    """Mask of candidates kept by greedy left-to-right min-gap suppression.
+
+    Candidates (sorted by band, then frame) that are at least min_gap after
+    their predecessor are always kept; only the rare runs of close candidates
+    need the sequential rule, and those are resolved run by run.
+    """
+    keep = np.ones(len(frames), dtype=bool)
+    if min_gap <= 1 or len(frames) < 2:
+        return keep
+
+    close = (np.diff(frames) < min_gap) & (bands[1:] == bands[:-1])
+    if not close.any():
+        return keep
+
+    # Each run of close candidates starts one before the first close diff.
+    idx = np.flatnonzero(close) + 1
+    run_starts = idx[np.r_[True, np.diff(idx) > 1]] - 1
+    run_ends = idx[np.r_[np.diff(idx) > 1, True]] + 1
+    for start, end in zip(run_starts, run_ends):
+        last = frames[start]
+        for i in range(start + 1, end):
+            if frames[i] - last >= min_gap:
+                last = frames[i]
+            else:
+                keep[i] = False
+    return keep
+
+
+def pick_band_onsets(energy: np.ndarray, thresholds: Thresholds = 0.3,
+                     min_gap: int = 1) -> List[np.ndarray]:
+    """Onset frame indices for each row of a (bands x frames) energy matrix."""
+    energy = np.atleast_2d(np.asarray(energy, dtype=np.float32))
+    n_bands = energy.shape[0]
+    thr = np.broadcast_to(np.asarray(thresholds, dtype=np.float32), (n_bands,))
+    if energy.shape[1] < 3:
+        return [np.array([], dtype=int) for _ in range(n_bands)]
+
+    e = _normalize(energy)
+    mid = e[:, 1:-1]
+    peaks = (mid > thr[:, None]) & (mid > e[:, :-2]) & (mid > e[:, 2:])
+    bands, frames = np.nonzero(peaks)
+    frames = frames + 1
+    keep = _enforce_min_gap(bands, frames, min_gap)
+    bands, frames = bands[keep], frames[keep]
+
+    splits = np.searchsorted(bands, np.arange(1, n_bands))
+    return np.split(frames, splits)
+
+
+def sweep_band_onsets(energy: np.ndarray, thresholds: Sequence[float],
+                      min_gap: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """pick_band_onsets for every row of energy at every threshold, in one pass.
+
+    Returns (pairs, frames) sorted by pair, then frame: pair is
+    row * len(thresholds) + threshold index. The peak test runs once per
+    row; each threshold only filters its candidates.
+    """
+    energy = np.atleast_2d(np.asarray(energy, dtype=np.float32))
+    thr = np.asarray(thresholds, dtype=np.float32)
+    if energy.shape[1] < 3:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    e = _normalize(energy)
+    mid = e[:, 1:-1]
+    rows, frames = np.nonzero((mid > e[:, :-2]) & (mid > e[:, 2:]))
+    values = mid[rows, frames]
+    cand, t_idx = np.nonzero(values[:, None] > thr[None, :])
+    pairs = rows[cand] * len(thr) + t_idx
+    frames = frames[cand] + 1
+    order = np.lexsort((frames, pairs))
+    pairs, frames = pairs[order], frames[order]
+    keep = _enforce_min_gap(pairs, frames, min_gap)
+    return pairs[keep], frames[keep]
+
+
+def pick_band_onsets_batch(energies: Sequence[np.ndarray], thresholds: Thresholds = 0.3,
+                           min_gap: int = 1) -> List[List[np.ndarray]]:
+    """pick_band_onsets for many tracks at once.
+
+    Tracks are zero-padded to a common length and stacked into one
+    (tracks x bands x frames) array, so the peak test is a single pass.
+    """
+    if not energies:
+        return []
+    n_bands = np.atleast_2d(energies[0]).shape[0]
+    lengths = [np.atleast_2d(e).shape[1] for e in energies]
+    stacked = np.zeros((len(energies), n_bands, max(max(lengths), 3)), dtype=np.float32)
+    for i, e in enumerate(energies):
+        stacked[i, :, :lengths[i]] = np.atleast_2d(e)
+
+    thr = np.broadcast_to(np.asarray(thresholds, dtype=np.float32), (n_bands,))
+    e = _normalize(stacked)
+    mid = e[:, :, 1:-1]
+    peaks = (mid > thr[None, :, None]) & (mid > e[:, :, :-2]) & (mid > e[:, :, 2:])
+    # The last real frame of a padded track has no right neighbour in the original.
+    for i, n in enumerate(lengths):
+        peaks[i, :, max(n - 2, 0):] = False
+
+    tracks, bands, frames = np.nonzero(peaks)
+    frames = frames + 1
+    rows = tracks * n_bands + bands
+    keep = _enforce_min_gap(rows, frames, min_gap)
+    rows, frames = rows[keep], frames[keep]
+
+    per_row = np.split(frames, np.searchsorted(rows, np.arange(1, len(energies) * n_bands)))
+    return [per_row[i * n_bands:(i + 1) * n_bands] for i in range(len(energies))]
+
+
+def quantize_onsets(onset_times: np.ndarray, step_duration: float, steps: int = 16,
+                    max_time: float = None) -> List[int]:
+    """Binary step pattern from onset times (onsets at or after max_time are ignored)."""
+    t = np.asarray(onset_times, dtype=float)
+    if max_time is not None:
+        t = t[t < max_time]
+    pattern = np.zeros(steps, dtype=int)
+    pattern[np.rint(t / step_duration).astype(int) % steps] = 1
+    return pattern.tolist()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Melody statistics: fast vectorized YIN, or full-range pyin for accuracy.
+
+The analysis only keeps register, range and activity from the pitch track,
+so the fast mode trades per-frame precision for speed:
+
+- the signal is resampled to FAST_SR (enough for fundamentals up to C7),
+- frames are taken with a coarse hop, and quiet frames are gated out
+  before any pitch work,
+- YIN's difference function is computed for all frames at once with FFTs,
+- the track is processed in blocks and stops early once the statistics
+  have stopped moving.
+
+Usage:
+    from pitch_tracking import melody_stats
+    stats = melody_stats(y_harmonic, sr, mode="fast")   # or mode="accurate"
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+FMIN_HZ = 65.406    # C2
+FMAX_HZ = 2093.005  # C7
+FAST_SR = 8000
+
+DEFAULT_STATS = {
+    "register": "mid",
+    "range": 12,
+    "low_midi": 48,
+    "high_midi": 60,
+    "activity": 0.5
+}
+
+
+def hz_to_midi(f0: np.ndarray) -> np.ndarray:
+    return 12 * (np.log2(np.asarray(f0, dtype=float)) - np.log2(440.0)) + 69
+
+
+def register_name(avg_note: int) -> str:
+    if avg_note < 48:  # Below C3
+        return "bass"
+    if avg_note < 60:  # Below C4
+        return "low"
+    if avg_note < 72:  # Below C5
+        return "mid"
+    return "high"
+
+
+def summarize(midi_notes: np.ndarray, n_frames: int) -> Optional[Dict]:
+    """Register/range/activity summary, as analyze_melody has always reported it."""
+    midi_notes = midi_notes[~np.isnan(midi_notes)]
+    if len(midi_notes) == 0:
+        return None
+    low_note = int(np.min(midi_notes))
+    high_note = int(np.max(midi_notes))
+    return {
+        "register": register_name(int(np.mean(midi_notes))),
+        "range": high_note - low_note,
+        "low_midi": low_note,
+        "high_midi": high_note,
+        "activity": round(len(midi_notes) / (n_frames + 1), 2)
+    }
+
+
+def yin_frames(frames: np.ndarray, sr: int, fmin: float = FMIN_HZ, fmax: float = FMAX_HZ,
+               threshold: float = 0.15) -> Tuple[np.ndarray, np.ndarray]:
+    """YIN f0 for every row of a (n_frames x frame_length) array.
+
+    Returns (f0 in Hz, voiced mask). The difference function comes from one
+    batched FFT autocorrelation plus cumulative energy sums.
+    """
+    n, length = frames.shape
+    tau_min = max(1, int(np.floor(sr / fmax)))
+    tau_max = min(int(np.ceil(sr / fmin)), length // 2)
+    window = length - tau_max
+    if n == 0 or window <= 0:
+        return np.zeros(n), np.zeros(n, dtype=bool)
+
+    n_fft = 1 << int(np.ceil(np.log2(length + window)))
+    spec = np.fft.rfft(frames, n=n_fft, axis=1)
+    head = np.fft.rfft(frames[:, :window], n=n_fft, axis=1)
+    acf = np.fft.irfft(spec * np.conj(head), n=n_fft, axis=1)[:, :tau_max + 1]
+
+    energy = np.concatenate([np.zeros((n, 1)), np.cumsum(frames ** 2, axis=1)], axis=1)
+    taus = np.arange(tau_max + 1)
+    e_lag = energy[:, taus + window] - energy[:, taus]
+    diff = np.maximum(e_lag[:, :1] + e_lag - 2 * acf, 0.0)
+
+    # Cumulative mean normalised difference
+    cum = np.cumsum(diff[:, 1:], axis=1)
+    cmnd = np.ones_like(diff)
+    cmnd[:, 1:] = diff[:, 1:] * taus[1:] / np.maximum(cum, 1e-12)
+
+    # First trough under the threshold within [tau_min, tau_max)
+    c = cmnd[:, tau_min:tau_max]
+    trough = (c[:, 1:-1] < threshold) & (c[:, 1:-1] <= c[:, 2:]) & (c[:, 1:-1] < c[:, :-2])
+    voiced = trough.any(axis=1)
+    first = np.argmax(trough, axis=1) + 1
+
+    # Parabolic interpolation around the trough
+    rows = np.arange(n)
+    left, mid, right = c[rows, first - 1], c[rows, first], c[rows, np.minimum(first + 1, c.shape[1] - 1)]
+    denom = left - 2 * mid + right
+    shift = np.where(np.abs(denom) > 1e-12, 0.5 * (left - right) / np.where(denom == 0, 1, denom), 0.0)
+    period = tau_min + first + np.clip(shift, -1, 1)
+    f0 = np.where(voiced, sr / period, np.nan)
+    return f0, voiced
+
+
+def continuous(frame_idx: np.ndarray, midi: np.ndarray, tolerance: float = 1.0) -> np.ndarray:
+    """Mask of voiced frames whose pitch carries on from an adjacent frame.
+
+    Stands in for pyin's HMM smoothing: isolated octave and subharmonic
+    slips at note edges are dropped so they cannot set the range.
+    """
+    linked = (np.diff(frame_idx) == 1) & (np.abs(np.diff(midi)) <= tolerance)
+    keep = np.zeros(len(midi), dtype=bool)
+    keep[:-1] |= linked
+    keep[1:] |= linked
+    return keep
+
+
+def fast_melody_stats(y: np.ndarray, sr: int, hop_seconds: float = 0.04,
+                      frame_seconds: float = 0.064, gate_db: float = -40.0,
+                      block_seconds: float = 8.0, min_seconds: float = 16.0,
+                      patience: int = 2) -> Dict:
+    """Melody statistics from a decimated, strided, gated YIN pass with early stopping."""
+    import librosa
+
+    y = np.asarray(y, dtype=np.float32)
+    if sr != FAST_SR:
+        y = librosa.resample(y, orig_sr=sr, target_sr=FAST_SR, res_type="soxr_qq")
+    frame_length = int(frame_seconds * FAST_SR)
+    hop = int(hop_seconds * FAST_SR)
+    if len(y) < frame_length:
+        return dict(DEFAULT_STATS, mode="fast", analyzed_seconds=0.0)
+
+    frames = np.lib.stride_tricks.sliding_window_view(y, frame_length)[::hop]
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    loud = rms > (rms.max() * 10 ** (gate_db / 20) if rms.max() > 0 else np.inf)
+
+    block = max(1, int(block_seconds / hop_seconds))
+    midi = []
+    history = []
+    n_seen = 0
+    for start in range(0, len(frames), block):
+        idx = start + np.flatnonzero(loud[start:start + block])
+        n_seen = min(start + block, len(frames))
+        if len(idx):
+            f0, voiced = yin_frames(frames[idx].astype(np.float64), FAST_SR)
+            notes = hz_to_midi(f0[voiced])
+            midi.append(notes[continuous(idx[voiced], notes)])
+        stats = summarize(np.concatenate(midi) if midi else np.array([]), n_seen)
+        history.append(stats)
+        if n_seen * hop_seconds >= min_seconds and len(history) > patience and _converged(history, patience):
+            break
+
+    stats = history[-1] if history else None
+    result = dict(stats if stats else DEFAULT_STATS)
+    result.update(mode="fast", analyzed_seconds=round(n_seen * hop_seconds, 1))
+    return result
+
+
+def _converged(history, patience: int) -> bool:
+    """True when the last `patience` blocks moved no statistic meaningfully."""
+    recent = history[-(patience + 1):]
+    if any(s is None for s in recent):
+        return False
+    last = recent[-1]
+    return all(s["register"] == last["register"]
+               and abs(s["low_midi"] - last["low_midi"]) <= 1
+               and abs(s["high_midi"] - last["high_midi"]) <= 1
+               and abs(s["activity"] - last["activity"]) <= 0.03
+               for s in recent[:-1])
+
+
+def accurate_melody_stats(y: np.ndarray, sr: int) -> Dict:
+    """Full C2-C7 pyin over the whole signal."""
+    import librosa
+
+    f0, voiced_flag, _ = librosa.pyin(
+        np.asarray(y),
+        fmin=FMIN_HZ,
+        fmax=FMAX_HZ,
+        sr=sr
+    )
+    stats = summarize(librosa.hz_to_midi(f0[voiced_flag]), len(f0))
+    result = dict(stats if stats else DEFAULT_STATS)
+    result.update(mode="accurate", analyzed_seconds=round(len(y) / sr, 1))
+    return result
+
+
+def melody_stats(y: np.ndarray, sr: int, mode: str = "fast") -> Dict:
+    """Register, range and activity of the melodic content of y."""
+    if mode == "accurate":
+        return accurate_melody_stats(y, sr)
+    if mode == "fast":
+        return fast_melody_stats(y, sr)
+    raise ValueError(f"unknown melody mode {mode!r} (use 'fast' or 'accurate')")
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+In-process Demucs source separation with a content-addressed stem store.
+
+The htdemucs model is loaded once per process and reused for every track in
+a queue, instead of paying model load and interpreter start-up per file via
+the demucs CLI. Stems are written under
+
+    $MUSICMAN_CACHE_DIR/stems/<audio hash>/<model>-<settings hash>/<stem>.wav
+
+so the same audio is never separated twice with the same settings, no matter
+which script asks, what the file is called, or where it lives. The store
+always holds every stem the model produces; a two-stem request (--two-stems
+drums) is answered from them, with no_drums summed once and kept alongside.
+
+On CPU-only machines a long track is split into overlapping chunks that are
+separated in parallel worker processes (each with its own resident model and
+a share of the cores) and stitched back together with crossfaded overlap-add.
+
+Usage:
+    python separation.py track1.mp3 track2.mp3 [--two-stems drums] [--threads 8]
+    python separation.py track.mp3 --chunk-seconds 60 --chunk-overlap 2 --workers 4
+    python separation.py --json track.mp3     # print {file: {stem: path}} for callers
+
+Environment:
+    MUSICMAN_SEP_CHUNK_SECONDS   Default chunk length, 0 disables chunking (default: 60)
+    MUSICMAN_SEP_CHUNK_OVERLAP   Default crossfade overlap in seconds (default: 2)
+    MUSICMAN_SEP_WORKERS         Default chunk worker processes (default: cores / 4, max 4)
+
+Requirements (ML venv):
+    pip install demucs torch torchaudio soundfile
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, replace
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from audio_cache import audio_hash, cache_root, write_atomic
+
+STORE_MANIFEST = "stems.json"
+
+
+@dataclass(frozen=True)
+class SeparationSettings:
+    """Everything that changes the stems a model produces."""
+    model: str = "htdemucs"
+    shifts: int = 1
+    overlap: float = 0.25
+    segment: Optional[float] = None
+    chunk_seconds: Optional[float] = None
+    chunk_overlap: float = 2.0
+
+    def key(self) -> str:
+        digest = hashlib.blake2b(json.dumps(asdict(self), sort_keys=True).encode(), digest_size=6)
+        return f"{self.model}-{digest.hexdigest()}"
+
+
+def default_settings(model: str = "htdemucs") -> SeparationSettings:
+    """Settings used by run_demucs callers, with chunking taken from the environment."""
+    chunk = float(os.environ.get("MUSICMAN_SEP_CHUNK_SECONDS", 60))
+    return SeparationSettings(model=model,
+                              chunk_seconds=chunk if chunk > 0 else None,
+                              chunk_overlap=float(os.environ.get("MUSICMAN_SEP_CHUNK_OVERLAP", 2.0)))
+
+
+def default_workers() -> int:
+    if "MUSICMAN_SEP_WORKERS" in os.environ:
+        return max(1, int(os.environ["MUSICMAN_SEP_WORKERS"]))
+    return max(1, min(4, default_threads() // 4))
+
+
+def stem_store_dir() -> Path:
+    return cache_root() / "stems"
+
+
+def stem_dir_for(audio_path, settings: SeparationSettings) -> Path:
+    return stem_store_dir() / audio_hash(audio_path) / settings.key()
+
+
+def two_stem_paths(stem_dir: Path, stems: Dict[str, str], two_stems: str) -> Dict[str, str]:
+    """{two_stems, no_<two_stems>} from the stored model stems.
+
+    The rest is the sum of the other stems, written once next to them.
+    """
+    if two_stems not in stems:
+        raise ValueError(f"no stem {two_stems!r} in {', '.join(stems)}")
+    rest_path = stem_dir / f"no_{two_stems}.wav"
+    if not rest_path.exists():
+        import numpy as np
+        import soundfile as sf
+
+        others = [sf.read(path, dtype="float32", always_2d=True) for name, path in stems.items()
+                  if name != two_stems]
+        rest = np.clip(sum(y for y, _ in others), -1.0, 1.0)
+        write_atomic(rest_path, lambda f: sf.write(f, rest, others[0][1], format="WAV", subtype="PCM_16"))
+    return {two_stems: stems[two_stems], f"no_{two_stems}": str(rest_path)}
+
+
+def find_stems(audio_path, settings: Optional[SeparationSettings] = None,
+               two_stems: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """Stems for audio_path already in the store, or None.
+
+    With two_stems, only that stem and the sum of the rest (no_<stem>).
+    """
+    settings = settings or default_settings()
+    stem_dir = stem_dir_for(audio_path, settings)
+    manifest = stem_dir / STORE_MANIFEST
+    if not manifest.exists():
+        return None
+    stems = {name: str(stem_dir / f"{name}.wav") for name in json.loads(manifest.read_text())["stems"]}
+    if not all(Path(p).exists() for p in stems.values()):
+        return None
+    return two_stem_paths(stem_dir, stems, two_stems) if two_stems else stems
+
+
+def default_threads() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def chunk_bounds(n_samples: int, chunk: int, overlap: int) -> List[Tuple[int, int]]:
+    """(start, end) sample ranges covering n_samples, neighbours sharing `overlap` samples."""
+    if n_samples <= chunk:
+        return [(0, n_samples)]
+    step = chunk - overlap
+    bounds = []
+    start = 0
+    while True:
+        end = min(start + chunk, n_samples)
+        bounds.append((start, end))
+        if end == n_samples:
+            return bounds
+        start += step
+
+
+def crossfade_weights(start: int, end: int, n_samples: int, overlap: int):
+    """Overlap-add window for one chunk: raised-cosine fades on interior edges only.
+
+    Complementary fades sum to one across every overlap, so the stitched
+    signal matches the chunk outputs exactly outside the crossfades.
+    """
+    import numpy as np
+
+    length = end - start
+    w = np.ones(length, dtype=np.float32)
+    fade = min(overlap, length)
+    ramp = (0.5 - 0.5 * np.cos(np.linspace(0.0, np.pi, fade, dtype=np.float32)))
+    if start > 0:
+        w[:fade] = ramp
+    if end < n_samples:
+        w[-fade:] = ramp[::-1]
+    return w
+
+
+# Chunk workers keep their own resident model across chunks and tracks.
+_chunk_service = None
+
+
+def _init_chunk_worker(model: str, threads: int) -> None:
+    global _chunk_service
+    _chunk_service = SeparationService(model, device="cpu", threads=threads)
+
+
+def _separate_chunk(wav, settings: SeparationSettings, norm: Tuple[float, float]):
+    return _chunk_service.separate_array(wav, settings, norm=norm)
+
+
+class SeparationService:
+    """Keeps one Demucs model resident and separates tracks through the store."""
+
+    def __init__(self, model: str = "htdemucs", device: Optional[str] = None,
+                 threads: Optional[int] = None, workers: Optional[int] = None):
+        import torch
+
+        self.torch = torch
+        self.model_name = model
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        # threads is this process's whole CPU budget; chunk workers share it.
+        self.threads = threads or default_threads()
+        # Chunk-parallel separation only pays off on CPU; a GPU runs chunks in turn.
+        self.workers = min(workers or default_workers(), self.threads) if self.device == "cpu" else 1
+        self.pool = None
+        if self.device == "cpu":
+            torch.set_num_threads(self.threads)
+            try:
+                torch.set_num_interop_threads(max(1, min(4, self.threads // 4)))
+            except RuntimeError:
+                pass  # already fixed once any parallel work has run
+        self.model = None
+
+    def load_model(self):
+        if self.model is None:
+            from demucs.pretrained import get_model
+
+            start = time.time()
+            self.model = get_model(self.model_name)
+            self.model.to(self.device)
+            self.model.eval()
+            logging.info(f"Loaded {self.model_name} on {self.device} in {time.time() - start:.1f}s")
+        return self.model
+
+    def separate_array(self, wav, settings: SeparationSettings,
+                       norm: Optional[Tuple[float, float]] = None):
+        """Separate a (channels, samples) float array at the model sample rate.
+
+        Returns {stem: (channels, samples) ndarray}, using the same
+        normalisation as the demucs CLI. norm overrides the (mean, std) used,
+        so chunks of one track are all normalised like the whole track.
+        """
+        from demucs.apply import apply_model
+
+        model = self.load_model()
+        torch = self.torch
+        mix = torch.as_tensor(wav, dtype=torch.float32)
+        if norm is None:
+            ref = mix.mean(0)
+            norm = (float(ref.mean()), float(ref.std()) + 1e-8)
+        mean, std = norm
+        mix = (mix - mean) / std
+
+        with torch.no_grad():
+            sources = apply_model(model, mix[None], device=self.device, shifts=settings.shifts,
+                                  split=True, overlap=settings.overlap, segment=settings.segment,
+                                  progress=False)[0]
+        sources = sources * std + mean
+
+        return {name: sources[i].cpu().numpy() for i, name in enumerate(model.sources)}
+
+    def _chunk_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            threads = max(1, self.threads // self.workers)
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_chunk_worker,
+                                            initargs=(self.model_name, threads))
+        return self.pool
+
+    def separate_chunked(self, wav, sr: int, settings: SeparationSettings):
+        """Separate overlapping chunks in parallel and overlap-add the stems."""
+        import numpy as np
+
+        n = wav.shape[1]
+        chunk = int(settings.chunk_seconds * sr)
+        overlap = min(int(settings.chunk_overlap * sr), chunk // 2)
+        bounds = chunk_bounds(n, chunk, overlap)
+        ref = wav.mean(0)
+        norm = (float(ref.mean()), float(ref.std()) + 1e-8)
+        logging.info(f"Separating {len(bounds)} chunks of {settings.chunk_seconds:g}s "
+                     f"with {self.workers} worker(s)")
+
+        if self.workers > 1:
+            pool = self._chunk_pool()
+            futures = [pool.submit(_separate_chunk, np.ascontiguousarray(wav[:, a:b]), settings, norm)
+                       for a, b in bounds]
+            parts = (f.result() for f in futures)
+        else:
+            parts = (self.separate_array(wav[:, a:b], settings, norm=norm) for a, b in bounds)
+
+        stems, weight = {}, np.zeros(n, dtype=np.float32)
+        for (a, b), part in zip(bounds, parts):
+            w = crossfade_weights(a, b, n, overlap)
+            weight[a:b] += w
+            for name, audio in part.items():
+                if name not in stems:
+                    stems[name] = np.zeros((audio.shape[0], n), dtype=np.float32)
+                stems[name][:, a:b] += audio * w
+        for audio in stems.values():
+            audio /= np.maximum(weight, 1e-8)
+        return stems
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def separate(self, audio_path, settings: Optional[SeparationSettings] = None,
+                 two_stems: Optional[str] = None) -> Dict[str, str]:
+        """Separate one file, reusing stored stems when they exist (see find_stems for two_stems)."""
+        import numpy as np
+        import soundfile as sf
+
+        from audio_cache import load_audio
+
+        settings = settings or default_settings(self.model_name)
+        cached = find_stems(audio_path, settings, two_stems)
+        if cached:
+            logging.info(f"Reusing stored stems for {Path(audio_path).name}")
+            return cached
+
+        model = self.load_model()
+        start = time.time()
+        y, sr = load_audio(audio_path, sr=model.samplerate, mono=False)
+        wav = np.atleast_2d(np.asarray(y))
+        if wav.shape[0] < model.audio_channels:
+            wav = np.repeat(wav[:1], model.audio_channels, axis=0)
+        wav = wav[:model.audio_channels]
+        if settings.chunk_seconds and wav.shape[1] > settings.chunk_seconds * sr:
+            stems = self.separate_chunked(wav, sr, settings)
+        else:
+            stems = self.separate_array(wav, settings)
+
+        stem_dir = stem_dir_for(audio_path, settings)
+        stem_dir.mkdir(parents=True, exist_ok=True)
+        paths = {}
+        for name, audio in stems.items():
+            path = stem_dir / f"{name}.wav"
+            sf.write(str(path), np.clip(audio.T, -1.0, 1.0), sr, subtype="PCM_16")
+            paths[name] = str(path)
+        # The manifest is written last: its presence marks a complete entry.
+        (stem_dir / STORE_MANIFEST).write_text(json.dumps({
+            "source": str(audio_path), "settings": asdict(settings), "stems": list(stems),
+        }, indent=2))
+
+        logging.info(f"Separated {Path(audio_path).name} in {time.time() - start:.1f}s")
+        return two_stem_paths(stem_dir, paths, two_stems) if two_stems else paths
+
+    def separate_many(self, audio_paths: Iterable, settings: Optional[SeparationSettings] = None,
+                      two_stems: Optional[str] = None) -> Iterator[Tuple[str, Dict[str, str]]]:
+        """Separate a queue of tracks with the one resident model."""
+        for audio_path in audio_paths:
+            try:
+                yield str(audio_path), self.separate(audio_path, settings, two_stems)
+            except Exception as e:
+                logging.warning(f"Separation failed for {audio_path}: {e}")
+                yield str(audio_path), {}
+
+
+_services: Dict[str, SeparationService] = {}
+
+
+def get_service(model: str = "htdemucs", threads: Optional[int] = None) -> SeparationService:
+    """Per-process SeparationService, so repeated calls share the loaded model."""
+    if model not in _services:
+        _services[model] = SeparationService(model, threads=threads)
+    return _services[model]
+
+
+def separate(audio_path, two_stems: Optional[str] = None, model: str = "htdemucs",
+             threads: Optional[int] = None) -> Dict[str, str]:
+    """Store-backed separation; only loads torch when the stems are missing.
+
+    threads caps the CPU threads of this process's service (default: all
+    cores); pool workers that each separate pass their share of the cores.
+    """
+    settings = default_settings(model)
+    return (find_stems(audio_path, settings, two_stems)
+            or get_service(model, threads).separate(audio_path, settings, two_stems))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Separate audio into stems with a resident Demucs model")
+    parser.add_argument("audio_files", nargs="+", help="Audio files to separate")
+    parser.add_argument("-n", "--model", default="htdemucs", help="Demucs model name")
+    parser.add_argument("--two-stems",
+                        help="Return this stem and the sum of the rest (e.g. drums); all stems are stored")
+    parser.add_argument("--shifts", type=int, default=1, help="Random shifts (quality vs. time)")
+    parser.add_argument("--overlap", type=float, default=0.25, help="Overlap between model segments")
+    parser.add_argument("--threads", type=int, help="CPU threads for torch (default: all cores)")
+    parser.add_argument("--chunk-seconds", type=float,
+                        help="Split long inputs into chunks of this length (0 = off)")
+    parser.add_argument("--chunk-overlap", type=float, help="Crossfade overlap between chunks in seconds")
+    parser.add_argument("--workers", type=int, help="Parallel chunk worker processes (CPU only)")
+    parser.add_argument("--json", action="store_true", help="Print {file: {stem: path}} as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s",
+                        stream=sys.stderr)
+    settings = replace(default_settings(args.model),
+                       shifts=args.shifts, overlap=args.overlap)
+    if args.chunk_seconds is not None:
+        settings = replace(settings, chunk_seconds=args.chunk_seconds or None)
+    if args.chunk_overlap is not None:
+        settings = replace(settings, chunk_overlap=args.chunk_overlap)
+
+    results = {}
+    pending = []
+    for path in args.audio_files:
+        cached = find_stems(path, settings, args.two_stems)
+        if cached:
+            results[path] = cached
+        else:
+            pending.append(path)
+    if pending:
+        service = SeparationService(args.model, threads=args.threads, workers=args.workers)
+        try:
+            results.update(service.separate_many(pending, settings, args.two_stems))
+        finally:
+            service.close()
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for path, stems in results.items():
+            print(f"{path}: {', '.join(stems) or 'FAILED'}")
+    sys.exit(0 if all(results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,10 @@
 """
 Song Generator - Generate full songs with intro/verse/chorus/drop structure.
 Uses Strudel's scene switching capabilities.
+
+The structure can also be taken from a real track: pass the JSON written by
+`structure.py --json` (or an analyze_audio.py analysis) with --structure, and
+its sections and their measured layer modifiers replace the genre template.
 """
 
 import json
@@ -129,12 +133,26 @@ SECTION_MODIFIERS = {
 }
 
 
+def load_structure(path: str) -> tuple:
+    """(section names, {name: modifiers}) from structure.py or analyze_audio.py JSON."""
+    data = json.loads(Path(path).read_text())
+    sections = data["sections"] if "sections" in data else data["structure"]
+    modifiers = {}
+    for section in sections:
+        modifiers.setdefault(section["name"], section["modifiers"])
+    return [section["name"] for section in sections], modifiers
+
+
 def generate_section(section_name: str, genre: str, key: str, mode: str,
-                     tempo: int, chord_str: str) -> str:
-    """Generate code for a single section."""
+                     tempo: int, chord_str: str, modifiers: Optional[dict] = None) -> str:
+    """Generate code for a single section.
+
+    modifiers (e.g. measured by structure.py) take precedence over
+    SECTION_MODIFIERS.
+    """
     
     preset = GENRE_PRESETS.get(genre, GENRE_PRESETS["house"])
-    mods = SECTION_MODIFIERS.get(section_name, SECTION_MODIFIERS["verse"])
+    mods = (modifiers or {}).get(section_name) or SECTION_MODIFIERS.get(section_name, SECTION_MODIFIERS["verse"])
     scale = f"{key}:{mode}"
     
     layers = []
@@ -176,8 +194,13 @@ def generate_section(section_name: str, genre: str, key: str, mode: str,
     return code
 
 
-def generate_song(prompt: str) -> dict:
-    """Generate a full song with multiple sections."""
+def generate_song(prompt: str, structure: Optional[list] = None,
+                  modifiers: Optional[dict] = None) -> dict:
+    """Generate a full song with multiple sections.
+
+    structure and modifiers override the genre's SONG_STRUCTURES entry and
+    SECTION_MODIFIERS (see structure.song_structure and load_structure).
+    """
     
     # Parse prompt
     params = parse_prompt(prompt)
@@ -200,7 +223,7 @@ def generate_song(prompt: str) -> dict:
     chord_str = " ".join(chord_names)
     
     # Get song structure
-    structure = SONG_STRUCTURES.get(genre, SONG_STRUCTURES["house"])
+    structure = structure or SONG_STRUCTURES.get(genre, SONG_STRUCTURES["house"])
     
     # Generate sections
     sections = []
@@ -209,7 +232,7 @@ def generate_song(prompt: str) -> dict:
     for section_name in structure:
         if section_name not in seen_sections:
             section_code = generate_section(
-                section_name, genre, key, mode, tempo, chord_str
+                section_name, genre, key, mode, tempo, chord_str, modifiers
             )
             sections.append(section_code)
             seen_sections.add(section_name)
@@ -261,9 +284,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate full songs with structure")
     parser.add_argument("prompt", nargs="?", default="house track",
                         help="Description of the song")
+    parser.add_argument("--structure", metavar="JSON",
+                        help="Sections from structure.py --json or an analyze_audio.py analysis")
     args = parser.parse_args()
     
-    result = generate_song(args.prompt)
+    structure, modifiers = load_structure(args.structure) if args.structure else (None, None)
+    result = generate_song(args.prompt, structure, modifiers)
     
     print(f"\n{'='*60}")
     print(f"Prompt: {result['prompt']}")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Dependency-driven stage scheduler for the analysis pipeline.
+
+Each stage declares the stages it depends on. Stages whose dependencies are
+done are dispatched to a process pool together, so independent work (tempo,
+key, source separation; then the per-stem analysers) runs concurrently and
+per-track latency approaches the critical path.
+
+Arrays produced by a stage are copied once into shared memory and handed to
+dependent stages by name, so worker processes attach to the decoded audio
+instead of re-reading WAVs or pickling large buffers.
+
+Example:
+    stages = [
+        Stage("audio", load, in_process=True),
+        Stage("key", detect, deps=["audio"]),
+    ]
+    results = run_stages(stages, max_workers=4)
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class Stage:
+    """One unit of pipeline work.
+
+    func is called with the results of ``deps`` as keyword arguments (named
+    after the dependency) plus ``kwargs``. in_process stages run in the
+    scheduler process, which suits cheap glue and decoding that feeds shared
+    memory.
+    """
+    name: str
+    func: Callable
+    deps: List[str] = field(default_factory=list)
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    in_process: bool = False
+
+
+@dataclass
+class SharedArray:
+    """Picklable handle to an ndarray living in shared memory."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class SharedArena:
+    """Owns the shared-memory blocks created during one scheduler run."""
+
+    def __init__(self):
+        self.blocks: List[shared_memory.SharedMemory] = []
+
+    def share(self, value):
+        """Replace every ndarray inside value (dicts, lists, tuples) with a SharedArray."""
+        if isinstance(value, np.ndarray):
+            shm = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+            np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+            self.blocks.append(shm)
+            return SharedArray(shm.name, value.shape, value.dtype.str)
+        if isinstance(value, dict):
+            return {k: self.share(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(self.share(v) for v in value)
+        return value
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+
+def _attach(value, opened: List[shared_memory.SharedMemory]):
+    """Inverse of SharedArena.share: map SharedArray handles to ndarray views."""
+    if isinstance(value, SharedArray):
+        shm = shared_memory.SharedMemory(name=value.name)
+        opened.append(shm)
+        return np.ndarray(value.shape, dtype=np.dtype(value.dtype), buffer=shm.buf)
+    if isinstance(value, dict):
+        return {k: _attach(v, opened) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_attach(v, opened) for v in value)
+    return value
+
+
+def _run_stage(func: Callable, kwargs: Dict[str, Any]) -> Tuple[Any, float]:
+    """Worker-side entry point: attach shared inputs, run, detach."""
+    opened: List[shared_memory.SharedMemory] = []
+    start = time.time()
+    try:
+        result = func(**_attach(kwargs, opened))
+    finally:
+        kwargs = None
+        for shm in opened:
+            try:
+                shm.close()
+            except BufferError:
+                # A view escaped into the result; the OS reclaims it on exit.
+                pass
+    return result, time.time() - start
+
+
+def _check_graph(stages: List[Stage]) -> None:
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("duplicate stage names")
+    for stage in stages:
+        missing = [d for d in stage.deps if d not in names]
+        if missing:
+            raise ValueError(f"stage {stage.name!r} depends on unknown stage(s) {missing}")
+
+    # Kahn's algorithm: every stage must become ready eventually.
+    done = set()
+    pending = list(stages)
+    while pending:
+        ready = [s for s in pending if all(d in done for d in s.deps)]
+        if not ready:
+            raise ValueError(f"dependency cycle among {[s.name for s in pending]}")
+        done.update(s.name for s in ready)
+        pending = [s for s in pending if s.name not in done]
+
+
+def run_stages(stages: List[Stage], max_workers: int = 1,
+               initializer: Optional[Callable] = None) -> Dict[str, Any]:
+    """Run stages respecting their dependencies and return {name: result}.
+
+    A stage that raises is logged and yields None; stages depending on it are
+    skipped and also yield None. With max_workers <= 1 everything runs
+    serially in this process, which is what batch mode wants when it already
+    parallelises across files.
+    """
+    _check_graph(stages)
+    results: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+    failed = set()
+
+    def skip_or_kwargs(stage: Stage, shared: Dict[str, Any]):
+        if any(d in failed for d in stage.deps):
+            return None
+        return {**stage.kwargs, **{d: shared[d] for d in stage.deps}}
+
+    if max_workers <= 1:
+        for stage in _topological(stages):
+            kwargs = skip_or_kwargs(stage, results)
+            if kwargs is None:
+                logging.debug(f"Skipping stage {stage.name}: a dependency failed")
+                failed.add(stage.name)
+                results[stage.name] = None
+                continue
+            start = time.time()
+            try:
+                results[stage.name] = stage.func(**kwargs)
+            except Exception as e:
+                logging.warning(f"Stage {stage.name} failed: {e}")
+                failed.add(stage.name)
+                results[stage.name] = None
+            timings[stage.name] = time.time() - start
+        _log_timings(timings)
+        return results
+
+    arena = SharedArena()
+    shared: Dict[str, Any] = {}
+    pending = list(stages)
+    running = {}
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer) as executor:
+            while pending or running:
+                ready = [s for s in pending if all(d in results for d in s.deps)]
+                for stage in ready:
+                    pending.remove(stage)
+                    kwargs = skip_or_kwargs(stage, results if stage.in_process else shared)
+                    if kwargs is None:
+                        logging.debug(f"Skipping stage {stage.name}: a dependency failed")
+                        failed.add(stage.name)
+                        results[stage.name] = shared[stage.name] = None
+                    elif stage.in_process:
+                        start = time.time()
+                        try:
+                            result = stage.func(**kwargs)
+                            results[stage.name] = result
+                            shared[stage.name] = arena.share(result)
+                        except Exception as e:
+                            logging.warning(f"Stage {stage.name} failed: {e}")
+                            failed.add(stage.name)
+                            results[stage.name] = shared[stage.name] = None
+                        timings[stage.name] = time.time() - start
+                    else:
+                        running[executor.submit(_run_stage, stage.func, kwargs)] = stage
+                if ready and not running:
+                    continue  # in-process stages may have unblocked others
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    try:
+                        result, elapsed = future.result()
+                        timings[stage.name] = elapsed
+                        results[stage.name] = result
+                        shared[stage.name] = arena.share(result)
+                    except Exception as e:
+                        logging.warning(f"Stage {stage.name} failed: {e}")
+                        failed.add(stage.name)
+                        results[stage.name] = shared[stage.name] = None
+    finally:
+        arena.close()
+
+    _log_timings(timings)
+    return results
+
+
+def _topological(stages: List[Stage]) -> List[Stage]:
+    ordered, done = [], set()
+    pending = list(stages)
+    while pending:
+        for stage in [s for s in pending if all(d in done for d in s.deps)]:
+            ordered.append(stage)
+            done.add(stage.name)
+            pending.remove(stage)
+    return ordered
+
+
+def _log_timings(timings: Dict[str, float]) -> None:
+    if timings:
+        summary = ", ".join(f"{name}={secs:.1f}s" for name, secs in timings.items())
+        logging.debug(f"Stage timings: {summary}")
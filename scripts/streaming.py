@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Bounded-memory, block-wise feature extraction for long files (DJ mixes).
+
+The in-memory analysers decode the whole file and keep full-resolution
+spectrograms: an hour at 22.05 kHz is ~300 MB of samples and over a
+gigabyte of magnitude STFT. This module decodes and resamples the file
+incrementally and hands the analysers hop-aligned blocks with a few seconds
+of context on either side. Each frame-level feature is computed on the
+block with the usual librosa call (centred frames), and only the frames the
+block owns are kept, so interior frames match the whole-file computation
+and the context absorbs edge effects (CQT filters, HPSS median kernels).
+
+Extractors reduce each block to a few values per frame (band sums, chroma,
+onset strength), and image features can be pooled in time as they
+arrive. Peak memory is one block of audio and its spectrograms plus those
+per-frame summaries, however long the file.
+
+Usage:
+    from streaming import should_stream, stream_features
+    if should_stream(path):
+        frames, duration = stream_features(path, {
+            "onset": lambda y, sr: librosa.onset.onset_strength(y=y, sr=sr),
+            "chroma": lambda y, sr: librosa.feature.chroma_cqt(y=y, sr=sr),
+        })
+
+Environment:
+    MUSICMAN_STREAM_SECONDS   Stream files longer than this (default: 600)
+"""
+
+import logging
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+
+STREAM_SR = 22050
+HOP_LENGTH = 512
+BLOCK_SECONDS = 30.0
+CONTEXT_SECONDS = 3.0  # > half the lowest chroma_cqt filter (~1.6 s) and the HPSS kernel
+STREAM_MIN_SECONDS = 600.0
+
+Extractor = Callable[[np.ndarray, int], np.ndarray]
+
+
+def stream_min_seconds() -> float:
+    return float(os.environ.get("MUSICMAN_STREAM_SECONDS", STREAM_MIN_SECONDS))
+
+
+def file_duration(path) -> Optional[float]:
+    """Duration from the file header, or None if soundfile cannot read it."""
+    import soundfile as sf
+
+    try:
+        return float(sf.info(str(path)).duration)
+    except (RuntimeError, OSError, ValueError):
+        return None
+
+
+def should_stream(path, stream: Optional[bool] = None) -> bool:
+    """Whether to analyse path block-wise: forced by `stream`, else by length.
+
+    Files soundfile cannot decode incrementally always take the in-memory path.
+    """
+    duration = file_duration(path)
+    if duration is None:
+        if stream:
+            logging.warning(f"Cannot stream {path} (unsupported by soundfile); loading it whole")
+        return False
+    return stream if stream is not None else duration > stream_min_seconds()
+
+
+def read_resampled(path, sr: int = STREAM_SR, chunk_seconds: float = BLOCK_SECONDS) -> Iterator[np.ndarray]:
+    """Mono float32 chunks of path at sr, decoded and resampled incrementally.
+
+    Downmixes then resamples with soxr HQ, like librosa.load, so the
+    concatenated chunks equal a whole-file load up to resampler rounding.
+    """
+    import soundfile as sf
+    import soxr
+
+    native_sr = sf.info(str(path)).samplerate
+    resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32", quality="HQ") \
+        if native_sr != sr else None
+    blocksize = max(1, int(chunk_seconds * native_sr))
+    for chunk in sf.blocks(str(path), blocksize=blocksize, dtype="float32", always_2d=True):
+        mono = chunk.mean(axis=1, dtype=np.float32)
+        yield resampler.resample_chunk(mono) if resampler else mono
+    if resampler:
+        yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+
+@dataclass
+class Block:
+    y: np.ndarray      # samples [offset, offset + len(y)), owned span plus context
+    offset: int        # sample index of y[0]
+    start: int         # first owned sample (a multiple of the hop)
+    end: int           # one past the last owned sample
+    final: bool        # last block: also owns the frame centred on the end of the signal
+    hop_length: int = HOP_LENGTH
+
+    @property
+    def first_frame(self) -> int:
+        return self.start // self.hop_length
+
+    @property
+    def n_frames(self) -> int:
+        return self.end // self.hop_length - self.first_frame + (1 if self.final else 0)
+
+    def own(self, X: np.ndarray) -> np.ndarray:
+        """The owned frames of a centred frame-level feature computed on self.y."""
+        skip = (self.start - self.offset) // self.hop_length
+        return np.asarray(X)[..., skip:skip + self.n_frames]
+
+
+def blocks(path, sr: int = STREAM_SR, hop_length: int = HOP_LENGTH, block_seconds: float = BLOCK_SECONDS,
+           context_seconds: float = CONTEXT_SECONDS) -> Iterator[Block]:
+    """Hop-aligned blocks of the resampled signal, each with context on both sides."""
+    block = max(1, int(block_seconds * sr) // hop_length) * hop_length
+    context = int(np.ceil(context_seconds * sr / hop_length)) * hop_length
+
+    source = read_resampled(path, sr)
+    buf = np.zeros(0, dtype=np.float32)
+    buf_offset = 0
+    done = False
+    start = 0
+    while True:
+        need = start + block + context
+        while not done and buf_offset + len(buf) < need:
+            chunk = next(source, None)
+            if chunk is None:
+                done = True
+            else:
+                buf = np.concatenate([buf, chunk])
+        buf_end = buf_offset + len(buf)
+        final = done and buf_end <= start + block
+        end = buf_end if final else start + block
+        lo = max(start - context, 0)
+        y = buf[lo - buf_offset:min(end + context, buf_end) - buf_offset]
+        yield Block(y=y, offset=lo, start=start, end=end, final=final, hop_length=hop_length)
+        if final:
+            return
+        start = end
+        keep_from = max(start - context, 0)
+        buf = buf[keep_from - buf_offset:]
+        buf_offset = keep_from
+
+
+class _Pool:
+    """Pools frames in groups of `size` as they stream in (mean, or any ufunc reduce)."""
+
+    def __init__(self, size: int, reduce: Callable = np.mean):
+        self.size = max(1, int(size))
+        self.reduce = reduce
+        self.pending = None
+        self.out = []
+
+    def add(self, X: np.ndarray) -> None:
+        if self.size == 1:
+            self.out.append(X)
+            return
+        X = X if self.pending is None else np.concatenate([self.pending, X], axis=-1)
+        n = X.shape[-1] // self.size * self.size
+        if n:
+            groups = X[..., :n].reshape(*X.shape[:-1], n // self.size, self.size)
+            self.out.append(self.reduce(groups, axis=-1).astype(np.float32))
+        self.pending = X[..., n:]
+
+    def result(self) -> np.ndarray:
+        if self.pending is not None and self.pending.shape[-1]:
+            self.out.append(self.reduce(self.pending, axis=-1, keepdims=True).astype(np.float32))
+        return np.concatenate(self.out, axis=-1) if self.out else np.zeros(0, dtype=np.float32)
+
+
+def pool_frames(X: np.ndarray, size: int, reduce: Callable = np.mean) -> np.ndarray:
+    """Pool the last axis of X in groups of `size` (the last group may be shorter)."""
+    pool = _Pool(size, reduce)
+    pool.add(np.asarray(X))
+    return pool.result()
+
+
+def stream_features(path, extractors: Dict[str, Extractor], sr: int = STREAM_SR,
+                    hop_length: int = HOP_LENGTH, pool: Optional[Dict[str, Union[int, Tuple]]] = None,
+                    block_seconds: float = BLOCK_SECONDS,
+                    context_seconds: float = CONTEXT_SECONDS) -> Tuple[Dict[str, np.ndarray], float]:
+    """Run every extractor over the file block by block.
+
+    Each extractor maps (block signal, sr) to a centred frame-level array
+    (..., frames) at hop_length, or to a dict of such arrays when several
+    features share intermediates (see feature_plan.block_extractor); each
+    entry is then returned under its own name. Returns the owned frames of
+    every feature concatenated in time and the signal duration in seconds.
+    pool[name] is a group size (mean-pooled) or a (size, reduce) pair such
+    as (8, np.max).
+    """
+    pool = pool or {}
+    pools: Dict[str, _Pool] = {}
+
+    def add(name: str, X: np.ndarray) -> None:
+        if name not in pools:
+            spec = pool.get(name, 1)
+            pools[name] = _Pool(*spec) if isinstance(spec, tuple) else _Pool(spec)
+        pools[name].add(np.asarray(block.own(X), dtype=np.float32))
+
+    n_samples = 0
+    for block in blocks(path, sr, hop_length, block_seconds, context_seconds):
+        for name, extract in extractors.items():
+            X = extract(block.y, sr)
+            for part, values in (X.items() if isinstance(X, dict) else [(name, X)]):
+                add(part, values)
+        n_samples = block.end
+    return {name: p.result() for name, p in pools.items()}, n_samples / sr
+
+
+def frame_peaks(y: np.ndarray, sr: int, hop_length: int = HOP_LENGTH) -> np.ndarray:
+    """(1, frames) peak absolute sample around each centred frame, for waveform plots."""
+    y = np.abs(np.asarray(y))
+    n = 1 + len(y) // hop_length
+    padded = np.zeros(n * hop_length, dtype=y.dtype)
+    start = hop_length // 2
+    padded[start:start + len(y)] = y[:len(padded) - start]
+    return padded.reshape(n, hop_length).max(axis=1)[None, :]
+
+
+def pool_size(duration: float, columns: int, sr: int = STREAM_SR, hop_length: int = HOP_LENGTH) -> int:
+    """Frames per pooled column so a plot of `duration` seconds has about `columns` columns."""
+    frames = int(duration * sr / hop_length) + 1
+    return max(1, -(-frames // columns))
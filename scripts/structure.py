@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Song structure from a beat-synchronous self-similarity matrix.
+
+Each beat of the BeatFeatures tensor becomes one vector (chroma, log drum
+band energy, bass level; each row z-scored), and beats are compared by
+cosine similarity. Section changes are where the music is self-similar
+within a few bars on either side but not across: Foote's checkerboard
+kernel slid along the diagonal of the self-similarity matrix. The kernel
+only reaches NOVELTY_BEATS beats off the diagonal, so only that band is
+built, stored by lag (memory linear in track length), and the kernel sum
+for every beat is one FFT convolution over the band.
+
+Boundaries are the strongest novelty peaks, snapped to the bar lines of the
+mined drum loop; a peak must also clear an absolute novelty floor, so a
+track that never changes stays one section. Sections are labelled by
+comparing their mean vectors: a close match to an earlier section reuses
+its letter (A), a looser one marks a variant (A′), anything else gets a new
+letter. Neighbours that end up with the same letter are merged. Each section also gets a
+role (intro, verse, chorus, buildup, breakdown, outro) and layer modifiers
+measured from its own drums, bass and level, in the shape of
+song_generator.SECTION_MODIFIERS, so a detected structure can be replayed
+by the song generator as it is.
+
+Usage:
+    from structure import detect_sections, song_structure
+    sections = detect_sections(features)             # [Section(start, end, label, role, ...)]
+    names, modifiers = song_structure(sections)      # SONG_STRUCTURES / SECTION_MODIFIERS shapes
+
+    python structure.py track.mp3 [--json]
+"""
+
+import argparse
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from beat_features import STEPS_PER_BEAT, BeatFeatures
+from drum_patterns import mine_loop
+from mix_segmentation import pick_boundaries
+
+BEATS_PER_BAR = 4
+NOVELTY_BEATS = 16        # checkerboard half-width: four bars either side
+MIN_SECTION_BEATS = 16
+PEAK_THRESHOLD = 0.5      # boundaries exceed the mean novelty by this many std devs...
+MIN_NOVELTY = 0.15        # ...and this much unnormalised novelty (a steady loop stays below 0.1)
+SAME_SECTION = 0.8        # cosine of section means: same letter...
+EXACT_SECTION = 0.95      # ...and at or above this, not a variant
+PRIME = "′"
+INTRO_LEVEL = 0.6         # relative level below which the first/last section is an intro/outro
+BREAKDOWN_LEVEL = 0.45
+DRUMS_ACTIVE = 0.25       # drum energy, relative to the track's loud beats, that counts as playing
+DRUMS_PLAYING = 0.5       # fraction of a section's beats that must be playing for it to have drums
+BASS_ACTIVE = 0.3         # bass level relative to the loudest section
+
+
+@dataclass
+class Section:
+    start: float
+    end: float
+    start_beat: int
+    end_beat: int
+    label: str            # A, B, A′ ...
+    role: str             # intro, verse, chorus, buildup, breakdown, outro
+    name: str = ""        # key into song_structure's modifiers (role, role2, ...)
+    level: float = 0.0    # mean drum energy relative to the loudest section
+    novelty: float = 0.0  # boundary strength at the start (0 for the first section)
+    modifiers: Dict = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def to_dict(self) -> Dict:
+        return {**asdict(self), "duration": round(self.duration, 3)}
+
+
+def _unit(X: np.ndarray) -> np.ndarray:
+    return X / np.maximum(np.linalg.norm(X, axis=0, keepdims=True), 1e-9)
+
+
+def _zscore(X: np.ndarray) -> np.ndarray:
+    return (X - X.mean(axis=1, keepdims=True)) / (X.std(axis=1, keepdims=True) + 1e-6)
+
+
+def beat_energy(features: BeatFeatures) -> np.ndarray:
+    """(bands, beats) peak drum band energy in each beat."""
+    if features.band_energy.shape[0] == 0:
+        return np.zeros((0, features.n_beats), dtype=np.float32)
+    return features.band_energy.reshape(-1, features.n_beats, STEPS_PER_BEAT).max(axis=2)
+
+
+def beat_vectors(features: BeatFeatures) -> np.ndarray:
+    """(dims, beats) z-scored chroma, log drum energy and bass level per beat."""
+    rows = [features.chroma, np.log1p(beat_energy(features))]
+    if features.bass_salience.shape[0]:
+        rows.append(np.log1p(features.bass_salience.sum(axis=0, keepdims=True)))
+    X = np.vstack(rows).astype(float)
+    return _zscore(X) if X.shape[0] else np.zeros((1, features.n_beats))
+
+
+def banded_ssm(X: np.ndarray, band: int) -> np.ndarray:
+    """(band, beats) cosine similarity by lag: B[d, i] = sim(beat i, beat i + d)."""
+    U = _unit(X)
+    n = U.shape[1]
+    B = np.zeros((band, n), dtype=np.float32)
+    for d in range(min(band, n)):
+        B[d, :n - d] = np.sum(U[:, :n - d] * U[:, d:], axis=0)
+    return B
+
+
+def checkerboard_kernel(half: int) -> np.ndarray:
+    """(2 half, 2 half) Gaussian-tapered checkerboard, +1 within and -1 across the centre."""
+    offsets = np.arange(-half, half) + 0.5
+    g = np.sign(offsets) * np.exp(-0.5 * (offsets / (half / 2)) ** 2)
+    K = np.outer(g, g)
+    return K / np.abs(K).sum()
+
+
+def novelty_curve(B: np.ndarray, half: int = NOVELTY_BEATS, normalize: bool = True) -> np.ndarray:
+    """Checkerboard novelty at every beat from a banded SSM (needs 2 half lags).
+
+    The kernel is re-indexed by (lag, offset) like the band, so the sum
+    under it at every beat is one 2-D FFT convolution that is "valid" over
+    the lags. Beat t's kernel spans beats [t - half, t + half). With
+    normalize the curve is scaled to a maximum of 1; otherwise it is the
+    kernel sum itself, comparable across tracks (about 0.5 between two
+    unrelated sections).
+    """
+    from scipy.signal import fftconvolve
+
+    band, n = B.shape
+    lags = 2 * half - 1
+    if band < lags + 1:
+        raise ValueError(f"band of {band} lags is too narrow for a half-width of {half}")
+    # Both halves of the symmetric band: row lags + d is lag d in [-lags, lags]
+    full = np.zeros((2 * lags + 1, n + 2 * half), dtype=np.float32)
+    for d in range(-lags, lags + 1):
+        row = B[abs(d)]
+        if d >= 0:
+            full[lags + d, half:half + n] = row
+        else:
+            full[lags + d, half - d:half + n] = row[:n + d]
+
+    K = checkerboard_kernel(half)
+    G = np.zeros((2 * lags + 1, 2 * half))
+    a = np.arange(-half, half)
+    for d in range(-lags, lags + 1):
+        b = a + d
+        ok = (b >= -half) & (b < half)
+        G[lags + d, (a + half)[ok]] = K[(a + half)[ok], (b + half)[ok]]
+
+    novelty = fftconvolve(full, G[::-1, ::-1], mode="valid")[0, :n]
+    novelty = np.maximum(novelty, 0.0)
+    return novelty / (novelty.max() or 1.0) if normalize else novelty
+
+
+def bar_phase(features: BeatFeatures) -> int:
+    """Beats before the first downbeat, from the mined drum loop (0 without drums)."""
+    if features.onset_mask.shape[0] == 0:
+        return 0
+    return mine_loop(features.onset_mask).phase // STEPS_PER_BEAT
+
+
+def snap_to_bars(beats: List[int], phase: int, n_beats: int) -> List[int]:
+    """Move each boundary to the nearest bar line, dropping any that collide."""
+    snapped = []
+    for b in beats:
+        bar = phase + BEATS_PER_BAR * int(round((b - phase) / BEATS_PER_BAR))
+        if 0 < bar < n_beats and (not snapped or bar > snapped[-1]):
+            snapped.append(bar)
+    return snapped
+
+
+def label_sections(X: np.ndarray, bounds: List[int]) -> List[str]:
+    """A/B/A′ labels from the cosine similarity of section mean vectors."""
+    letters: List[Tuple[str, np.ndarray]] = []
+    labels = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        mean = _unit(X[:, lo:hi].mean(axis=1, keepdims=True))[:, 0]
+        sims = [float(mean @ proto) for _, proto in letters]
+        best = int(np.argmax(sims)) if sims else -1
+        if best >= 0 and sims[best] >= SAME_SECTION:
+            labels.append(letters[best][0] + ("" if sims[best] >= EXACT_SECTION else PRIME))
+        else:
+            k = len(letters)
+            letter = chr(ord("A") + k) if k < 26 else f"S{k}"
+            letters.append((letter, mean))
+            labels.append(letter)
+    return labels
+
+
+def merge_repeats(X: np.ndarray, bounds: List[int]) -> Tuple[List[int], List[str]]:
+    """Bounds and labels with neighbouring sections of the same letter (A, A′) merged."""
+    labels = label_sections(X, bounds)
+    while True:
+        base = [label.rstrip(PRIME) for label in labels]
+        keep = [b for i, b in enumerate(bounds[1:-1]) if base[i] != base[i + 1]]
+        if len(keep) == len(bounds) - 2:
+            return bounds, labels
+        bounds = [bounds[0]] + keep + [bounds[-1]]
+        labels = label_sections(X, bounds)
+
+
+def _section_stats(features: BeatFeatures, bounds: List[int]) -> Dict[str, np.ndarray]:
+    """Per-section level, drum activity (fraction of beats playing), bass level,
+    brightness and energy slope."""
+    energy = beat_energy(features)
+    total = energy.sum(axis=0) if energy.shape[0] else np.zeros(features.n_beats)
+    # Sustained tones in a drum band trip the onset picker, so activity is judged on energy
+    loud = np.percentile(total, 95) if len(total) else 0.0
+    hits = total >= DRUMS_ACTIVE * loud if loud > 0 else np.zeros(features.n_beats, dtype=bool)
+    bass = (features.bass_salience.sum(axis=0) if features.bass_salience.shape[0]
+            else total)
+    hihat = energy[features.band("hihat")] if energy.shape[0] > 2 else np.zeros(features.n_beats)
+
+    stats = {name: [] for name in ("level", "drums", "bass", "bright", "slope")}
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        span = total[lo:hi]
+        stats["level"].append(span.mean())
+        stats["drums"].append(hits[lo:hi].mean())
+        stats["bass"].append(bass[lo:hi].mean())
+        stats["bright"].append(hihat[lo:hi].sum() / max(energy[:, lo:hi].sum(), 1e-9)
+                               if energy.shape[0] else 0.0)
+        stats["slope"].append(np.polyfit(np.arange(len(span)), span, 1)[0] if len(span) > 1 else 0.0)
+    stats = {k: np.asarray(v, dtype=float) for k, v in stats.items()}
+    for k in ("level", "bass", "bright"):
+        stats[k] = stats[k] / (stats[k].max() or 1.0)
+    return stats
+
+
+def assign_roles(labels: List[str], stats: Dict[str, np.ndarray]) -> List[str]:
+    """Role of each section from its label, level and position.
+
+    The loudest label (repeated ones first) is the chorus; quiet first and
+    last sections are intro and outro, quiet middle ones breakdowns, and a
+    rising section straight before a chorus is a buildup. Sections where the
+    drums play less than half the time count as quiet whatever their level.
+    """
+    n = len(labels)
+    base = [label.rstrip(PRIME) for label in labels]
+    by_label: Dict[str, List[float]] = {}
+    for label, level in zip(base, stats["level"]):
+        by_label.setdefault(label, []).append(level)
+    chorus = max(by_label, key=lambda k: (len(by_label[k]) > 1, np.mean(by_label[k])))
+
+    roles = []
+    for i in range(n):
+        level = stats["level"][i] if stats["drums"][i] >= DRUMS_PLAYING else 0.0
+        if n > 1 and i == 0 and level < INTRO_LEVEL and base[i] != chorus:
+            roles.append("intro")
+        elif n > 1 and i == n - 1 and level < INTRO_LEVEL and base[i] != chorus:
+            roles.append("outro")
+        elif base[i] == chorus:
+            roles.append("chorus")
+        elif level < BREAKDOWN_LEVEL:
+            roles.append("breakdown")
+        elif i + 1 < n and base[i + 1] == chorus and stats["slope"][i] > 0:
+            roles.append("buildup")
+        else:
+            roles.append("verse")
+    return roles
+
+
+def section_modifiers(role: str, i: int, stats: Dict[str, np.ndarray]) -> Dict:
+    """Layer switches, filter and gain of one section, as in SECTION_MODIFIERS."""
+    bright = stats["bright"][i]
+    if role == "buildup":
+        filt = ".lpf(sine.range(2000,400).slow(8))"
+    elif bright >= 0.8:
+        filt = ""
+    else:
+        filt = f".lpf({int(round(400 + 3600 * bright, -2))})"
+    return {
+        "drums": bool(stats["drums"][i] >= DRUMS_PLAYING),
+        "bass": bool(stats["bass"][i] >= BASS_ACTIVE),
+        "chords": True,
+        "lead": role == "chorus",
+        "filter": filt,
+        "gain": f".gain({0.4 + 0.6 * stats['level'][i]:.1f})",
+    }
+
+
+def detect_sections(features: BeatFeatures, half: int = NOVELTY_BEATS,
+                    min_beats: int = MIN_SECTION_BEATS) -> List[Section]:
+    """Labelled sections of a track from its beat-synchronous features."""
+    n = features.n_beats
+    X = beat_vectors(features)
+    if n < 2 * min_beats:
+        bounds = [0, n]
+        novelty = np.zeros(n)
+    else:
+        raw = novelty_curve(banded_ssm(X, 2 * half), half, normalize=False)
+        peaks = [p for p in pick_boundaries(raw, min_beats, threshold=PEAK_THRESHOLD)
+                 if raw[p] >= MIN_NOVELTY]
+        bounds = [0] + snap_to_bars(peaks, bar_phase(features), n) + [n]
+        novelty = raw / (raw.max() or 1.0)
+
+    bounds, labels = merge_repeats(X, bounds)
+    stats = _section_stats(features, bounds)
+    roles = assign_roles(labels, stats)
+
+    times = np.append(features.beat_times, features.duration)
+    names: Dict[Tuple[str, str], str] = {}
+    per_role: Dict[str, int] = {}
+    sections = []
+    for i, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+        key = (roles[i], labels[i].rstrip(PRIME))
+        if key not in names:
+            per_role[roles[i]] = per_role.get(roles[i], 0) + 1
+            names[key] = roles[i] + (str(per_role[roles[i]]) if per_role[roles[i]] > 1 else "")
+        sections.append(Section(
+            start=round(float(times[lo]), 3) if lo else 0.0, end=round(float(times[hi]), 3), start_beat=int(lo),
+            end_beat=int(hi), label=labels[i], role=roles[i], name=names[key],
+            level=round(float(stats["level"][i]), 3),
+            novelty=round(float(novelty[lo]), 3) if lo else 0.0,
+            modifiers=section_modifiers(roles[i], i, stats)))
+    return sections
+
+
+def song_structure(sections: List[Section]) -> Tuple[List[str], Dict[str, Dict]]:
+    """(section names in order, {name: modifiers}) for song_generator.generate_song."""
+    modifiers: Dict[str, Dict] = {}
+    for section in sections:
+        modifiers.setdefault(section.name, section.modifiers)
+    return [s.name for s in sections], modifiers
+
+
+def main():
+    import librosa
+
+    import streaming
+    import tempo
+    from audio_cache import load_audio
+    from beat_features import beat_features_from_frames, compute_beat_features, drum_energy
+    from chroma import chromagram
+
+    parser = argparse.ArgumentParser(description="Detect labelled song sections")
+    parser.add_argument("audio_file", help="Audio file")
+    parser.add_argument("--json", action="store_true", help="Print {\"sections\": [...]} as JSON")
+    args = parser.parse_args()
+
+    if streaming.should_stream(args.audio_file):
+        sr, hop = streaming.STREAM_SR, streaming.HOP_LENGTH
+        frames, duration = streaming.stream_features(args.audio_file, {
+            "onset": lambda y, sr: librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop),
+            "drums": lambda y, sr: drum_energy(y, sr, hop),
+            "chroma": lambda y, sr: chromagram(y, sr, hop),
+        })
+        grid = tempo.grid_from_envelope(frames["onset"], sr, hop_length=hop)
+        features = beat_features_from_frames(grid.beats, duration, sr, grid.bpm, hop,
+                                             energy=frames["drums"], chroma=frames["chroma"])
+    else:
+        y, sr = load_audio(args.audio_file, sr=22050)
+        grid = tempo.track_beats(args.audio_file, y=y, sr=sr)
+        features = compute_beat_features(grid.beats, len(y) / sr, grid.bpm,
+                                         percussive=(y, sr), harmonic=(y, sr), bass=(y, sr))
+
+    sections = detect_sections(features)
+    if args.json:
+        print(json.dumps({"sections": [s.to_dict() for s in sections]}, indent=2))
+        return
+    for s in sections:
+        print(f"{s.start:7.1f}-{s.end:7.1f}s  {s.label:3s} {s.name:10s} level {s.level:.2f}")
+    names, _ = song_structure(sections)
+    print(f"Structure: {' -> '.join(names)}")
+
+
+if __name__ == "__main__":
+    main()
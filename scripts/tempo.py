@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Tempo and beat tracking shared by every analysis script.
+
+The onset-strength envelope is computed once per decoding and kept in the
+track's feature store (see feature_store.py), and so is the resulting beat
+grid. Each track is therefore beat-tracked at most once however many
+scripts (or stages) ask for its tempo.
+
+Backends:
+    librosa     Dynamic-programming beat tracker on the onset envelope
+    tempogram   Peak of the FFT tempogram plus a phase-aligned regular grid
+                (cheapest; assumes a steady tempo)
+    madmom      RNN beat activations + BeatTrackingProcessor (most robust).
+                Runs on the most rhythmically active excerpt of the track,
+                or on the whole track split into chunks processed in parallel.
+
+Every backend returns a BeatGrid with beat times in seconds and a confidence
+in [0, 1] (pulse clarity: onset-envelope autocorrelation at the beat period).
+
+Usage:
+    from tempo import track_beats
+    grid = track_beats("track.mp3")                           # librosa backend
+    grid = track_beats("track.mp3", backend="madmom", excerpt=60)
+    print(grid.bpm, grid.confidence, grid.beats[:8])
+
+    python tempo.py track.mp3 [--backend tempogram] [--duration 30]
+
+Environment:
+    MUSICMAN_TEMPO_BACKEND   Default backend (default: librosa)
+"""
+
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from audio_cache import load_audio
+from feature_store import FeatureStore
+
+HOP_LENGTH = 512
+MIN_BPM = 60.0
+MAX_BPM = 200.0
+MADMOM_SR = 44100
+MADMOM_FPS = 100
+BACKENDS = ("librosa", "tempogram", "madmom")
+# What madmom raises when it is missing or cannot track the audio; only these fall back to librosa
+MADMOM_FAILURES = (ImportError, ValueError, RuntimeError, OSError)
+TEMPOGRAM_BLOCK = 2048  # envelope frames per tempogram block (~47 s)
+
+
+@dataclass
+class BeatGrid:
+    bpm: float
+    beats: List[float] = field(default_factory=list)
+    confidence: float = 0.0
+    backend: str = "librosa"
+
+    @property
+    def beat_duration(self) -> float:
+        return 60.0 / self.bpm if self.bpm > 0 else 0.5
+
+    def beat_frames(self, sr: float, hop_length: int = HOP_LENGTH) -> np.ndarray:
+        return np.round(np.asarray(self.beats) * sr / hop_length).astype(int)
+
+
+def default_backend() -> str:
+    return os.environ.get("MUSICMAN_TEMPO_BACKEND", "librosa")
+
+
+def _store(audio_path, sr: int, duration: Optional[float]) -> FeatureStore:
+    return FeatureStore(audio_path, sr=int(sr), duration=None if duration is None else float(duration))
+
+
+def onset_envelope(y: Optional[np.ndarray] = None, sr: int = 22050, audio_path=None,
+                   duration: Optional[float] = None, hop_length: int = HOP_LENGTH) -> np.ndarray:
+    """Onset-strength envelope, from the feature store when audio_path is given.
+
+    y may be passed to skip decoding; it must be audio_path decoded at sr
+    (mono, limited to duration seconds).
+    """
+    import librosa
+
+    def compute():
+        signal = y if y is not None else load_audio(audio_path, sr=sr, mono=True, duration=duration)[0]
+        return librosa.onset.onset_strength(y=np.asarray(signal), sr=sr, hop_length=hop_length)
+
+    if audio_path is None:
+        return compute()
+    return _store(audio_path, sr, duration).get_or_compute("onset", {"hop_length": hop_length}, compute)
+
+
+def pulse_clarity(env: np.ndarray, bpm: float, sr: float, hop_length: int = HOP_LENGTH) -> float:
+    """Normalised autocorrelation of the onset envelope at the beat period."""
+    env = np.asarray(env, dtype=float) - np.mean(env)
+    n = len(env)
+    if n < 4 or bpm <= 0 or not np.any(env):
+        return 0.0
+    spec = np.fft.rfft(env, n=2 * n)
+    ac = np.fft.irfft(spec * np.conj(spec))[:n]
+    ac /= ac[0]
+    lag = 60.0 / bpm * sr / hop_length
+    lo, hi = int(np.floor(lag)) - 1, int(np.ceil(lag)) + 2
+    if lo < 1 or hi > n:
+        return 0.0
+    return float(np.clip(ac[lo:hi].max(), 0.0, 1.0))
+
+
+def regular_grid(env: np.ndarray, bpm: float, sr: float, hop_length: int = HOP_LENGTH,
+                 start: float = 0.0, end: Optional[float] = None) -> np.ndarray:
+    """Beat times at a fixed bpm, phase chosen to sit on the strongest onsets."""
+    period = 60.0 / bpm * sr / hop_length
+    n = len(env)
+    phases = np.arange(int(np.ceil(period)))
+    steps = np.arange(int(n / period) + 1)
+    idx = np.rint(phases[:, None] + steps[None, :] * period).astype(int)
+    score = np.where(idx < n, np.asarray(env)[np.minimum(idx, n - 1)], 0.0).sum(axis=1)
+    first = phases[int(np.argmax(score))] * hop_length / sr
+    beat = 60.0 / bpm
+    end = n * hop_length / sr if end is None else end
+    first = first - beat * np.floor((first - start) / beat)
+    return np.arange(first, end, beat)
+
+
+def mean_tempogram(env: np.ndarray, sr: float, hop_length: int = HOP_LENGTH,
+                   win_length: Optional[int] = None, fourier: bool = False,
+                   block: int = TEMPOGRAM_BLOCK) -> np.ndarray:
+    """Time-averaged (autocorrelation or |Fourier|) tempogram of env.
+
+    Computed block by block with win_length // 2 frames of context on each
+    side, so it equals the mean of the whole-envelope tempogram while only
+    one block's tempogram is ever held (an hour is ~155k envelope frames).
+    """
+    import librosa
+
+    env = np.asarray(env, dtype=float)
+    if win_length is None:
+        win_length = 384 if fourier else int(librosa.time_to_frames(8.0, sr=sr, hop_length=hop_length))
+    if fourier:
+        def tempogram(e):
+            return np.abs(librosa.feature.fourier_tempogram(onset_envelope=e, sr=sr, hop_length=hop_length,
+                                                            win_length=win_length))
+    else:
+        def tempogram(e):
+            return librosa.feature.tempogram(onset_envelope=e, sr=sr, hop_length=hop_length,
+                                             win_length=win_length)
+
+    n = len(env)
+    context = win_length // 2 + 1
+    total, count = 0.0, 0
+    for start in range(0, max(n, 1), block):
+        end = min(start + block, n)
+        lo = max(start - context, 0)
+        tg = tempogram(env[lo:min(end + context, n)])
+        # The last block also keeps any trailing frame the whole-envelope transform has
+        own = tg[:, start - lo:] if end == n else tg[:, start - lo:start - lo + end - start]
+        total = total + own.sum(axis=1)
+        count += own.shape[1]
+    return total / max(count, 1)
+
+
+def _librosa_grid(env: np.ndarray, sr: int, hop_length: int) -> BeatGrid:
+    import librosa
+
+    tg = mean_tempogram(env, sr, hop_length)
+    tempo = librosa.feature.tempo(tg=tg[:, None], sr=sr, hop_length=hop_length)
+    tempo, beats = librosa.beat.beat_track(onset_envelope=env, sr=sr, hop_length=hop_length,
+                                           bpm=float(np.atleast_1d(tempo)[0]))
+    bpm = float(np.atleast_1d(tempo)[0])
+    times = librosa.frames_to_time(beats, sr=sr, hop_length=hop_length)
+    return BeatGrid(bpm=bpm, beats=times.tolist(), backend="librosa")
+
+
+def _tempogram_grid(env: np.ndarray, sr: int, hop_length: int, win_length: int = 384) -> BeatGrid:
+    import librosa
+
+    freqs = librosa.fourier_tempo_frequencies(sr=sr, hop_length=hop_length, win_length=win_length)
+    strength = mean_tempogram(env, sr, hop_length, win_length, fourier=True)
+    # Log-normal prior around 120 BPM, like librosa's tempo estimator, against octave errors
+    valid = (freqs >= MIN_BPM) & (freqs <= MAX_BPM)
+    prior = np.exp(-0.5 * np.log2(np.maximum(freqs, 1e-6) / 120.0) ** 2)
+    bpm = float(freqs[np.argmax(np.where(valid, strength * prior, 0.0))])
+    return BeatGrid(bpm=bpm, beats=regular_grid(env, bpm, sr, hop_length).tolist(), backend="tempogram")
+
+
+def grid_from_envelope(env: np.ndarray, sr: int = 22050, backend: Optional[str] = None,
+                       hop_length: int = HOP_LENGTH) -> BeatGrid:
+    """Beat grid from an onset envelope alone (e.g. one built block-wise by streaming).
+
+    madmom needs the audio itself, so it is replaced by librosa here.
+    """
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown tempo backend {backend!r} (use one of {', '.join(BACKENDS)})")
+    grid = _tempogram_grid(env, sr, hop_length) if backend == "tempogram" else _librosa_grid(env, sr, hop_length)
+    grid.confidence = round(pulse_clarity(env, grid.bpm, sr, hop_length), 3)
+    return grid
+
+
+# madmom RNN workers (one processor per process, built on first use)
+_rnn = None
+
+
+def _rnn_activation(y: np.ndarray) -> np.ndarray:
+    global _rnn
+    from madmom.audio.signal import Signal
+    from madmom.features.beats import RNNBeatProcessor
+
+    if _rnn is None:
+        _rnn = RNNBeatProcessor()
+    return _rnn(Signal(np.asarray(y, dtype=np.float32), sample_rate=MADMOM_SR))
+
+
+def best_excerpt(env: np.ndarray, seconds: float, sr: float, hop_length: int = HOP_LENGTH) -> float:
+    """Start time of the window with the most onset energy."""
+    width = int(seconds * sr / hop_length)
+    if width >= len(env):
+        return 0.0
+    cs = np.concatenate([[0.0], np.cumsum(env)])
+    return float(np.argmax(cs[width:] - cs[:-width]) * hop_length / sr)
+
+
+def _madmom_activations(y: np.ndarray, chunk_seconds: Optional[float], overlap: float,
+                        workers: int) -> np.ndarray:
+    """RNN beat activations for y, chunked and run in parallel if chunk_seconds is set."""
+    chunk = int((chunk_seconds or 0) * MADMOM_SR)
+    if not chunk or len(y) <= chunk:
+        return _rnn_activation(y)
+
+    pad = int(overlap * MADMOM_SR)
+    starts = list(range(0, len(y), chunk))
+    pieces = [np.asarray(y[max(0, s - pad):min(len(y), s + chunk + pad)]) for s in starts]
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        acts = list(pool.map(_rnn_activation, pieces))
+
+    # Keep each chunk's own span; the padding only gives the RNN context.
+    trim = int(overlap * MADMOM_FPS)
+    stitched = []
+    for s, act in zip(starts, acts):
+        head = trim if s > 0 else 0
+        own = int(round(min(chunk, len(y) - s) / MADMOM_SR * MADMOM_FPS))
+        stitched.append(act[head:head + own])
+    return np.concatenate(stitched)
+
+
+def _madmom_grid(audio_path, y: Optional[np.ndarray], env: np.ndarray, sr: int, hop_length: int,
+                 duration: Optional[float], excerpt: Optional[float],
+                 chunk_seconds: Optional[float], workers: int) -> BeatGrid:
+    from madmom.features.beats import BeatTrackingProcessor
+
+    if audio_path is not None:
+        y44, _ = load_audio(audio_path, sr=MADMOM_SR, mono=True, duration=duration)
+    else:
+        import librosa
+        y44 = librosa.resample(np.asarray(y), orig_sr=sr, target_sr=MADMOM_SR)
+    total = len(y44) / MADMOM_SR
+
+    offset = 0.0
+    use_excerpt = bool(excerpt) and excerpt < total
+    if use_excerpt:
+        offset = best_excerpt(env, excerpt, sr, hop_length)
+        y44 = y44[int(offset * MADMOM_SR):int((offset + excerpt) * MADMOM_SR)]
+
+    act = _madmom_activations(np.asarray(y44), chunk_seconds, overlap=4.0, workers=workers)
+    beats = np.asarray(BeatTrackingProcessor(fps=MADMOM_FPS)(act)) + offset
+    if len(beats) < 2:
+        raise ValueError("madmom found fewer than two beats")
+    bpm = 60.0 / float(np.median(np.diff(beats)))
+    if use_excerpt:
+        # Excerpt: extend the excerpt's beat phase over the whole track
+        beat = 60.0 / bpm
+        first = beats[0] - beat * np.floor(beats[0] / beat)
+        beats = np.arange(first, total, beat)
+    return BeatGrid(bpm=bpm, beats=beats.tolist(), backend="madmom")
+
+
+def track_beats(audio_path=None, y: Optional[np.ndarray] = None, sr: int = 22050,
+                backend: Optional[str] = None, duration: Optional[float] = None,
+                excerpt: Optional[float] = None, chunk_seconds: Optional[float] = None,
+                workers: int = 1, hop_length: int = HOP_LENGTH,
+                env: Optional[np.ndarray] = None) -> BeatGrid:
+    """Beat grid for a track, from the feature store when it has been tracked before.
+
+    Pass audio_path (and optionally y, the same audio already decoded at sr)
+    to use the store; with only y the grid is computed every time. madmom
+    options: excerpt (seconds of the busiest window to run the RNN on) or
+    chunk_seconds/workers (split the track and run chunks in parallel).
+    env may be y's onset envelope at hop_length, if the caller has it.
+    Falls back to librosa if madmom is not installed or fails on the audio;
+    any other error (a bug here) is raised rather than hidden by the fallback.
+    """
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown tempo backend {backend!r} (use one of {', '.join(BACKENDS)})")
+
+    if audio_path is not None and duration is not None:
+        if y is None:
+            y, sr = load_audio(audio_path, sr=sr, mono=True, duration=duration)
+        if len(y) < int(duration * sr):
+            duration = None  # the whole track; share the full-length cache entry
+
+    store = params = None
+    if audio_path is not None:
+        store = _store(audio_path, sr, duration)
+        params = {"hop_length": hop_length, "backend": backend}
+        if backend == "madmom":
+            params.update(excerpt=excerpt or 0, chunk_seconds=chunk_seconds or 0)
+        beats = store.get("beats", params)
+        if beats is not None:
+            attrs = store.attrs("beats", params)
+            return BeatGrid(bpm=attrs["bpm"], beats=beats.tolist(), confidence=attrs["confidence"],
+                            backend=attrs["backend"])
+
+    if y is None and audio_path is not None:
+        y, sr = load_audio(audio_path, sr=sr, mono=True, duration=duration)
+    if env is None:
+        env = onset_envelope(y, sr, audio_path=audio_path, duration=duration, hop_length=hop_length)
+
+    if backend == "madmom":
+        try:
+            grid = _madmom_grid(audio_path, y, env, sr, hop_length, duration, excerpt,
+                                chunk_seconds, workers)
+        except MADMOM_FAILURES as e:
+            logging.warning(f"madmom beat tracking failed ({type(e).__name__}: {e}), using librosa")
+            return track_beats(audio_path, y, sr, "librosa", duration, hop_length=hop_length,
+                               env=env)
+        grid.confidence = round(pulse_clarity(env, grid.bpm, sr, hop_length), 3)
+    else:
+        grid = grid_from_envelope(env, sr, backend, hop_length)
+
+    if store is not None:
+        store.put("beats", params, np.asarray(grid.beats), dtype=np.float64,
+                  attrs={"bpm": grid.bpm, "confidence": grid.confidence, "backend": grid.backend})
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate tempo and beat grid of audio files")
+    parser.add_argument("audio_files", nargs="+", help="Audio files")
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="Beat tracker (default: $MUSICMAN_TEMPO_BACKEND or librosa)")
+    parser.add_argument("--duration", type=float, default=None, help="Only analyse the first N seconds")
+    parser.add_argument("--excerpt", type=float, default=None,
+                        help="madmom: run the RNN on the busiest N-second window only")
+    parser.add_argument("--chunk-seconds", type=float, default=None,
+                        help="madmom: split the track into chunks of N seconds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="madmom: parallel chunk workers")
+    parser.add_argument("--json", action="store_true", help="Print grids as JSON")
+    args = parser.parse_args()
+
+    grids: Dict[str, dict] = {}
+    for path in args.audio_files:
+        grid = track_beats(path, backend=args.backend, duration=args.duration, excerpt=args.excerpt,
+                           chunk_seconds=args.chunk_seconds, workers=args.workers)
+        grids[path] = asdict(grid)
+        if not args.json:
+            print(f"{path}\t{grid.bpm:.1f} BPM\t{len(grid.beats)} beats\t"
+                  f"confidence {grid.confidence:.2f}\t({grid.backend})")
+    if args.json:
+        print(json.dumps(grids))
+
+
+if __name__ == "__main__":
+    main()